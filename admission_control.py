@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Admission control và load shedding cho Whisper API
+Từ chối sớm (429/503 + Retry-After) thay vì để mọi request xếp hàng vô hạn
+"""
+
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Optional
+
+
+class AdmissionRejected(Exception):
+    """Request bị từ chối bởi admission control"""
+
+    def __init__(self, status_code: int, reason: str, retry_after: float, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = max(1, int(math.ceil(retry_after)))
+        self.detail = detail
+
+
+class TokenBucket:
+    """Token bucket đơn giản cho rate limit theo từng client"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self, now: float) -> float:
+        """
+        Lấy 1 token
+
+        Returns:
+            float: 0 nếu thành công, ngược lại số giây cần chờ để có token
+        """
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class AdmissionTicket:
+    """Thông tin của một request đã được nhận"""
+
+    def __init__(self, client_id: str, audio_seconds: float,
+                 queued_before: float, in_flight_before: int):
+        self.client_id = client_id
+        self.audio_seconds = audio_seconds
+        self.queued_before = queued_before
+        self.in_flight_before = in_flight_before
+        self.admitted_at = time.monotonic()
+
+
+class AdmissionController:
+    """
+    Giới hạn số request đang xử lý, tổng số giây audio đang chờ
+    và tốc độ request của từng client
+
+    Thời gian chờ ước lượng = audio đang chờ * (giây xử lý / giây audio) / concurrency.
+    Tỉ lệ xử lý được cập nhật liên tục (EWMA) từ các request đã hoàn thành.
+    """
+
+    def __init__(self,
+                 max_in_flight: int = 8,
+                 max_queued_audio_seconds: float = 600.0,
+                 client_rate: float = 2.0,
+                 client_burst: float = 10.0,
+                 deadline_seconds: float = 30.0,
+                 concurrency: int = 2,
+                 initial_processing_ratio: float = 0.3,
+                 max_clients: int = 10000,
+                 trusted_proxies: Optional[set] = None):
+        self.max_in_flight = max_in_flight
+        self.max_queued_audio_seconds = max_queued_audio_seconds
+        self.client_rate = client_rate
+        self.client_burst = client_burst
+        self.deadline_seconds = deadline_seconds
+        self.concurrency = max(1, concurrency)
+        self.processing_ratio = initial_processing_ratio
+        self.max_clients = max(1, max_clients)
+        # Chỉ tin header X-Client-ID khi request đi qua các proxy này
+        self.trusted_proxies = set(trusted_proxies or ())
+
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+        self._in_flight = 0
+        self._queued_audio_seconds = 0.0
+        self._latencies = deque(maxlen=1000)
+        self._admitted = 0
+        self._completed = 0
+        self._rejected = {}
+
+    def estimated_wait(self, audio_seconds: float = 0.0) -> float:
+        """Ước lượng thời gian (giây) để xử lý xong nếu nhận thêm audio_seconds"""
+        return (self._queued_audio_seconds + audio_seconds) * self.processing_ratio / self.concurrency
+
+    def _reject(self, status_code: int, reason: str, retry_after: float, detail: str):
+        self._rejected[reason] = self._rejected.get(reason, 0) + 1
+        raise AdmissionRejected(status_code, reason, retry_after, detail)
+
+    def client_id(self, peer: Optional[str], header_client_id: Optional[str] = None) -> str:
+        """
+        Định danh client cho rate limit
+
+        Mặc định là địa chỉ peer; X-Client-ID do client tự gửi nên chỉ được dùng
+        khi peer là proxy tin cậy (ADMISSION_TRUSTED_PROXIES), nếu không client có thể
+        đổi giá trị mỗi request để né rate limit.
+        """
+        peer = peer or "unknown"
+        if header_client_id and peer in self.trusted_proxies:
+            return header_client_id
+        return peer
+
+    def _check_client(self, client_id: str, now: float):
+        bucket = self._buckets.get(client_id)
+        if bucket is None:
+            # Giới hạn memory: bỏ bucket ít dùng gần đây nhất khi đầy
+            while len(self._buckets) >= self.max_clients:
+                self._buckets.popitem(last=False)
+            bucket = TokenBucket(self.client_rate, self.client_burst)
+            self._buckets[client_id] = bucket
+        else:
+            self._buckets.move_to_end(client_id)
+
+        wait = bucket.take(now)
+        if wait > 0:
+            self._reject(429, "client_rate", wait,
+                         "Rate limit exceeded cho client này, vui lòng thử lại sau")
+
+    def admit(self, client_id: str, audio_seconds: float) -> AdmissionTicket:
+        """
+        Quyết định nhận hoặc từ chối một request
+
+        Args:
+            client_id (str): Định danh client (xem client_id())
+            audio_seconds (float): Thời lượng audio ước lượng của request
+
+        Returns:
+            AdmissionTicket: Ticket cần được release() khi request kết thúc
+
+        Raises:
+            AdmissionRejected: Khi request bị từ chối
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._check_client(client_id, now)
+
+            avg_service = self.processing_ratio * max(audio_seconds, 1.0)
+
+            if self._in_flight >= self.max_in_flight:
+                self._reject(503, "max_in_flight", avg_service,
+                             "Server đang quá tải, vui lòng thử lại sau")
+
+            # Server rảnh thì luôn nhận, để request quá lớn nhận lỗi 413 thay vì 503 mãi
+            if self._in_flight > 0 and \
+                    self._queued_audio_seconds + audio_seconds > self.max_queued_audio_seconds:
+                self._reject(503, "max_queued_audio",
+                             self.estimated_wait() - self.deadline_seconds + avg_service,
+                             "Hàng đợi audio đã đầy, vui lòng thử lại sau")
+
+            wait = self.estimated_wait(audio_seconds)
+            if self._in_flight > 0 and wait > self.deadline_seconds:
+                self._reject(503, "deadline", wait - self.deadline_seconds,
+                             f"Thời gian chờ ước lượng ({wait:.1f}s) vượt quá deadline "
+                             f"({self.deadline_seconds:.0f}s)")
+
+            ticket = AdmissionTicket(client_id, audio_seconds,
+                                     self._queued_audio_seconds, self._in_flight)
+            self._in_flight += 1
+            self._queued_audio_seconds += audio_seconds
+            self._admitted += 1
+            return ticket
+
+    def release(self, ticket: AdmissionTicket, success: bool = True):
+        """Giải phóng ticket và cập nhật tỉ lệ xử lý từ latency thực tế"""
+        elapsed = time.monotonic() - ticket.admitted_at
+        with self._lock:
+            self._in_flight -= 1
+            self._queued_audio_seconds = max(0.0, self._queued_audio_seconds - ticket.audio_seconds)
+            self._completed += 1
+            if success:
+                self._latencies.append(elapsed)
+                # Đảo ngược công thức estimated_wait với lượng audio đã chờ trước request này
+                queued = max(ticket.queued_before + ticket.audio_seconds, 1.0)
+                parallel = min(self.concurrency, ticket.in_flight_before + 1)
+                observed = elapsed * parallel / queued
+                self.processing_ratio = 0.8 * self.processing_ratio + 0.2 * observed
+
+    def stats(self) -> dict:
+        """Metrics cho endpoint /metrics"""
+        with self._lock:
+            latencies = sorted(self._latencies)
+
+            def percentile(p):
+                if not latencies:
+                    return None
+                index = min(len(latencies) - 1, int(round(p / 100 * (len(latencies) - 1))))
+                return round(latencies[index], 3)
+
+            return {
+                "in_flight": self._in_flight,
+                "max_in_flight": self.max_in_flight,
+                "queued_audio_seconds": round(self._queued_audio_seconds, 2),
+                "max_queued_audio_seconds": self.max_queued_audio_seconds,
+                "estimated_wait_seconds": round(self.estimated_wait(), 2),
+                "deadline_seconds": self.deadline_seconds,
+                "processing_ratio": round(self.processing_ratio, 4),
+                "admitted": self._admitted,
+                "completed": self._completed,
+                "rejected": dict(self._rejected),
+                "tracked_clients": len(self._buckets),
+                "latency_p50": percentile(50),
+                "latency_p95": percentile(95),
+                "latency_p99": percentile(99),
+            }
+
+
+# Singleton pattern
+_admission_controller = None
+
+
+def get_admission_controller() -> Optional[AdmissionController]:
+    """Get admission controller từ environment variables (None nếu bị tắt)"""
+    global _admission_controller
+    if _admission_controller is None:
+        if os.environ.get('ADMISSION_ENABLED', '1').lower() in ('0', 'false', 'no'):
+            return None
+        _admission_controller = AdmissionController(
+            max_in_flight=int(os.environ.get('ADMISSION_MAX_IN_FLIGHT', 8)),
+            max_queued_audio_seconds=float(os.environ.get('ADMISSION_MAX_QUEUED_AUDIO_SECONDS', 600)),
+            client_rate=float(os.environ.get('ADMISSION_CLIENT_RATE', 2)),
+            client_burst=float(os.environ.get('ADMISSION_CLIENT_BURST', 10)),
+            deadline_seconds=float(os.environ.get('ADMISSION_DEADLINE_SECONDS', 30)),
+            concurrency=int(os.environ.get('ADMISSION_CONCURRENCY', 2)),
+            max_clients=int(os.environ.get('ADMISSION_MAX_CLIENTS', 10000)),
+            trusted_proxies={
+                address.strip()
+                for address in os.environ.get('ADMISSION_TRUSTED_PROXIES', '').split(',')
+                if address.strip()
+            },
+        )
+    return _admission_controller
@@ -5,22 +5,37 @@ Whisper API Server cho Railway deployment
 FastAPI application để cung cấp Speech-to-Text service qua REST API
 """
 
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form
+from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Request, Header, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, FileResponse
+from pydantic import BaseModel, Field
 import uvicorn
 import os
 import tempfile
 import logging
 from typing import Optional
 import asyncio
+import contextlib
 from concurrent.futures import ThreadPoolExecutor
 import time
 
-from lightweight_whisper import get_whisper_service
+from lightweight_whisper import get_whisper_service, is_error_result
+from admission_control import get_admission_controller, AdmissionRejected
+from audio_info import estimate_duration, estimate_duration_from_size
+from scheduler import get_scheduler
+import tracing
+from tracing import span
+from profiling import get_profiling_manager
+from hedging import get_hedged_requester
+from fingerprint_cache import get_fingerprint_cache
+from encoder_cache import encoder_cache_stats
+from decoding_profiles import get_profile_selector, DecodingProfile
+from url_fetch import get_audio_fetcher, AudioFetchError
+from audio_stream import AudioStream, AudioTooLargeError, extension_for_content_type, spool_audio
+from chunked_transcription import IncompleteTranscriptionError, file_sha256
 
-# Setup logging
-logging.basicConfig(level=logging.INFO)
+# Setup logging (structured JSON có trace_id, LOG_FORMAT=text để dùng format cũ)
+tracing.setup_logging(logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Khởi tạo FastAPI app
@@ -32,7 +47,128 @@ app = FastAPI(
     redoc_url="/redoc"
 )
 
-# CORS middleware
+# Global variables
+whisper_model = None
+executor = ThreadPoolExecutor(max_workers=2)
+admission = get_admission_controller()
+scheduler = get_scheduler()
+profiler = get_profiling_manager()
+hedger = get_hedged_requester()
+result_cache = get_fingerprint_cache()
+# Giới hạn số lookup (decode bằng ffmpeg + tính fingerprint) chạy đồng thời trước scheduler
+fingerprint_slots = asyncio.Semaphore(result_cache.workers) if result_cache is not None else None
+profile_selector = get_profile_selector()
+
+# Giới hạn upload và định dạng được hỗ trợ
+MAX_FILE_SIZE = 25 * 1024 * 1024  # 25MB
+ALLOWED_EXTENSIONS = ['.wav', '.mp3', '.flac', '.m4a', '.ogg', '.webm', '.mp4']
+
+# File dài hơn ngưỡng này được transcribe theo chunk có checkpoint (resume khi retry)
+LONG_AUDIO_SECONDS = float(os.environ.get('LONG_AUDIO_SECONDS', 60))
+
+# /transcribe-raw chuyển tiếp body thẳng tới HF API thay vì ghi ra file trước (HF_PASSTHROUGH=1)
+PASSTHROUGH_ENABLED = os.environ.get('HF_PASSTHROUGH', '0').lower() in ('1', 'true', 'yes')
+# Số upload pass-through đồng thời; khi đủ, request mới đi đường ghi file tạm
+passthrough_uploads = asyncio.Semaphore(int(os.environ.get('HF_PASSTHROUGH_MAX_UPLOADS', 8)))
+
+# Thời lượng giả định khi request không có Content-Length
+UNKNOWN_AUDIO_SECONDS = float(os.environ.get('ADMISSION_UNKNOWN_AUDIO_SECONDS', 30))
+
+@app.middleware("http")
+async def admission_middleware(request: Request, call_next):
+    """
+    Admission control cho các endpoint transcribe
+
+    Chạy trước khi body được đọc nên request bị từ chối không tốn
+    bộ nhớ buffer upload. Thời lượng audio được ước lượng từ Content-Length
+    (request JSON như /transcribe-url dùng giá trị mặc định).
+    """
+    if admission is None or request.method != "POST" or not request.url.path.startswith("/transcribe"):
+        return await call_next(request)
+
+    client_id = admission.client_id(
+        request.client.host if request.client else None,
+        request.headers.get("x-client-id")
+    )
+    content_length = request.headers.get("content-length")
+    is_json = request.headers.get("content-type", "").startswith("application/json")
+    if content_length and content_length.isdigit() and not is_json:
+        audio_seconds = estimate_duration_from_size(int(content_length))
+    else:
+        audio_seconds = UNKNOWN_AUDIO_SECONDS
+
+    try:
+        ticket = admission.admit(client_id, audio_seconds)
+    except AdmissionRejected as e:
+        logger.warning(f"Từ chối request từ {client_id}: {e.reason}")
+        return JSONResponse(
+            status_code=e.status_code,
+            content={"detail": e.detail, "reason": e.reason},
+            headers={"Retry-After": str(e.retry_after)}
+        )
+
+    success = False
+    try:
+        response = await call_next(request)
+        success = response.status_code < 500
+        return response
+    finally:
+        admission.release(ticket, success=success)
+
+@app.middleware("http")
+async def profiling_middleware(request: Request, call_next):
+    """
+    Profile request được gắn cờ (X-Profile: 1 + X-Profiling-Token) hoặc được lấy mẫu
+
+    Khi PROFILING_ENABLED tắt, middleware chỉ chuyển tiếp request.
+    """
+    if profiler is None or not profiler.should_profile(
+            request.headers.get("x-profile"), request.headers.get("x-profiling-token")):
+        return await call_next(request)
+
+    session = profiler.begin(tracing.current_trace_id())
+    if session is None:
+        return await call_next(request)
+
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        response.headers["X-Profile-Id"] = session.profile_id
+        return response
+    finally:
+        profiler.end(session, f"{request.method} {request.url.path} {status_code}")
+        logger.info(f"Đã lưu profile {session.profile_id}", extra={"fields": {"profile_files": session.files}})
+
+@app.middleware("http")
+async def tracing_middleware(request: Request, call_next):
+    """
+    Gán trace id cho mỗi request (từ X-Request-ID/traceparent hoặc tạo mới)
+
+    Bọc ngoài admission control để cả request bị từ chối cũng có trace id.
+    """
+    trace = tracing.start_trace(tracing.extract_trace_id(request.headers))
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        response.headers["X-Request-ID"] = trace.trace_id
+        return response
+    finally:
+        trace.finish()
+        summary = trace.to_dict()
+        logger.info(
+            f"{request.method} {request.url.path} {status_code} {summary['total_ms']}ms",
+            extra={"fields": {
+                "method": request.method,
+                "path": request.url.path,
+                "status_code": status_code,
+                "duration_ms": summary["total_ms"],
+                "spans": summary["spans"],
+            }}
+        )
+
+# CORS middleware (thêm sau cùng để bọc ngoài, response 429/503 vẫn có CORS headers)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # Trong production nên giới hạn origins cụ thể
@@ -41,10 +177,6 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Global variables
-whisper_model = None
-executor = ThreadPoolExecutor(max_workers=2)
-
 def initialize_whisper():
     """Khởi tạo lightweight Whisper service"""
     global whisper_model
@@ -67,6 +199,15 @@ async def startup_event():
     if not success:
         logger.error("Không thể khởi tạo Whisper model!")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Đóng connection pool của URL fetcher và HF API, lưu fingerprint cache"""
+    await get_audio_fetcher().close()
+    if result_cache is not None:
+        result_cache.save()
+    if hasattr(whisper_model, "close"):
+        await whisper_model.close()
+
 @app.get("/")
 async def root():
     """Root endpoint với thông tin cơ bản"""
@@ -100,18 +241,188 @@ async def health_check():
         "timestamp": time.time()
     }
 
+def choose_profile(audio_duration: float, profile: Optional[str], deadline_ms: Optional[int]):
+    """
+    Chọn decoding profile cho request (None nếu client không gửi profile/deadline)
+
+    Budget còn lại = deadline - thời gian đã dùng (upload, ...) - thời gian chờ scheduler dự kiến.
+    """
+    if profile is None and deadline_ms is None:
+        return None
+    try:
+        return profile_selector.choose(
+            audio_duration,
+            profile=profile,
+            deadline_seconds=deadline_ms / 1000 if deadline_ms is not None else None,
+            elapsed_seconds=tracing.elapsed_since_start(),
+            wait_seconds=scheduler.expected_wait()
+        )
+    except KeyError:
+        raise HTTPException(
+            status_code=422,
+            detail=f"Profile không tồn tại. Các profile: {', '.join(profile_selector.profiles)}"
+        )
+
+async def run_transcription(audio_path: str, audio_duration: float, language: Optional[str],
+                            task: str, priority: int, audio_sha256: Optional[str] = None,
+                            profile: Optional[str] = None, deadline_ms: Optional[int] = None) -> tuple:
+    """
+    Chạy transcription qua cache (nếu bật) và scheduler
+
+    Khi có profile hoặc deadline_ms, cấu hình decode được chọn theo latency model
+    và response có thêm field "decoding" (profile đã chọn, deadline_met).
+
+    Returns:
+        tuple: (transcription, processing_time, details) với details là các field
+        thêm vào response ("cache" khi lấy từ cache, "chunks" khi chạy theo chunk)
+    """
+    choice = choose_profile(audio_duration, profile, deadline_ms)
+    decoding_profile = choice.profile if choice is not None else None
+
+    lookup = None
+    if result_cache is not None:
+        start_time = time.time()
+        params = f"{getattr(whisper_model, 'model', '')}|{language}|{task}"
+        if decoding_profile is not None and decoding_profile.name != profile_selector.default:
+            params = f"{decoding_profile.model}|{language}|{task}|{decoding_profile.name}"
+        with span("cache_lookup"):
+            async with fingerprint_slots:
+                if audio_sha256 is None:
+                    audio_sha256 = await asyncio.to_thread(file_sha256, audio_path)
+                lookup = await asyncio.to_thread(
+                    result_cache.lookup, audio_path, audio_sha256, params, audio_duration
+                )
+        if lookup.text is not None:
+            details = {"cache": {"match": lookup.match, "similarity": lookup.similarity}}
+            if choice is not None:
+                details["decoding"] = choice.report(tracing.elapsed_since_start())
+            return lookup.text, time.time() - start_time, details
+
+    transcription, processing_time, details = await transcribe_scheduled(
+        audio_path, audio_duration, language, task, priority, audio_sha256, decoding_profile
+    )
+    if lookup is not None and not is_error_result(transcription):
+        await asyncio.to_thread(result_cache.store, lookup, transcription)
+
+    if choice is not None:
+        elapsed = tracing.elapsed_since_start()
+        # Chunk lấy lại từ checkpoint làm latency thấp hơn thực tế, không dùng để calibrate
+        if not is_error_result(transcription) and not details.get("chunks", {}).get("chunks_reused"):
+            profile_selector.record(choice, audio_duration, processing_time, elapsed)
+        details["decoding"] = choice.report(elapsed)
+    return transcription, processing_time, details
+
+async def transcribe_scheduled(audio_path: str, audio_duration: float, language: Optional[str],
+                               task: str, priority: int, audio_sha256: Optional[str] = None,
+                               profile: Optional[DecodingProfile] = None) -> tuple:
+    """
+    Chạy transcription qua scheduler
+
+    File dài (>= LONG_AUDIO_SECONDS) được xử lý theo chunk có checkpoint nếu
+    backend hỗ trợ; khi một chunk lỗi, client nhận 503 và lần retry chỉ xử lý
+    các chunk còn thiếu.
+
+    Returns:
+        tuple: (transcription, processing_time, details)
+    """
+    # Chỉ truyền profile khi có, để backend không hỗ trợ profile vẫn chạy như cũ
+    profile_kwargs = {"profile": profile} if profile is not None else {}
+
+    async with scheduler.slot(audio_duration, priority):
+        with span("transcribe"):
+            start_time = time.time()
+
+            if audio_duration >= LONG_AUDIO_SECONDS and hasattr(whisper_model, "transcribe_resumable"):
+                if audio_sha256 is None:
+                    audio_sha256 = await asyncio.to_thread(file_sha256, audio_path)
+                try:
+                    outcome = await whisper_model.transcribe_resumable(
+                        audio_path, audio_sha256, language=language, task=task, **profile_kwargs
+                    )
+                except IncompleteTranscriptionError as e:
+                    logger.warning(f"Transcription dở dang: {e}")
+                    raise HTTPException(
+                        status_code=503,
+                        detail=f"{e}. Gửi lại request để tiếp tục từ chunk còn thiếu",
+                        headers={"Retry-After": "30"}
+                    )
+                if outcome is not None:
+                    chunks = {key: outcome[key] for key in ("chunks_total", "chunks_reused", "chunks_processed")}
+                    return outcome["text"], time.time() - start_time, {"chunks": chunks}
+
+            transcription = await whisper_model.transcribe(audio_path, language=language, task=task, **profile_kwargs)
+            return transcription, time.time() - start_time, {}
+
+async def transcribe_passthrough(stream: AudioStream, language: Optional[str], task: str, priority: int,
+                                 profile: Optional[str] = None, deadline_ms: Optional[int] = None) -> tuple:
+    """
+    Transcribe qua pass-through: chuyển tiếp body tới backend trong lúc client còn upload
+
+    Thời lượng được ước lượng từ header ở chunk đầu và Content-Length. Upload của client
+    không giữ slot của scheduler: chunk cuối được giữ lại tới khi có slot (HF API chỉ bắt
+    đầu xử lý khi nhận đủ body), nên client upload chậm không chặn các job khác.
+    processing_time tính từ lúc có slot, không gồm thời gian upload.
+
+    Returns:
+        tuple: (transcription, processing_time, details)
+    """
+    choice = choose_profile(stream.duration, profile, deadline_ms)
+    profile_kwargs = {"profile": choice.profile} if choice is not None else {}
+    slot_start = None
+
+    async with contextlib.AsyncExitStack() as stack:
+        async def gated_stream():
+            nonlocal slot_start
+            held = None
+            async for chunk in stream:
+                if held is not None:
+                    yield held
+                held = chunk
+            # Upload xong, thời lượng lúc này tính theo kích thước thực
+            await stack.enter_async_context(scheduler.slot(stream.duration, priority))
+            slot_start = time.time()
+            if held is not None:
+                yield held
+
+        with span("transcribe"):
+            transcription = await whisper_model.transcribe_stream(
+                gated_stream(), language=language, task=task, size=stream.expected_size, **profile_kwargs
+            )
+        # Upstream lỗi trước khi nhận hết body thì không có thời gian xử lý
+        processing_time = time.time() - slot_start if slot_start is not None else 0.0
+
+    details = {"passthrough": True}
+    if choice is not None:
+        elapsed = tracing.elapsed_since_start()
+        if not is_error_result(transcription) and slot_start is not None:
+            profile_selector.record(choice, stream.duration, processing_time, elapsed)
+        details["decoding"] = choice.report(elapsed)
+    return transcription, processing_time, details
+
 @app.post("/transcribe")
 async def transcribe_audio(
     file: UploadFile = File(..., description="File audio để transcribe"),
-    language: Optional[str] = Form(None, description="Mã ngôn ngữ (vi, en, fr, etc.)")
+    language: Optional[str] = Form(None, description="Mã ngôn ngữ (vi, en, fr, etc.)"),
+    task: str = Form("transcribe", pattern="^(transcribe|translate)$", description="transcribe hoặc translate (dịch sang tiếng Anh)"),
+    priority: int = Form(0, ge=-10, le=10, description="Độ ưu tiên (lớn hơn = xử lý sớm hơn)"),
+    profile: Optional[str] = Form(None, description="Decoding profile (accurate, balanced, fast)"),
+    deadline_ms: Optional[int] = Form(None, gt=0, description="Latency budget (ms), server chọn profile phù hợp"),
+    timings: bool = False
 ):
     """
     Transcribe file audio thành text
 
     - **file**: File audio (wav, mp3, flac, m4a, ogg, etc.)
-    - **language**: Mã ngôn ngữ (tùy chọn, ví dụ: 'vi' cho tiếng Việt)
+    - **language**: Mã ngôn ngữ (tùy chọn, ví dụ: 'vi' cho tiếng Việt). Nên chỉ định để bỏ qua bước language detection
+    - **task**: 'transcribe' (mặc định) hoặc 'translate'
+    - **priority**: Độ ưu tiên từ -10 đến 10 (tùy chọn, mặc định 0)
+    - **profile**: Decoding profile (tùy chọn): 'accurate', 'balanced' (mặc định) hoặc 'fast'
+    - **deadline_ms**: Latency budget (tùy chọn); server chọn profile chính xác nhất vẫn kịp deadline
+      và trả về profile đã chọn cùng `deadline_met` trong field `decoding`
+    - **timings**: Query param, `?timings=true` để trả về thời gian từng giai đoạn
     """
     global whisper_model
+    tracing.record_since_start("upload_parse")
 
     if whisper_model is None:
         raise HTTPException(
@@ -120,47 +431,59 @@ async def transcribe_audio(
         )
 
     # Kiểm tra định dạng file
-    allowed_extensions = ['.wav', '.mp3', '.flac', '.m4a', '.ogg', '.webm', '.mp4']
     file_extension = os.path.splitext(file.filename)[1].lower()
 
-    if file_extension not in allowed_extensions:
+    if file_extension not in ALLOWED_EXTENSIONS:
         raise HTTPException(
             status_code=400,
-            detail=f"Định dạng file không được hỗ trợ. Các định dạng được hỗ trợ: {', '.join(allowed_extensions)}"
+            detail=f"Định dạng file không được hỗ trợ. Các định dạng được hỗ trợ: {', '.join(ALLOWED_EXTENSIONS)}"
         )
 
     # Kiểm tra kích thước file (giới hạn 25MB)
-    max_size = 25 * 1024 * 1024  # 25MB
-    file_content = await file.read()
+    with span("upload_read"):
+        file_content = await file.read()
 
-    if len(file_content) > max_size:
+    if len(file_content) > MAX_FILE_SIZE:
         raise HTTPException(
             status_code=413,
             detail="File quá lớn. Kích thước tối đa là 25MB"
         )
+    if not file_content:
+        raise HTTPException(status_code=400, detail="File rỗng")
 
     try:
         # Tạo file tạm thời
-        with tempfile.NamedTemporaryFile(delete=False, suffix=file_extension) as temp_file:
-            temp_file.write(file_content)
-            temp_file_path = temp_file.name
+        with span("temp_file_write"):
+            with tempfile.NamedTemporaryFile(delete=False, suffix=file_extension) as temp_file:
+                temp_file.write(file_content)
+                temp_file_path = temp_file.name
 
-                # Thực hiện transcription với async
-        start_time = time.time()
-        transcription = await whisper_model.transcribe(temp_file_path, language=language)
-        processing_time = time.time() - start_time
+        # Thực hiện transcription, job ngắn được scheduler ưu tiên chạy trước
+        audio_duration = estimate_duration(file_content, file_extension)
+        transcription, processing_time, details = await run_transcription(
+            temp_file_path, audio_duration, language, task, priority,
+            profile=profile, deadline_ms=deadline_ms
+        )
 
         # Xóa file tạm thời
-        os.unlink(temp_file_path)
+        with span("temp_file_cleanup"):
+            os.unlink(temp_file_path)
 
-        return {
+        result = {
             "transcription": transcription,
             "filename": file.filename,
             "language": language,
+            "task": task,
             "processing_time": round(processing_time, 2),
             "file_size": len(file_content),
+            "audio_duration": round(audio_duration, 2),
+            "trace_id": tracing.current_trace_id(),
             "timestamp": time.time()
         }
+        result.update(details)
+        if timings:
+            result["timings"] = tracing.current_trace().to_dict()
+        return result
 
     except Exception as e:
         # Đảm bảo xóa file tạm thời nếu có lỗi
@@ -170,6 +493,9 @@ async def transcribe_audio(
             except:
                 pass
 
+        if isinstance(e, HTTPException):
+            raise
+
         logger.error(f"Lỗi khi transcribe: {e}")
         raise HTTPException(
             status_code=500,
@@ -179,12 +505,20 @@ async def transcribe_audio(
 @app.post("/transcribe-batch")
 async def transcribe_batch(
     files: list[UploadFile] = File(..., description="Danh sách file audio"),
-    language: Optional[str] = Form(None, description="Mã ngôn ngữ")
+    language: Optional[str] = Form(None, description="Mã ngôn ngữ"),
+    task: str = Form("transcribe", pattern="^(transcribe|translate)$", description="transcribe hoặc translate"),
+    priority: int = Form(0, ge=-10, le=10, description="Độ ưu tiên (lớn hơn = xử lý sớm hơn)"),
+    profile: Optional[str] = Form(None, description="Decoding profile (accurate, balanced, fast)"),
+    deadline_ms: Optional[int] = Form(None, gt=0, description="Latency budget (ms) cho mỗi file"),
+    timings: bool = False
 ):
     """
     Transcribe nhiều file audio cùng lúc
+
+    Mỗi file là một job riêng trong scheduler, file ngắn được xử lý trước.
     """
     global whisper_model
+    tracing.record_since_start("upload_parse")
 
     if whisper_model is None:
         raise HTTPException(
@@ -204,10 +538,11 @@ async def transcribe_batch(
     try:
         # Chuẩn bị tất cả file tạm thời
         for file in files:
-            file_content = await file.read()
+            with span("upload_read"):
+                file_content = await file.read()
 
             # Kiểm tra kích thước
-            if len(file_content) > 25 * 1024 * 1024:
+            if len(file_content) > MAX_FILE_SIZE:
                 raise HTTPException(
                     status_code=413,
                     detail=f"File {file.filename} quá lớn (>25MB)"
@@ -215,50 +550,65 @@ async def transcribe_batch(
 
             # Tạo file tạm thời
             file_extension = os.path.splitext(file.filename)[1].lower()
-            temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=file_extension)
-            temp_file.write(file_content)
-            temp_file.close()
+            with span("temp_file_write"):
+                temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=file_extension)
+                temp_file.write(file_content)
+                temp_file.close()
 
             temp_files.append({
                 'path': temp_file.name,
                 'filename': file.filename,
-                'size': len(file_content)
+                'size': len(file_content),
+                'duration': estimate_duration(file_content, file_extension)
             })
 
-                # Thực hiện transcription batch với async
+        # Thực hiện transcription batch, các file được xếp lịch độc lập
         start_time = time.time()
 
-        batch_results = []
-        for temp_file_info in temp_files:
+        async def transcribe_one(temp_file_info):
             try:
-                transcription = await whisper_model.transcribe(
-                    temp_file_info['path'],
-                    language=language
+                transcription, _, details = await run_transcription(
+                    temp_file_info['path'], temp_file_info['duration'], language, task, priority,
+                    profile=profile, deadline_ms=deadline_ms
                 )
-                batch_results.append({
+                item = {
                     "filename": temp_file_info['filename'],
                     "transcription": transcription,
                     "file_size": temp_file_info['size'],
+                    "audio_duration": round(temp_file_info['duration'], 2),
                     "success": True
-                })
+                }
+                item.update(details)
+                return item
+            except HTTPException as e:
+                return {
+                    "filename": temp_file_info['filename'],
+                    "error": e.detail,
+                    "success": False
+                }
             except Exception as e:
-                batch_results.append({
+                return {
                     "filename": temp_file_info['filename'],
                     "error": str(e),
                     "success": False
-                })
+                }
 
-        results = batch_results
+        results = await asyncio.gather(*(transcribe_one(info) for info in temp_files))
 
         processing_time = time.time() - start_time
 
-        return {
+        result = {
             "results": results,
             "total_files": len(files),
             "processing_time": round(processing_time, 2),
             "language": language,
+            "task": task,
+            "trace_id": tracing.current_trace_id(),
             "timestamp": time.time()
         }
+        if timings:
+            result["timings"] = tracing.current_trace().to_dict()
+        return result
 
     except Exception as e:
         logger.error(f"Lỗi batch transcription: {e}")
@@ -275,6 +625,364 @@ async def transcribe_batch(
             except:
                 pass
 
+@app.post("/transcribe-raw")
+async def transcribe_raw(
+    request: Request,
+    language: Optional[str] = Query(None, description="Mã ngôn ngữ (hoặc header X-Language)"),
+    task: Optional[str] = Query(None, pattern="^(transcribe|translate)$", description="transcribe hoặc translate (hoặc header X-Task)"),
+    priority: Optional[int] = Query(None, ge=-10, le=10, description="Độ ưu tiên (hoặc header X-Priority)"),
+    filename: Optional[str] = Query(None, description="Tên file gốc (hoặc header X-Filename)"),
+    profile: Optional[str] = Query(None, description="Decoding profile (hoặc header X-Decoding-Profile)"),
+    deadline_ms: Optional[int] = Query(None, gt=0, description="Latency budget ms (hoặc header X-Deadline-Ms)"),
+    timings: bool = False
+):
+    """
+    Transcribe audio gửi trực tiếp trong request body (không dùng multipart)
+
+    Content-Type: `application/octet-stream` hoặc `audio/*`. Body được stream vào
+    file tạm theo từng chunk, bỏ qua bước parse multipart và bản copy spooled của UploadFile.
+
+    Với HF_PASSTHROUGH=1, body được chuyển tiếp thẳng tới HF API ngay khi chunk đầu tới
+    (trừ file dài cần chia chunk và khi bật fingerprint cache, vì cả hai cần file hoàn chỉnh).
+    """
+    if whisper_model is None:
+        raise HTTPException(
+            status_code=503,
+            detail="Whisper model chưa được khởi tạo"
+        )
+
+    content_type = request.headers.get("content-type", "application/octet-stream")
+    mime = content_type.split(";")[0].strip().lower()
+    if mime != "application/octet-stream" and not mime.startswith("audio/") and mime != "video/mp4":
+        raise HTTPException(
+            status_code=415,
+            detail="Content-Type phải là application/octet-stream hoặc audio/*"
+        )
+
+    # Query param được ưu tiên, header là phương án thay thế
+    language = language or request.headers.get("x-language")
+    task = task or request.headers.get("x-task") or "transcribe"
+    filename = filename or request.headers.get("x-filename")
+    profile = profile or request.headers.get("x-decoding-profile")
+    if task not in ("transcribe", "translate"):
+        raise HTTPException(status_code=422, detail="task phải là 'transcribe' hoặc 'translate'")
+    if priority is None:
+        try:
+            priority = max(-10, min(10, int(request.headers.get("x-priority", 0))))
+        except ValueError:
+            raise HTTPException(status_code=422, detail="X-Priority phải là số nguyên")
+    if deadline_ms is None and request.headers.get("x-deadline-ms"):
+        try:
+            deadline_ms = int(request.headers["x-deadline-ms"])
+        except ValueError:
+            raise HTTPException(status_code=422, detail="X-Deadline-Ms phải là số nguyên")
+        if deadline_ms <= 0:
+            raise HTTPException(status_code=422, detail="X-Deadline-Ms phải lớn hơn 0")
+
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > MAX_FILE_SIZE:
+        raise HTTPException(
+            status_code=413,
+            detail="File quá lớn. Kích thước tối đa là 25MB"
+        )
+    if content_length and content_length.isdigit() and int(content_length) == 0:
+        raise HTTPException(status_code=400, detail="File rỗng")
+
+    extension = os.path.splitext(filename)[1].lower() if filename else extension_for_content_type(mime)
+    expected_size = int(content_length) if content_length and content_length.isdigit() else None
+    # Không có Content-Length (chunked) thì không biết file có dài không: ghi file tạm để
+    # file dài vẫn đi đường chia chunk có checkpoint
+    if (PASSTHROUGH_ENABLED and hasattr(whisper_model, "transcribe_stream") and result_cache is None
+            and expected_size is not None
+            and estimate_duration_from_size(expected_size, extension) < LONG_AUDIO_SECONDS
+            and not passthrough_uploads.locked()):
+        return await transcribe_raw_passthrough(
+            request, extension, expected_size, filename, language, task, priority, profile, deadline_ms, timings
+        )
+
+    try:
+        with span("body_stream"):
+            audio = await spool_audio(request.stream(), extension, MAX_FILE_SIZE, filename=filename)
+    except AudioTooLargeError:
+        raise HTTPException(
+            status_code=413,
+            detail="File quá lớn. Kích thước tối đa là 25MB"
+        )
+
+    try:
+        if audio.size == 0:
+            raise HTTPException(status_code=400, detail="File rỗng")
+        if audio.extension not in ALLOWED_EXTENSIONS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Định dạng file không được hỗ trợ. Các định dạng được hỗ trợ: {', '.join(ALLOWED_EXTENSIONS)}"
+            )
+
+        transcription, processing_time, details = await run_transcription(
+            audio.path, audio.duration, language, task, priority, audio.sha256,
+            profile=profile, deadline_ms=deadline_ms
+        )
+
+        result = {
+            "transcription": transcription,
+            "filename": audio.filename,
+            "language": language,
+            "task": task,
+            "processing_time": round(processing_time, 2),
+            "file_size": audio.size,
+            "audio_duration": round(audio.duration, 2),
+            "audio_sha256": audio.sha256,
+            "trace_id": tracing.current_trace_id(),
+            "timestamp": time.time()
+        }
+        result.update(details)
+        if timings:
+            result["timings"] = tracing.current_trace().to_dict()
+        return result
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Lỗi khi transcribe raw body: {e}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Lỗi khi xử lý audio: {str(e)}"
+        )
+
+    finally:
+        audio.cleanup()
+
+async def transcribe_raw_passthrough(request: Request, extension: str, expected_size: Optional[int],
+                                     filename: Optional[str], language: Optional[str], task: str, priority: int,
+                                     profile: Optional[str], deadline_ms: Optional[int], timings: bool) -> dict:
+    """Phần pass-through của /transcribe-raw"""
+    stream = AudioStream(request.stream(), extension, MAX_FILE_SIZE,
+                         filename=filename, expected_size=expected_size)
+    try:
+        async with passthrough_uploads:
+            with span("body_first_chunk"):
+                await stream.start()
+            if stream.size == 0:
+                raise HTTPException(status_code=400, detail="File rỗng")
+            if stream.extension not in ALLOWED_EXTENSIONS:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Định dạng file không được hỗ trợ. Các định dạng được hỗ trợ: {', '.join(ALLOWED_EXTENSIONS)}"
+                )
+
+            transcription, processing_time, details = await transcribe_passthrough(
+                stream, language, task, priority, profile=profile, deadline_ms=deadline_ms
+            )
+    except AudioTooLargeError:
+        raise HTTPException(
+            status_code=413,
+            detail="File quá lớn. Kích thước tối đa là 25MB"
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Lỗi khi chuyển tiếp raw body: {e}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Lỗi khi xử lý audio: {str(e)}"
+        )
+
+    result = {
+        "transcription": transcription,
+        "filename": stream.filename,
+        "language": language,
+        "task": task,
+        "processing_time": round(processing_time, 2),
+        "file_size": stream.size,
+        "audio_duration": round(stream.duration, 2),
+        "audio_sha256": stream.sha256,
+        "trace_id": tracing.current_trace_id(),
+        "timestamp": time.time()
+    }
+    result.update(details)
+    if timings:
+        result["timings"] = tracing.current_trace().to_dict()
+    return result
+
+class TranscribeUrlRequest(BaseModel):
+    """Body của /transcribe-url"""
+    url: str = Field(..., description="URL http(s) của file audio")
+    language: Optional[str] = Field(None, description="Mã ngôn ngữ (vi, en, fr, etc.)")
+    task: str = Field("transcribe", pattern="^(transcribe|translate)$")
+    priority: int = Field(0, ge=-10, le=10)
+    profile: Optional[str] = Field(None, description="Decoding profile (accurate, balanced, fast)")
+    deadline_ms: Optional[int] = Field(None, gt=0, description="Latency budget (ms)")
+
+class TranscribeUrlBatchRequest(BaseModel):
+    """Body của /transcribe-url-batch"""
+    urls: list[str] = Field(..., min_length=1, max_length=5, description="Tối đa 5 URL")
+    language: Optional[str] = None
+    task: str = Field("transcribe", pattern="^(transcribe|translate)$")
+    priority: int = Field(0, ge=-10, le=10)
+    profile: Optional[str] = Field(None, description="Decoding profile (accurate, balanced, fast)")
+    deadline_ms: Optional[int] = Field(None, gt=0, description="Latency budget (ms)")
+
+async def fetch_audio(url: str):
+    """Tải audio từ URL và kiểm tra định dạng"""
+    fetched = await get_audio_fetcher().fetch(url)
+    if fetched.extension not in ALLOWED_EXTENSIONS:
+        fetched.cleanup()
+        raise AudioFetchError(
+            400,
+            f"Định dạng file không được hỗ trợ. Các định dạng được hỗ trợ: {', '.join(ALLOWED_EXTENSIONS)}"
+        )
+    return fetched
+
+@app.post("/transcribe-url")
+async def transcribe_url(body: TranscribeUrlRequest, timings: bool = False):
+    """
+    Transcribe audio từ URL (ví dụ object storage) mà không cần upload lại
+
+    Audio được stream vào file tạm, kiểm tra kích thước và tính sha256 trong lúc tải.
+    """
+    if whisper_model is None:
+        raise HTTPException(
+            status_code=503,
+            detail="Whisper model chưa được khởi tạo"
+        )
+
+    try:
+        fetched = await fetch_audio(body.url)
+    except AudioFetchError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+    try:
+        transcription, processing_time, details = await run_transcription(
+            fetched.path, fetched.duration, body.language, body.task, body.priority, fetched.sha256,
+            profile=body.profile, deadline_ms=body.deadline_ms
+        )
+
+        result = {
+            "transcription": transcription,
+            "url": body.url,
+            "filename": fetched.filename,
+            "language": body.language,
+            "task": body.task,
+            "processing_time": round(processing_time, 2),
+            "file_size": fetched.size,
+            "audio_duration": round(fetched.duration, 2),
+            "audio_sha256": fetched.sha256,
+            "trace_id": tracing.current_trace_id(),
+            "timestamp": time.time()
+        }
+        result.update(details)
+        if timings:
+            result["timings"] = tracing.current_trace().to_dict()
+        return result
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Lỗi khi transcribe URL: {e}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Lỗi khi xử lý audio: {str(e)}"
+        )
+
+    finally:
+        fetched.cleanup()
+
+@app.post("/transcribe-url-batch")
+async def transcribe_url_batch(body: TranscribeUrlBatchRequest, timings: bool = False):
+    """
+    Transcribe nhiều URL cùng lúc
+
+    Các URL được tải song song, mỗi file sau đó là một job riêng trong scheduler.
+    """
+    if whisper_model is None:
+        raise HTTPException(
+            status_code=503,
+            detail="Whisper model chưa được khởi tạo"
+        )
+
+    start_time = time.time()
+
+    async def process_one(url: str):
+        try:
+            fetched = await fetch_audio(url)
+        except AudioFetchError as e:
+            return {"url": url, "error": e.detail, "status_code": e.status_code, "success": False}
+
+        try:
+            transcription, _, details = await run_transcription(
+                fetched.path, fetched.duration, body.language, body.task, body.priority, fetched.sha256,
+                profile=body.profile, deadline_ms=body.deadline_ms
+            )
+            item = {
+                "url": url,
+                "filename": fetched.filename,
+                "transcription": transcription,
+                "file_size": fetched.size,
+                "audio_duration": round(fetched.duration, 2),
+                "audio_sha256": fetched.sha256,
+                "success": True
+            }
+            item.update(details)
+            return item
+        except HTTPException as e:
+            return {"url": url, "error": e.detail, "status_code": e.status_code, "success": False}
+        except Exception as e:
+            return {"url": url, "error": str(e), "success": False}
+        finally:
+            fetched.cleanup()
+
+    results = await asyncio.gather(*(process_one(url) for url in body.urls))
+
+    result = {
+        "results": results,
+        "total_files": len(body.urls),
+        "processing_time": round(time.time() - start_time, 2),
+        "language": body.language,
+        "task": body.task,
+        "trace_id": tracing.current_trace_id(),
+        "timestamp": time.time()
+    }
+    if timings:
+        result["timings"] = tracing.current_trace().to_dict()
+    return result
+
+@app.get("/metrics")
+async def get_metrics():
+    """Metrics của admission control, scheduler, hedging, các cache và decoding profiles"""
+    return {
+        "admission": admission.stats() if admission is not None else None,
+        "scheduler": scheduler.stats(),
+        "hedging": hedger.stats() if hedger is not None else None,
+        "cache": result_cache.stats() if result_cache is not None else None,
+        "encoder_cache": encoder_cache_stats(),
+        "decoding_profiles": profile_selector.stats(),
+        "timestamp": time.time()
+    }
+
+def _require_profiling_token(token: Optional[str]):
+    if profiler is None:
+        raise HTTPException(status_code=404, detail="Profiling chưa được bật")
+    if not profiler.authorized(token):
+        raise HTTPException(status_code=401, detail="Profiling token không hợp lệ")
+
+@app.get("/profiles")
+async def list_profiles(x_profiling_token: Optional[str] = Header(None)):
+    """Danh sách profile đã lưu (cần header X-Profiling-Token)"""
+    _require_profiling_token(x_profiling_token)
+    return {
+        "profiles": profiler.store.list(),
+        "stats": profiler.stats()
+    }
+
+@app.get("/profiles/{name}")
+async def download_profile(name: str, x_profiling_token: Optional[str] = Header(None)):
+    """Tải một file profile (cần header X-Profiling-Token)"""
+    _require_profiling_token(x_profiling_token)
+    path = profiler.store.path(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Không tìm thấy profile")
+    return FileResponse(path, media_type="text/plain", filename=name)
+
 @app.get("/languages")
 async def get_supported_languages():
     """Lấy danh sách ngôn ngữ được hỗ trợ bởi Hugging Face Whisper API"""
@@ -322,5 +1030,6 @@ if __name__ == "__main__":
         host=host,
         port=port,
         reload=False,  # Tắt reload trong production
-        log_level="info"
+        log_level="info",
+        log_config=None  # Dùng root logger (JSON) cho cả log của uvicorn
     )
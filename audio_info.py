@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Ước lượng nhanh thời lượng audio mà không cần decode
+Chỉ đọc header (WAV, FLAC, MP3) hoặc suy ra từ kích thước file và bitrate điển hình
+"""
+
+import struct
+from typing import Optional
+
+# Bitrate điển hình (bytes/giây) dùng khi không đọc được header
+TYPICAL_BYTE_RATES = {
+    '.wav': 32000,     # 16 kHz, 16-bit, mono
+    '.mp3': 16000,     # 128 kbps
+    '.m4a': 16000,     # 128 kbps AAC
+    '.mp4': 16000,
+    '.ogg': 12000,     # ~96 kbps Vorbis/Opus
+    '.webm': 8000,     # ~64 kbps Opus
+    '.flac': 88000,    # ~700 kbps
+}
+DEFAULT_BYTE_RATE = 16000
+
+
+def _wav_duration(data: bytes, total_size: int) -> Optional[float]:
+    """Đọc byte rate và kích thước data chunk từ header RIFF/WAVE"""
+    if len(data) < 12 or data[0:4] != b'RIFF' or data[8:12] != b'WAVE':
+        return None
+
+    byte_rate = None
+    offset = 12
+    while offset + 8 <= len(data):
+        chunk_id = data[offset:offset + 4]
+        chunk_size = struct.unpack('<I', data[offset + 4:offset + 8])[0]
+        if chunk_id == b'fmt ' and offset + 20 <= len(data):
+            byte_rate = struct.unpack('<I', data[offset + 16:offset + 20])[0]
+        elif chunk_id == b'data':
+            if not byte_rate:
+                return None
+            # Header có thể ghi sai kích thước (stream), giới hạn theo dữ liệu thực
+            available = total_size - offset - 8
+            return min(chunk_size, available) / byte_rate
+        offset += 8 + chunk_size + (chunk_size & 1)
+    return None
+
+
+def _flac_duration(data: bytes) -> Optional[float]:
+    """Đọc sample rate và tổng số sample từ block STREAMINFO"""
+    if len(data) < 8 + 18 or data[0:4] != b'fLaC' or (data[4] & 0x7F) != 0:
+        return None
+    info = data[8:8 + 18]
+    sample_rate = (info[10] << 12) | (info[11] << 4) | (info[12] >> 4)
+    total_samples = ((info[13] & 0x0F) << 32) | struct.unpack('>I', info[14:18])[0]
+    if not sample_rate or not total_samples:
+        return None
+    return total_samples / sample_rate
+
+
+# Bảng bitrate (kbps) và sample rate cho MPEG-1 Layer III và MPEG-2/2.5 Layer III
+_MP3_BITRATES = {
+    3: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    2: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+_MP3_SAMPLE_RATES = {3: [44100, 48000, 32000], 2: [22050, 24000, 16000], 0: [11025, 12000, 8000]}
+
+
+def _mp3_duration(data: bytes, total_size: int) -> Optional[float]:
+    """Đọc frame header đầu tiên (và Xing/Info header nếu có) của file MP3"""
+    offset = 0
+    if data[:3] == b'ID3' and len(data) >= 10:
+        tag_size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+        offset = 10 + tag_size
+
+    # Tìm frame sync trong 64KB đầu
+    limit = min(len(data) - 4, offset + 65536)
+    while offset < limit:
+        if data[offset] == 0xFF and (data[offset + 1] & 0xE6) == 0xE2:
+            break
+        offset += 1
+    else:
+        return None
+
+    header = data[offset:offset + 4]
+    version = (header[1] >> 3) & 0x03          # 3: MPEG-1, 2: MPEG-2, 0: MPEG-2.5
+    bitrate_index = header[2] >> 4
+    rate_index = (header[2] >> 2) & 0x03
+    if version == 1 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    sample_rate = _MP3_SAMPLE_RATES[version][rate_index]
+    bitrate = _MP3_BITRATES[3 if version == 3 else 2][bitrate_index] * 1000
+    samples_per_frame = 1152 if version == 3 else 576
+
+    # VBR: Xing/Info header chứa tổng số frame
+    for tag in (b'Xing', b'Info'):
+        position = data.find(tag, offset, offset + 64)
+        if position != -1 and position + 12 <= len(data):
+            flags = struct.unpack('>I', data[position + 4:position + 8])[0]
+            if flags & 0x01:
+                frames = struct.unpack('>I', data[position + 8:position + 12])[0]
+                return frames * samples_per_frame / sample_rate
+
+    # CBR: suy ra từ kích thước phần audio
+    return (total_size - offset) * 8 / bitrate
+
+
+def estimate_duration_from_size(size: int, extension: str = '') -> float:
+    """Ước lượng thời lượng (giây) chỉ từ kích thước, ví dụ Content-Length"""
+    byte_rate = TYPICAL_BYTE_RATES.get(extension.lower(), DEFAULT_BYTE_RATE)
+    return max(size / byte_rate, 0.1)
+
+
+def estimate_duration(data: bytes, extension: str = '', total_size: Optional[int] = None) -> float:
+    """
+    Ước lượng thời lượng audio (giây)
+
+    Args:
+        data (bytes): Nội dung file audio, hoặc chỉ phần đầu file nếu có total_size
+        extension (str): Phần mở rộng file, ví dụ '.wav'
+        total_size (Optional[int]): Kích thước cả file khi data chỉ là phần đầu
+
+    Returns:
+        float: Thời lượng ước lượng, luôn > 0
+    """
+    if total_size is None:
+        total_size = len(data)
+
+    duration = None
+    extension = extension.lower()
+    try:
+        if extension == '.wav' or data[:4] == b'RIFF':
+            duration = _wav_duration(data, total_size)
+        elif extension == '.flac' or data[:4] == b'fLaC':
+            duration = _flac_duration(data)
+        elif extension == '.mp3' or data[:3] == b'ID3':
+            duration = _mp3_duration(data, total_size)
+    except (struct.error, IndexError, KeyError, ZeroDivisionError):
+        # Header bị cắt hoặc sai định dạng: dùng ước lượng theo kích thước
+        duration = None
+
+    if duration is None:
+        return estimate_duration_from_size(total_size, extension)
+
+    return max(duration, 0.1)
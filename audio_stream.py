@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Ghi audio dạng stream (URL download, raw request body) vào file tạm
+Kiểm tra kích thước, tính sha256 và đọc header trong một lượt, không buffer cả file
+"""
+
+import asyncio
+import hashlib
+import mimetypes
+import os
+import tempfile
+from typing import AsyncIterator, Optional
+
+from audio_info import estimate_duration
+
+# Content-Type -> phần mở rộng khi không có tên file
+CONTENT_TYPE_EXTENSIONS = {
+    'audio/wav': '.wav',
+    'audio/x-wav': '.wav',
+    'audio/wave': '.wav',
+    'audio/mpeg': '.mp3',
+    'audio/mp3': '.mp3',
+    'audio/flac': '.flac',
+    'audio/x-flac': '.flac',
+    'audio/mp4': '.m4a',
+    'audio/x-m4a': '.m4a',
+    'audio/ogg': '.ogg',
+    'audio/webm': '.webm',
+    'video/mp4': '.mp4',
+}
+
+# Số byte đầu file giữ lại để đọc header (thời lượng)
+HEADER_BYTES = 64 * 1024
+
+
+class AudioTooLargeError(Exception):
+    """Stream vượt quá kích thước cho phép"""
+
+    def __init__(self, max_bytes: int):
+        super().__init__(f"File quá lớn (>{max_bytes // (1024 * 1024)}MB)")
+        self.max_bytes = max_bytes
+
+
+def extension_for_content_type(content_type: Optional[str]) -> str:
+    """Phần mở rộng file tương ứng với Content-Type ('' nếu không biết)"""
+    if not content_type:
+        return ''
+    mime = content_type.split(';')[0].strip().lower()
+    if mime in CONTENT_TYPE_EXTENSIONS:
+        return CONTENT_TYPE_EXTENSIONS[mime]
+    if mime.startswith('audio/'):
+        return mimetypes.guess_extension(mime) or ''
+    return ''
+
+
+def sniff_extension(data: bytes) -> str:
+    """Đoán định dạng audio từ magic bytes ở đầu file ('' nếu không nhận ra)"""
+    if data[:4] == b'RIFF' and data[8:12] == b'WAVE':
+        return '.wav'
+    if data[:4] == b'fLaC':
+        return '.flac'
+    if data[:3] == b'ID3' or (len(data) > 1 and data[0] == 0xFF and (data[1] & 0xE0) == 0xE0):
+        return '.mp3'
+    if data[:4] == b'OggS':
+        return '.ogg'
+    if data[:4] == b'\x1a\x45\xdf\xa3':
+        return '.webm'
+    if data[4:8] == b'ftyp':
+        return '.m4a'
+    return ''
+
+
+class SpooledAudio:
+    """Audio đã được ghi ra file tạm"""
+
+    def __init__(self, path: str, filename: str, extension: str,
+                 size: int, sha256: str, duration: float):
+        self.path = path
+        self.filename = filename
+        self.extension = extension
+        self.size = size
+        self.sha256 = sha256
+        self.duration = duration
+
+    def cleanup(self):
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+async def spool_audio(chunks: AsyncIterator[bytes], extension: str, max_bytes: int,
+                      filename: Optional[str] = None) -> SpooledAudio:
+    """
+    Ghi các chunk vào file tạm
+
+    Args:
+        chunks: Async iterator các chunk bytes
+        extension (str): Phần mở rộng của file tạm, '' để đoán từ magic bytes
+        max_bytes (int): Kích thước tối đa, vượt quá thì dừng đọc ngay
+        filename (Optional[str]): Tên file gốc để trả về cho client
+
+    Returns:
+        SpooledAudio: File tạm, gọi cleanup() khi dùng xong
+
+    Raises:
+        AudioTooLargeError: Khi stream vượt quá max_bytes
+    """
+    digest = hashlib.sha256()
+    header = bytearray()
+    size = 0
+
+    # File tạm được tạo ở chunk đầu tiên để có thể đoán phần mở rộng.
+    # Ghi/đóng file chạy trong thread để disk chậm không chặn event loop
+    temp_file = None
+    try:
+        async for chunk in chunks:
+            if not chunk:
+                continue
+            if temp_file is None:
+                extension = extension or sniff_extension(chunk)
+                temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=extension)
+            size += len(chunk)
+            if size > max_bytes:
+                raise AudioTooLargeError(max_bytes)
+            digest.update(chunk)
+            if len(header) < HEADER_BYTES:
+                header.extend(chunk[:HEADER_BYTES - len(header)])
+            await asyncio.to_thread(temp_file.write, chunk)
+        if temp_file is None:
+            temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=extension)
+        await asyncio.to_thread(temp_file.close)
+    except BaseException:
+        # Dọn dẹp đồng bộ: có thể đang bị cancel (timeout) nên không await thêm
+        if temp_file is not None:
+            temp_file.close()
+            os.unlink(temp_file.name)
+        raise
+
+    return SpooledAudio(
+        path=temp_file.name,
+        filename=filename or "audio" + extension,
+        extension=extension,
+        size=size,
+        sha256=digest.hexdigest(),
+        duration=estimate_duration(bytes(header), extension, total_size=size),
+    )
+
+
+class AudioStream:
+    """
+    Chuyển tiếp stream audio (pass-through) mà không ghi ra file
+
+    Kiểm tra kích thước, tính sha256 và giữ header khi các chunk đi qua. start() đọc
+    chunk đầu tiên để biết định dạng trước khi mở request upstream; sau đó iterate
+    qua object (một lần) để lấy lần lượt các chunk. size/sha256/duration chỉ đầy đủ
+    sau khi stream kết thúc.
+    """
+
+    def __init__(self, chunks: AsyncIterator[bytes], extension: str, max_bytes: int,
+                 filename: Optional[str] = None, expected_size: Optional[int] = None):
+        """
+        Args:
+            chunks: Async iterator các chunk bytes (ví dụ request.stream())
+            extension (str): Phần mở rộng, '' để đoán từ magic bytes của chunk đầu
+            max_bytes (int): Kích thước tối đa, vượt quá thì dừng đọc ngay
+            filename (Optional[str]): Tên file gốc để trả về cho client
+            expected_size (Optional[int]): Content-Length của client (nếu có)
+        """
+        self._chunks = chunks.__aiter__()
+        self.extension = extension
+        self.max_bytes = max_bytes
+        self.filename = filename
+        self.expected_size = expected_size
+        self.size = 0
+        self.complete = False
+        self._digest = hashlib.sha256()
+        self._header = bytearray()
+        self._first = None
+
+    def _accept(self, chunk: bytes):
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise AudioTooLargeError(self.max_bytes)
+        self._digest.update(chunk)
+        if len(self._header) < HEADER_BYTES:
+            self._header.extend(chunk[:HEADER_BYTES - len(self._header)])
+
+    async def start(self) -> 'AudioStream':
+        """Đọc chunk đầu tiên (đoán định dạng, header)"""
+        async for chunk in self._chunks:
+            if chunk:
+                self._first = chunk
+                self.extension = self.extension or sniff_extension(chunk)
+                self._accept(chunk)
+                break
+        else:
+            self.complete = True
+        if self.filename is None:
+            self.filename = "audio" + self.extension
+        return self
+
+    async def __aiter__(self):
+        if self._first is not None:
+            first, self._first = self._first, None
+            yield first
+        async for chunk in self._chunks:
+            if not chunk:
+                continue
+            self._accept(chunk)
+            yield chunk
+        self.complete = True
+
+    @property
+    def sha256(self) -> Optional[str]:
+        return self._digest.hexdigest() if self.complete else None
+
+    @property
+    def duration(self) -> float:
+        """Thời lượng từ header; trước khi stream xong thì dựa vào Content-Length"""
+        total_size = self.size if self.complete else max(self.size, self.expected_size or 0)
+        return estimate_duration(bytes(self._header), self.extension, total_size=total_size)
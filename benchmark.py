@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark các tối ưu của Whisper service
+Chạy: python benchmark.py <tên benchmark> --help
+"""
+
+import argparse
+import asyncio
+import difflib
+import io
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import wave
+from concurrent.futures import ThreadPoolExecutor
+
+
+def summarize(name: str, latencies: list) -> dict:
+    """In và trả về thống kê latency (giây)"""
+    latencies = sorted(latencies)
+    result = {
+        "name": name,
+        "runs": len(latencies),
+        "mean": statistics.mean(latencies),
+        "p50": latencies[len(latencies) // 2],
+        "max": latencies[-1],
+    }
+    print(f"{name:<28} runs={result['runs']:<4} mean={result['mean']:.3f}s "
+          f"p50={result['p50']:.3f}s max={result['max']:.3f}s")
+    return result
+
+
+def bench_language(args):
+    """So sánh latency khi ép ngôn ngữ với khi để model tự nhận diện ngôn ngữ"""
+    from lightweight_whisper import is_error_result
+
+    if args.backend == "hf":
+        from lightweight_whisper import LightweightWhisperService
+        service = LightweightWhisperService()
+
+        async def run(language):
+            return await service.transcribe(args.audio, language=language)
+
+        async def close():
+            await service.close()
+    else:
+        from whisper_connection import WhisperConnection
+        whisper = WhisperConnection(args.model)
+        audio = whisper.load_audio(args.audio)
+
+        async def run(language):
+            return whisper.transcribe(audio, language=language)
+
+        async def close():
+            pass
+
+    labels = (("auto-detect", None), (f"forced language={args.language}", args.language))
+
+    async def measure_all():
+        """Latency từng cấu hình; dùng một event loop cho connection pool của service"""
+        try:
+            # Warmup (load model / HF API load model lần đầu)
+            print(f"auto-detect: {await run(None)}")
+            print(f"forced {args.language}: {await run(args.language)}")
+
+            latencies = {}
+            for label, language in labels:
+                latencies[label] = []
+                for _ in range(args.runs):
+                    start = time.perf_counter()
+                    text = await run(language)
+                    if is_error_result(text):
+                        print(f"  [{label}] {text}")
+                        continue
+                    latencies[label].append(time.perf_counter() - start)
+            return latencies
+        finally:
+            await close()
+
+    latencies = asyncio.run(measure_all())
+    if not all(latencies.values()):
+        print("Không đủ kết quả thành công để so sánh")
+        return
+
+    results = {}
+    for label, _ in labels:
+        results[label] = summarize(label, latencies[label])
+
+    auto, forced = results.values()
+    saved = auto["mean"] - forced["mean"]
+    print(f"Tiết kiệm trung bình: {saved * 1000:.1f} ms/request ({saved / auto['mean'] * 100:.1f}%)")
+
+
+# Server benchmark: app thật nhưng backend là FallbackWhisperService (không gọi HF API),
+# để chỉ đo chi phí của tầng HTTP/upload
+SERVER_CODE = """
+import sys
+import uvicorn
+import lightweight_whisper
+lightweight_whisper._whisper_service = lightweight_whisper.FallbackWhisperService()
+uvicorn.run("app:app", host="127.0.0.1", port=int(sys.argv[1]), log_level="warning")
+"""
+
+
+def make_wav(size_bytes: int) -> bytes:
+    """Tạo file WAV 16kHz mono (im lặng) có kích thước xấp xỉ size_bytes"""
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(16000)
+        wav.writeframes(b'\0' * (size_bytes - 44))
+    return buffer.getvalue()
+
+
+def process_cpu_seconds(pid: int) -> float:
+    """CPU time (user + system) của một process, đọc từ /proc (Linux)"""
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def start_server() -> tuple:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    env = dict(os.environ, ADMISSION_ENABLED="0", LOG_FORMAT="text")
+    process = subprocess.Popen([sys.executable, "-c", SERVER_CODE, str(port)], env=env,
+                               cwd=os.path.dirname(os.path.abspath(__file__)),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{port}"
+    import httpx
+    for _ in range(100):
+        try:
+            if httpx.get(f"{base_url}/health").status_code == 200:
+                return process, base_url
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("Server không khởi động được")
+
+
+def bench_upload(args):
+    """So sánh CPU server/request và throughput giữa /transcribe (multipart) và /transcribe-raw"""
+    import httpx
+
+    payload = make_wav(int(args.size_mb * 1024 * 1024))
+    process, base_url = start_server()
+
+    def multipart(client):
+        return client.post(f"{base_url}/transcribe", files={"file": ("audio.wav", payload, "audio/wav")},
+                           data={"language": "vi"})
+
+    def raw(client):
+        return client.post(f"{base_url}/transcribe-raw?language=vi", content=payload,
+                           headers={"Content-Type": "audio/wav"})
+
+    try:
+        print(f"Payload: {len(payload) / 1024 / 1024:.1f}MB, {args.requests} requests, "
+              f"concurrency {args.concurrency}")
+        for name, send in (("multipart /transcribe", multipart), ("raw /transcribe-raw", raw)):
+            with httpx.Client(timeout=120) as client:
+                send(client).raise_for_status()  # warmup
+
+            def worker(count):
+                with httpx.Client(timeout=120) as client:
+                    for _ in range(count):
+                        send(client).raise_for_status()
+
+            per_worker = [args.requests // args.concurrency] * args.concurrency
+            per_worker[0] += args.requests % args.concurrency
+
+            cpu_before = process_cpu_seconds(process.pid)
+            start = time.perf_counter()
+            with ThreadPoolExecutor(args.concurrency) as pool:
+                list(pool.map(worker, per_worker))
+            elapsed = time.perf_counter() - start
+            cpu = process_cpu_seconds(process.pid) - cpu_before
+
+            print(f"{name:<24} server CPU/request={cpu / args.requests * 1000:.1f}ms "
+                  f"throughput={args.requests / elapsed:.1f} req/s "
+                  f"({args.requests * len(payload) / elapsed / 1024 / 1024:.0f} MB/s)")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def bench_onnx(args):
+    """So sánh backend ONNX Runtime với torch (WhisperConnection): độ khớp kết quả và latency"""
+    import torch
+    from whisper_connection import WhisperConnection
+    from onnx_whisper import OnnxWhisperConnection
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    reference = WhisperConnection(args.model)
+    # Tắt encoder cache để lần chạy lặp lại của torch vẫn chạy encoder
+    reference.encoder_cache = None
+    engines = {"torch": reference}
+    engines["onnx"] = OnnxWhisperConnection(args.model, intra_op_threads=args.threads)
+    if args.int8:
+        engines["onnx int8"] = OnnxWhisperConnection(args.model, intra_op_threads=args.threads, quantize=True)
+
+    audios = {path: reference.load_audio(path) for path in args.audio}
+    expected = {path: reference.transcribe(audio, language=args.language) for path, audio in audios.items()}
+
+    print("Parity so với torch:")
+    for name, engine in engines.items():
+        if name == "torch":
+            continue
+        identical = 0
+        similarities = []
+        for path, audio in audios.items():
+            text = engine.transcribe(audio, language=args.language)
+            identical += text == expected[path]
+            similarities.append(difflib.SequenceMatcher(None, expected[path], text).ratio())
+            if text != expected[path]:
+                print(f"  [{name}] {path}\n    torch: {expected[path]}\n    {name}: {text}")
+        print(f"{name:<28} giống hệt {identical}/{len(audios)}, similarity trung bình {statistics.mean(similarities):.3f}")
+
+    print("Latency:")
+    results = {}
+    for name, engine in engines.items():
+        latencies = []
+        for _ in range(args.runs):
+            for audio in audios.values():
+                start = time.perf_counter()
+                engine.transcribe(audio, language=args.language)
+                latencies.append(time.perf_counter() - start)
+        results[name] = summarize(name, latencies)
+
+    for name, result in results.items():
+        if name != "torch":
+            print(f"{name}: nhanh hơn torch {results['torch']['mean'] / result['mean']:.2f}x")
+
+
+def bench_pipeline(args):
+    """So sánh throughput khi chạy tuần tự với khi chạy qua pipeline nhiều stage"""
+    from pipeline import build_whisper_pipeline
+
+    if args.backend == "onnx":
+        from onnx_whisper import OnnxWhisperConnection
+        engine = OnnxWhisperConnection(args.model)
+    else:
+        from optimize_whisper import OptimizedWhisperConnection
+        engine = OptimizedWhisperConnection(args.model)
+        # Tắt encoder cache để mỗi request đều chạy encoder
+        engine.encoder_cache = None
+
+    paths = (args.audio * (args.requests // len(args.audio) + 1))[:args.requests]
+    # Warmup
+    engine.transcribe(paths[0], language=args.language)
+
+    start = time.perf_counter()
+    for path in paths:
+        engine.transcribe(path, language=args.language)
+    sequential = time.perf_counter() - start
+    print(f"{'sequential':<28} {len(paths)} requests trong {sequential:.2f}s "
+          f"({len(paths) / sequential:.2f} req/s)")
+
+    pipeline = build_whisper_pipeline(engine, queue_size=args.queue_size)
+    try:
+        start = time.perf_counter()
+        futures = [pipeline.submit(path, language=args.language) for path in paths]
+        for future in futures:
+            future.result()
+        pipelined = time.perf_counter() - start
+        stats = pipeline.stats()
+    finally:
+        pipeline.close()
+
+    print(f"{'pipelined':<28} {len(paths)} requests trong {pipelined:.2f}s "
+          f"({len(paths) / pipelined:.2f} req/s), nhanh hơn {sequential / pipelined:.2f}x")
+    for name, stage in stats["stages"].items():
+        print(f"  {name:<20} workers={stage['workers']} avg={stage['avg_ms']}ms "
+              f"utilisation={stage['utilisation']:.0%}")
+
+
+def bench_profiles(args):
+    """Đo latency từng decoding profile trên backend HF, ghi file calibration cho latency model"""
+    import json
+    from audio_info import estimate_duration
+    from decoding_profiles import LatencyModel, load_profiles
+    from lightweight_whisper import LightweightWhisperService, is_error_result
+
+    service = LightweightWhisperService()
+    durations = {}
+    for path in args.audio:
+        with open(path, 'rb') as f:
+            durations[path] = estimate_duration(f.read(), os.path.splitext(path)[1].lower())
+
+    async def measure(profile):
+        """Latency (giây) theo thời lượng audio; dùng một event loop cho connection pool của service"""
+        # Warmup (HF API load model lần đầu)
+        await service.transcribe(args.audio[0], language=args.language, profile=profile)
+        samples = []
+        for _ in range(args.runs):
+            for path, duration in durations.items():
+                start = time.perf_counter()
+                text = await service.transcribe(path, language=args.language, profile=profile)
+                if is_error_result(text):
+                    print(f"  [{profile.name}] {path}: {text}")
+                    continue
+                samples.append((duration, time.perf_counter() - start))
+        return samples
+
+    async def measure_all(profiles):
+        try:
+            return [await measure(profile) for profile in profiles]
+        finally:
+            await service.close()
+
+    profiles = load_profiles(args.input)
+    calibrated = []
+    for profile, samples in zip(profiles, asyncio.run(measure_all(profiles))):
+        model = LatencyModel(profile.base_seconds, profile.seconds_per_audio_second,
+                             window=10000, min_samples=2, percentile=args.percentile)
+        for duration, latency in samples:
+            model.record(duration, latency)
+        if samples:
+            summarize(profile.name, [latency for _, latency in samples])
+        stats = model.stats()
+        item = profile.to_dict()
+        # Margin được cộng vào base để dự đoán ban đầu thiên về an toàn
+        item["base_seconds"] = round(stats["base_seconds"] + stats["margin_seconds"], 3)
+        item["seconds_per_audio_second"] = stats["seconds_per_audio_second"]
+        calibrated.append(item)
+        print(f"  base={item['base_seconds']}s per_audio_second={item['seconds_per_audio_second']}s")
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump({"profiles": calibrated}, f, indent=2)
+    print(f"Đã ghi {args.output} (dùng với DECODING_CALIBRATION_FILE)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Whisper service")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    language = subparsers.add_parser("language", help="Forced language vs auto-detect")
+    language.add_argument("audio", help="File audio để test")
+    language.add_argument("--language", default="vi")
+    language.add_argument("--runs", type=int, default=10)
+    language.add_argument("--backend", choices=["local", "hf"], default="local")
+    language.add_argument("--model", default="openai/whisper-small")
+    language.set_defaults(func=bench_language)
+
+    upload = subparsers.add_parser("upload", help="Multipart /transcribe vs raw body /transcribe-raw")
+    upload.add_argument("--size-mb", type=float, default=10)
+    upload.add_argument("--requests", type=int, default=30)
+    upload.add_argument("--concurrency", type=int, default=2)
+    upload.set_defaults(func=bench_upload)
+
+    onnx = subparsers.add_parser("onnx", help="ONNX Runtime backend vs torch (parity và tốc độ)")
+    onnx.add_argument("audio", nargs="+", help="Các file audio để test")
+    onnx.add_argument("--language", default="vi")
+    onnx.add_argument("--runs", type=int, default=5)
+    onnx.add_argument("--model", default="openai/whisper-small")
+    onnx.add_argument("--threads", type=int, default=0, help="Số thread cho cả torch và onnxruntime (0 = mặc định)")
+    onnx.add_argument("--int8", action="store_true", help="Đo thêm graph int8")
+    onnx.set_defaults(func=bench_onnx)
+
+    pipeline = subparsers.add_parser("pipeline", help="Chạy tuần tự vs pipeline nhiều stage (throughput)")
+    pipeline.add_argument("audio", nargs="+", help="Các file audio để test")
+    pipeline.add_argument("--language", default="vi")
+    pipeline.add_argument("--requests", type=int, default=20)
+    pipeline.add_argument("--queue-size", type=int, default=4)
+    pipeline.add_argument("--backend", choices=["optimized", "onnx"], default="optimized")
+    pipeline.add_argument("--model", default="openai/whisper-small")
+    pipeline.set_defaults(func=bench_pipeline)
+
+    profiles = subparsers.add_parser("profiles", help="Calibrate latency model của các decoding profile")
+    profiles.add_argument("audio", nargs="+", help="Các file audio với thời lượng khác nhau")
+    profiles.add_argument("--language", default="vi")
+    profiles.add_argument("--runs", type=int, default=3)
+    profiles.add_argument("--percentile", type=float, default=90)
+    profiles.add_argument("--input", help="File profile/calibration hiện có (mặc định: profile có sẵn)")
+    profiles.add_argument("--output", default="decoding_profiles.json")
+    profiles.set_defaults(func=bench_profiles)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
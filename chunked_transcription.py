@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Transcription file dài theo từng chunk, có checkpoint để resume
+Kết quả mỗi chunk được lưu theo (audio hash, tham số, chunk index); khi retry
+hoặc sau khi worker restart chỉ các chunk còn thiếu được xử lý lại
+"""
+
+import asyncio
+import hashlib
+import io
+import os
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+import threading
+import time
+import wave
+from typing import Awaitable, Callable, Optional
+
+from tracing import span
+
+
+class IncompleteTranscriptionError(Exception):
+    """Một chunk bị lỗi, các chunk đã xong vẫn được lưu trong checkpoint"""
+
+    def __init__(self, completed: int, total: int, cause: Exception):
+        super().__init__(f"Đã hoàn thành {completed}/{total} chunk, lỗi: {cause}")
+        self.completed = completed
+        self.total = total
+        self.cause = cause
+
+
+class CheckpointStore:
+    """
+    Lưu kết quả từng chunk trong SQLite (file local, dùng chung giữa các worker)
+    """
+
+    def __init__(self, path: str, ttl_seconds: float = 24 * 3600):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS chunks ("
+                " audio_hash TEXT NOT NULL,"
+                " params TEXT NOT NULL,"
+                " chunk_index INTEGER NOT NULL,"
+                " text TEXT NOT NULL,"
+                " created REAL NOT NULL,"
+                " PRIMARY KEY (audio_hash, params, chunk_index))"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=10)
+
+    def load(self, audio_hash: str, params: str) -> dict:
+        """Các chunk đã hoàn thành: {chunk_index: text}"""
+        with self._lock, self._connect() as conn:
+            rows = conn.execute(
+                "SELECT chunk_index, text FROM chunks WHERE audio_hash = ? AND params = ? AND created > ?",
+                (audio_hash, params, time.time() - self.ttl_seconds)
+            ).fetchall()
+        return dict(rows)
+
+    def save(self, audio_hash: str, params: str, chunk_index: int, text: str):
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?, ?)",
+                (audio_hash, params, chunk_index, text, time.time())
+            )
+
+    def prune(self):
+        """Xoá checkpoint quá hạn"""
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM chunks WHERE created <= ?", (time.time() - self.ttl_seconds,))
+
+
+def file_sha256(path: str) -> str:
+    """sha256 của file, đọc theo block"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def split_wav(path: str, chunk_seconds: float) -> Optional[list]:
+    """Cắt file WAV thành các chunk WAV (bytes) bằng module wave, None nếu không phải WAV"""
+    try:
+        source = wave.open(path, 'rb')
+    except (wave.Error, EOFError):
+        return None
+
+    chunks = []
+    with source:
+        params = source.getparams()
+        frames_per_chunk = max(1, int(chunk_seconds * params.framerate))
+        while True:
+            frames = source.readframes(frames_per_chunk)
+            if not frames:
+                break
+            buffer = io.BytesIO()
+            with wave.open(buffer, 'wb') as target:
+                target.setparams(params)
+                target.writeframes(frames)
+            chunks.append(buffer.getvalue())
+    return chunks
+
+
+def split_with_ffmpeg(path: str, chunk_seconds: float) -> Optional[list]:
+    """Cắt các định dạng khác thành chunk WAV 16kHz mono nếu có ffmpeg"""
+    if shutil.which("ffmpeg") is None:
+        return None
+
+    with tempfile.TemporaryDirectory() as directory:
+        result = subprocess.run(
+            ["ffmpeg", "-nostdin", "-loglevel", "error", "-i", path,
+             "-ac", "1", "-ar", "16000", "-f", "segment",
+             "-segment_time", str(chunk_seconds), os.path.join(directory, "%05d.wav")],
+            capture_output=True
+        )
+        if result.returncode != 0:
+            return None
+        chunks = []
+        for name in sorted(os.listdir(directory)):
+            with open(os.path.join(directory, name), 'rb') as f:
+                chunks.append(f.read())
+        return chunks
+
+
+def split_audio(path: str, chunk_seconds: float) -> Optional[list]:
+    """Cắt audio thành các chunk, None nếu định dạng không cắt được"""
+    return split_wav(path, chunk_seconds) or split_with_ffmpeg(path, chunk_seconds)
+
+
+class ResumableTranscriber:
+    """
+    Transcribe tuần tự các chunk, bỏ qua chunk đã có trong checkpoint
+    """
+
+    def __init__(self, store: CheckpointStore, chunk_seconds: float = 30.0):
+        self.store = store
+        self.chunk_seconds = chunk_seconds
+
+    async def run(self, chunks: list, audio_hash: str, params: str,
+                  transcribe_chunk: Callable[[bytes], Awaitable[str]]) -> dict:
+        """
+        Args:
+            chunks (list): Danh sách chunk audio (bytes)
+            audio_hash (str): sha256 của file gốc
+            params (str): Khoá tham số (model, language, task, chunk size)
+            transcribe_chunk: Coroutine transcribe một chunk, raise khi lỗi
+
+        Returns:
+            dict: text, chunks_total, chunks_reused, chunks_processed
+
+        Raises:
+            IncompleteTranscriptionError: Khi một chunk lỗi (các chunk xong đã được lưu)
+        """
+        params = f"{params}|{self.chunk_seconds}"
+        # SQLite chạy trong thread để không chặn event loop
+        completed = await asyncio.to_thread(self.store.load, audio_hash, params)
+        reused = sum(1 for index in completed if index < len(chunks))
+        done = reused
+        texts = []
+
+        for index, chunk in enumerate(chunks):
+            if index in completed:
+                texts.append(completed[index])
+                continue
+            with span(f"chunk_{index}"):
+                try:
+                    text = await transcribe_chunk(chunk)
+                except Exception as e:
+                    raise IncompleteTranscriptionError(done, len(chunks), e)
+            await asyncio.to_thread(self.store.save, audio_hash, params, index, text)
+            texts.append(text)
+            done += 1
+
+        return {
+            "text": " ".join(text.strip() for text in texts if text.strip()),
+            "chunks_total": len(chunks),
+            "chunks_reused": reused,
+            "chunks_processed": len(chunks) - reused,
+        }
+
+
+# Singleton pattern
+_resumable_transcriber = None
+
+
+def get_resumable_transcriber() -> ResumableTranscriber:
+    """Get resumable transcriber từ environment variables"""
+    global _resumable_transcriber
+    if _resumable_transcriber is None:
+        store = CheckpointStore(
+            path=os.environ.get('CHECKPOINT_DB', '/tmp/whisper_checkpoints/chunks.db'),
+            ttl_seconds=float(os.environ.get('CHECKPOINT_TTL_HOURS', 24)) * 3600,
+        )
+        store.prune()
+        _resumable_transcriber = ResumableTranscriber(
+            store,
+            chunk_seconds=float(os.environ.get('CHECKPOINT_CHUNK_SECONDS', 30)),
+        )
+    return _resumable_transcriber
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Decoding profiles theo latency budget
+Client gửi tên profile hoặc deadline; server chọn cấu hình decode (model, beam width,
+max tokens, chunk size) chính xác nhất mà latency model dự đoán vẫn kịp deadline.
+
+Latency model: mỗi profile có latency ≈ base + per_audio_second * thời lượng audio,
+khởi đầu từ giá trị calibration (mặc định hoặc file DECODING_CALIBRATION_FILE),
+sau đó fit lại (least squares) từ các request thực tế gần đây, cộng thêm margin là
+percentile của sai số để dự đoán thiên về an toàn.
+"""
+
+import json
+import os
+import threading
+from collections import deque
+from typing import Optional
+
+
+class DecodingProfile:
+    """Một bộ tham số decode; giá trị None nghĩa là dùng mặc định của backend"""
+
+    def __init__(self,
+                 name: str,
+                 model: str,
+                 num_beams: Optional[int] = None,
+                 max_new_tokens: Optional[int] = None,
+                 chunk_seconds: Optional[float] = None,
+                 base_seconds: float = 1.0,
+                 seconds_per_audio_second: float = 0.1):
+        """
+        Args:
+            name (str): Tên profile
+            model (str): Model id trên HF (ví dụ openai/whisper-tiny)
+            num_beams (Optional[int]): Beam width
+            max_new_tokens (Optional[int]): Số token tối đa mỗi lần decode
+            chunk_seconds (Optional[float]): Độ dài chunk khi transcribe file dài
+            base_seconds (float): Latency cố định (calibration ban đầu)
+            seconds_per_audio_second (float): Latency thêm cho mỗi giây audio (calibration ban đầu)
+        """
+        self.name = name
+        self.model = model
+        self.num_beams = num_beams
+        self.max_new_tokens = max_new_tokens
+        self.chunk_seconds = chunk_seconds
+        self.base_seconds = base_seconds
+        self.seconds_per_audio_second = seconds_per_audio_second
+
+    def generate_kwargs(self) -> dict:
+        """Tham số generate khác mặc định (rỗng nếu profile không đổi gì)"""
+        kwargs = {}
+        if self.num_beams is not None:
+            kwargs["num_beams"] = self.num_beams
+        if self.max_new_tokens is not None:
+            kwargs["max_new_tokens"] = self.max_new_tokens
+        return kwargs
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "model": self.model,
+            "num_beams": self.num_beams,
+            "max_new_tokens": self.max_new_tokens,
+            "chunk_seconds": self.chunk_seconds,
+        }
+
+
+# Profile mặc định, xếp từ chính xác nhất tới nhanh nhất.
+# "balanced" giữ nguyên request như khi chưa có profile (whisper-small, tham số mặc định).
+DEFAULT_PROFILES = [
+    DecodingProfile("accurate", "openai/whisper-large-v3", num_beams=5,
+                    base_seconds=3.0, seconds_per_audio_second=0.3),
+    DecodingProfile("balanced", "openai/whisper-small",
+                    base_seconds=1.0, seconds_per_audio_second=0.08),
+    DecodingProfile("fast", "openai/whisper-tiny", num_beams=1, max_new_tokens=128, chunk_seconds=15,
+                    base_seconds=0.4, seconds_per_audio_second=0.02),
+]
+
+
+class LatencyModel:
+    """
+    Dự đoán latency của một profile theo thời lượng audio
+
+    Chưa đủ `min_samples` mẫu thì dùng calibration ban đầu; sau đó fit tuyến tính
+    trên `window` mẫu gần nhất và cộng margin = percentile `percentile` của sai số.
+    """
+
+    def __init__(self, base_seconds: float, seconds_per_audio_second: float,
+                 window: int = 100, min_samples: int = 10, percentile: float = 90):
+        self.base_seconds = base_seconds
+        self.seconds_per_audio_second = seconds_per_audio_second
+        self.min_samples = min_samples
+        self.percentile = percentile
+        self.margin = 0.0
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def predict(self, audio_seconds: float) -> float:
+        with self._lock:
+            return max(0.0, self.base_seconds + self.seconds_per_audio_second * audio_seconds) + self.margin
+
+    def record(self, audio_seconds: float, latency: float):
+        with self._lock:
+            self._samples.append((audio_seconds, latency))
+            if len(self._samples) >= self.min_samples:
+                self._fit()
+
+    def _fit(self):
+        n = len(self._samples)
+        mean_x = sum(x for x, _ in self._samples) / n
+        mean_y = sum(y for _, y in self._samples) / n
+        var_x = sum((x - mean_x) ** 2 for x, _ in self._samples)
+        if var_x > 1e-9:
+            slope = sum((x - mean_x) * (y - mean_y) for x, y in self._samples) / var_x
+            slope = max(0.0, slope)
+        else:
+            # Các mẫu cùng thời lượng: giữ slope hiện tại, chỉ chỉnh base
+            slope = self.seconds_per_audio_second
+        self.seconds_per_audio_second = slope
+        self.base_seconds = mean_y - slope * mean_x
+
+        residuals = sorted(y - (self.base_seconds + slope * x) for x, y in self._samples)
+        index = min(n - 1, int(round(self.percentile / 100 * (n - 1))))
+        self.margin = max(0.0, residuals[index])
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "base_seconds": round(self.base_seconds, 3),
+                "seconds_per_audio_second": round(self.seconds_per_audio_second, 4),
+                "margin_seconds": round(self.margin, 3),
+                "samples": len(self._samples),
+            }
+
+
+class ProfileChoice:
+    """Profile được chọn cho một request và latency dự đoán"""
+
+    def __init__(self, profile: DecodingProfile, predicted_seconds: float,
+                 deadline_seconds: Optional[float] = None):
+        self.profile = profile
+        self.predicted_seconds = predicted_seconds
+        self.deadline_seconds = deadline_seconds
+
+    def report(self, elapsed_seconds: float) -> dict:
+        """Field "decoding" trong response"""
+        result = {
+            "profile": self.profile.name,
+            "model": self.profile.model,
+            "predicted_ms": round(self.predicted_seconds * 1000),
+        }
+        if self.deadline_seconds is not None:
+            result["deadline_ms"] = round(self.deadline_seconds * 1000)
+            result["deadline_met"] = elapsed_seconds <= self.deadline_seconds
+        return result
+
+
+class ProfileSelector:
+    """Chọn decoding profile theo tên hoặc theo deadline"""
+
+    def __init__(self, profiles: list, default: str = "balanced",
+                 window: int = 100, min_samples: int = 10, percentile: float = 90):
+        """
+        Args:
+            profiles (list): Các DecodingProfile, xếp từ chính xác nhất tới nhanh nhất
+            default (str): Profile dùng khi request không chỉ định gì
+        """
+        self.profiles = {profile.name: profile for profile in profiles}
+        if default not in self.profiles:
+            raise ValueError(f"Profile mặc định '{default}' không tồn tại")
+        self.default = default
+        self.models = {
+            profile.name: LatencyModel(profile.base_seconds, profile.seconds_per_audio_second,
+                                       window=window, min_samples=min_samples, percentile=percentile)
+            for profile in profiles
+        }
+        self._lock = threading.Lock()
+        self._chosen = {name: 0 for name in self.profiles}
+        self._deadline_requests = 0
+        self._deadline_met = 0
+
+    def choose(self, audio_seconds: float, profile: Optional[str] = None,
+               deadline_seconds: Optional[float] = None, elapsed_seconds: float = 0.0,
+               wait_seconds: float = 0.0) -> ProfileChoice:
+        """
+        Args:
+            audio_seconds (float): Thời lượng audio (ước lượng)
+            profile (Optional[str]): Tên profile client yêu cầu (ưu tiên hơn deadline)
+            deadline_seconds (Optional[float]): Budget tính từ lúc nhận request
+            elapsed_seconds (float): Thời gian request đã dùng (upload, ...)
+            wait_seconds (float): Thời gian chờ scheduler dự kiến
+
+        Raises:
+            KeyError: Khi tên profile không tồn tại
+        """
+        if profile is not None:
+            chosen = self.profiles[profile]
+        elif deadline_seconds is None:
+            chosen = self.profiles[self.default]
+        else:
+            budget = deadline_seconds - elapsed_seconds - wait_seconds
+            chosen = None
+            # Profile chính xác nhất còn kịp deadline
+            for candidate in self.profiles.values():
+                if self.models[candidate.name].predict(audio_seconds) <= budget:
+                    chosen = candidate
+                    break
+            if chosen is None:
+                # Không profile nào kịp: dùng profile nhanh nhất
+                chosen = min(self.profiles.values(),
+                             key=lambda candidate: self.models[candidate.name].predict(audio_seconds))
+
+        with self._lock:
+            self._chosen[chosen.name] += 1
+        return ProfileChoice(chosen, self.models[chosen.name].predict(audio_seconds) + wait_seconds,
+                             deadline_seconds)
+
+    def record(self, choice: ProfileChoice, audio_seconds: float, latency: float,
+               elapsed_seconds: Optional[float] = None):
+        """
+        Cập nhật latency model bằng thời gian xử lý thực tế
+
+        Args:
+            latency (float): Thời gian transcribe (không tính chờ scheduler)
+            elapsed_seconds (Optional[float]): Tổng thời gian request, để tính tỉ lệ kịp deadline
+        """
+        self.models[choice.profile.name].record(audio_seconds, latency)
+        if choice.deadline_seconds is not None and elapsed_seconds is not None:
+            with self._lock:
+                self._deadline_requests += 1
+                self._deadline_met += elapsed_seconds <= choice.deadline_seconds
+
+    def stats(self) -> dict:
+        """Metrics cho endpoint /metrics"""
+        with self._lock:
+            chosen = dict(self._chosen)
+            requests = self._deadline_requests
+            met = self._deadline_met
+        return {
+            "default": self.default,
+            "profiles": {
+                name: dict(profile.to_dict(), chosen=chosen[name], latency_model=self.models[name].stats())
+                for name, profile in self.profiles.items()
+            },
+            "deadline_requests": requests,
+            "deadline_met_rate": round(met / requests, 4) if requests else None,
+        }
+
+
+def load_profiles(path: Optional[str] = None) -> list:
+    """
+    Profile mặc định, ghi đè bởi file JSON nếu có
+
+    File có dạng {"profiles": [{"name": ..., "model": ..., "num_beams": ..., ...}, ...]}
+    (thứ tự từ chính xác nhất tới nhanh nhất); `python benchmark.py profiles` ghi file này
+    sau khi đo base_seconds/seconds_per_audio_second trên backend thật.
+    """
+    if not path or not os.path.exists(path):
+        return list(DEFAULT_PROFILES)
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    return [DecodingProfile(**item) for item in data["profiles"]]
+
+
+# Singleton pattern
+_profile_selector = None
+
+
+def get_profile_selector() -> ProfileSelector:
+    """Get profile selector từ environment variables"""
+    global _profile_selector
+    if _profile_selector is None:
+        _profile_selector = ProfileSelector(
+            load_profiles(os.environ.get('DECODING_CALIBRATION_FILE')),
+            default=os.environ.get('DECODING_DEFAULT_PROFILE', 'balanced'),
+            window=int(os.environ.get('DECODING_LATENCY_WINDOW', 100)),
+            min_samples=int(os.environ.get('DECODING_LATENCY_MIN_SAMPLES', 10)),
+            percentile=float(os.environ.get('DECODING_LATENCY_PERCENTILE', 90)),
+        )
+    return _profile_selector
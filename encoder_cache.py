@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cache encoder output cho các local engine (WhisperConnection, OptimizedWhisperConnection)
+Cùng một audio được decode lại với language/task/tham số khác chỉ cần chạy decoder.
+Giới hạn theo dung lượng memory, bỏ entry ít dùng gần đây nhất khi đầy.
+LocalWhisperMixin gom phần encode/generate kwargs dùng chung của các engine đó.
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from tracing import span
+
+
+def tensor_bytes(tensor) -> int:
+    return tensor.element_size() * tensor.nelement()
+
+
+class EncoderCache:
+    """
+    LRU cache encoder hidden states (tensor last_hidden_state) theo (model, hash của input features)
+
+    Chỉ cache tensor, không cache BaseModelOutput: generate ghi đè field của object
+    encoder_outputs được truyền vào (ví dụ khi expand theo num_beams).
+    """
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    @staticmethod
+    def key(model_name: str, input_features) -> tuple:
+        """Khoá cache: hash nội dung log-mel features (đầu vào của encoder)"""
+        data = input_features.detach().cpu().contiguous().numpy().tobytes()
+        return model_name, tuple(input_features.shape), hashlib.blake2b(data, digest_size=16).hexdigest()
+
+    def get(self, key: tuple):
+        with self._lock:
+            hidden_states = self._entries.get(key)
+            if hidden_states is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return hidden_states
+
+    def put(self, key: tuple, hidden_states):
+        size = tensor_bytes(hidden_states)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = hidden_states
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= tensor_bytes(evicted)
+                self._evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        """Hit rate và memory đang dùng"""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "hit_rate": round(self._hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+# Số token prompt tối đa trước phần transcription:
+# <|startoftranscript|><|lang|><|task|><|notimestamps|> chiếm 4 vị trí của decoder
+PROMPT_TOKENS = 4
+
+
+class LocalWhisperMixin:
+    """
+    Phần dùng chung của các local engine (WhisperConnection, OptimizedWhisperConnection)
+
+    Class dùng mixin cần có `model`, `model_name`, `device` và `encoder_cache`.
+    torch/transformers được import trong hàm: app.py import module này cho /metrics
+    mà không cần cài torch.
+    """
+
+    def language_kwargs(self, language: Optional[str], task: str = "transcribe") -> dict:
+        """
+        Tham số language/task cho generate
+
+        Khi ngôn ngữ được chỉ định, token ngôn ngữ được đưa vào prompt nên model bỏ
+        qua bước language detection. Không có ngôn ngữ thì generate vẫn tự nhận diện
+        ngôn ngữ, kể cả với task translate (không ép token nào vào vị trí ngôn ngữ).
+        """
+        kwargs = {}
+        if language:
+            kwargs["language"] = language
+        if task != "transcribe":
+            kwargs["task"] = task
+        return kwargs
+
+    def max_new_tokens(self, requested: int) -> int:
+        """Giới hạn số token sinh thêm để prompt + transcription không vượt max_target_positions"""
+        return min(requested, self.model.config.max_target_positions - PROMPT_TOKENS)
+
+    def encode(self, input_features):
+        """
+        Encoder output cho input features, dùng lại từ cache nếu audio đã được encode
+
+        Args:
+            input_features (torch.Tensor): Log-mel features (trên CPU, dùng để tính khoá cache)
+
+        Returns:
+            BaseModelOutput: Encoder output để truyền vào generate(encoder_outputs=...)
+        """
+        import torch
+        from transformers.modeling_outputs import BaseModelOutput
+
+        if self.encoder_cache is None:
+            with span("encoder"), torch.no_grad():
+                return self.model.get_encoder()(input_features.to(self.device))
+
+        key = self.encoder_cache.key(self.model_name, input_features)
+        hidden_states = self.encoder_cache.get(key)
+        if hidden_states is None:
+            with span("encoder"), torch.no_grad():
+                hidden_states = self.model.get_encoder()(input_features.to(self.device)).last_hidden_state
+            self.encoder_cache.put(key, hidden_states)
+        # generate thay last_hidden_state trong encoder_outputs (expand theo num_beams),
+        # nên mỗi lần decode dùng một BaseModelOutput mới thay vì object trong cache
+        return BaseModelOutput(last_hidden_state=hidden_states)
+
+
+# Singleton pattern (dùng chung giữa các engine trong cùng process)
+_encoder_cache = None
+_encoder_cache_lock = threading.Lock()
+
+
+def get_encoder_cache() -> Optional[EncoderCache]:
+    """Get encoder cache từ environment variables (None nếu ENCODER_CACHE_MAX_MB=0)"""
+    global _encoder_cache
+    with _encoder_cache_lock:
+        if _encoder_cache is None:
+            max_mb = float(os.environ.get('ENCODER_CACHE_MAX_MB', 256))
+            if max_mb <= 0:
+                return None
+            _encoder_cache = EncoderCache(max_bytes=int(max_mb * 1024 * 1024))
+        return _encoder_cache
+
+
+def encoder_cache_stats() -> Optional[dict]:
+    """Stats của encoder cache nếu đã có engine local sử dụng, None nếu chưa"""
+    return _encoder_cache.stats() if _encoder_cache is not None else None
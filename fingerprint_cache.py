@@ -0,0 +1,474 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cache kết quả transcription theo fingerprint âm thanh
+Tìm được cả audio gần giống (ghi âm lại, encode lại, metadata khác), không chỉ file trùng byte.
+
+Fingerprint: năng lượng log theo dải tần (thang mel) của các frame 64ms, cắt im lặng
+hai đầu, gộp về lưới thời gian cố định, trừ trung bình mỗi dải và mỗi đoạn (bỏ ảnh hưởng
+gain/mic), mỗi đoạn chuẩn hoá L2 riêng. Tìm kiếm gồm hai bước: phép nhân ma trận (cosine
+trung bình các đoạn) trên toàn bộ index để chọn ứng viên, rồi so từng đoạn thời gian với
+ứng viên: chỉ cần một phần audio khác (một câu, một từ) là không khớp.
+"""
+
+import json
+import os
+import shutil
+import subprocess
+import threading
+import time
+import wave
+from typing import Optional
+
+try:
+    import numpy as np
+except ImportError:  # numpy là tuỳ chọn, thiếu thì cache bị tắt
+    np = None
+
+# Tham số fingerprint
+FRAME_SECONDS = 0.064
+MAX_FREQUENCY = 4000.0
+N_BANDS = 48
+N_SEGMENTS = 48
+FINGERPRINT_DIM = N_BANDS * N_SEGMENTS
+SILENCE_RATIO = 1e-3  # frame có năng lượng < max * ratio (-30dB) được coi là im lặng
+FLOOR_RATIO = 1e-3  # sàn năng lượng của mỗi dải, để nhiễu nền không lấn át các đoạn nghỉ
+PAUSE_RATIO = 1e-2  # đoạn có năng lượng < đoạn lớn nhất * ratio (-20dB) là đoạn nghỉ, không so sánh
+MAX_LAG = 1  # số đoạn lệch tối đa khi so từng đoạn (bù sai lệch khi cắt im lặng)
+CANDIDATES = 8  # số ứng viên (cosine cao nhất) được so từng đoạn
+
+_band_matrices = {}
+
+
+def read_wav_samples(path: str):
+    """Đọc WAV PCM thành (samples float32 mono, sample_rate), None nếu không đọc được"""
+    try:
+        with wave.open(path, 'rb') as source:
+            channels = source.getnchannels()
+            width = source.getsampwidth()
+            rate = source.getframerate()
+            frames = source.readframes(source.getnframes())
+    except (wave.Error, EOFError):
+        return None
+
+    if width == 1:
+        samples = np.frombuffer(frames, dtype=np.uint8).astype(np.float32) - 128
+    elif width in (2, 4):
+        samples = np.frombuffer(frames, dtype=np.int16 if width == 2 else np.int32).astype(np.float32)
+    else:
+        return None
+    if channels > 1:
+        samples = samples[:len(samples) // channels * channels].reshape(-1, channels).mean(axis=1)
+    return samples, rate
+
+
+def read_samples_with_ffmpeg(path: str, rate: int = 16000):
+    """Decode các định dạng khác bằng ffmpeg (nếu có) thành PCM mono"""
+    if shutil.which("ffmpeg") is None:
+        return None
+    result = subprocess.run(
+        ["ffmpeg", "-nostdin", "-loglevel", "error", "-i", path,
+         "-ac", "1", "-ar", str(rate), "-f", "s16le", "-"],
+        capture_output=True
+    )
+    if result.returncode != 0 or not result.stdout:
+        return None
+    return np.frombuffer(result.stdout, dtype=np.int16).astype(np.float32), rate
+
+
+def _band_matrix(n_fft: int, rate: int):
+    """Ma trận (bins, N_BANDS) gộp các bin FFT thành dải tam giác trên thang mel"""
+    key = (n_fft, rate)
+    if key not in _band_matrices:
+        def mel(f):
+            return 2595 * np.log10(1 + f / 700)
+
+        def hz(m):
+            return 700 * (10 ** (m / 2595) - 1)
+
+        frequencies = np.fft.rfftfreq(n_fft, 1 / rate)
+        edges = hz(np.linspace(mel(50.0), mel(min(MAX_FREQUENCY, rate / 2)), N_BANDS + 2))
+        matrix = np.zeros((len(frequencies), N_BANDS), dtype=np.float32)
+        for band in range(N_BANDS):
+            low, center, high = edges[band], edges[band + 1], edges[band + 2]
+            rising = (frequencies - low) / (center - low)
+            falling = (high - frequencies) / (high - center)
+            matrix[:, band] = np.clip(np.minimum(rising, falling), 0, None)
+        _band_matrices[key] = matrix
+    return _band_matrices[key]
+
+
+def compute_fingerprint(samples, rate: int):
+    """
+    Fingerprint của audio
+
+    Returns:
+        tuple: (vector float32 đã chuẩn hoá L2, thời lượng phần có tiếng tính bằng giây),
+        None nếu audio quá ngắn hoặc im lặng
+    """
+    n_fft = int(FRAME_SECONDS * rate)
+    hop = n_fft // 2
+    if len(samples) < n_fft * N_SEGMENTS // 2:
+        return None
+
+    frames = np.lib.stride_tricks.sliding_window_view(samples, n_fft)[::hop]
+    spectrum = np.abs(np.fft.rfft(frames * np.hanning(n_fft).astype(np.float32), axis=1)) ** 2
+    bands = spectrum @ _band_matrix(n_fft, rate)
+
+    # Cắt im lặng hai đầu để bản ghi lại có padding khác vẫn khớp
+    energy = bands.sum(axis=1)
+    if energy.max() <= 0:
+        return None
+    voiced = np.flatnonzero(energy > energy.max() * SILENCE_RATIO)
+    bands = bands[voiced[0]:voiced[-1] + 1]
+    if len(bands) < N_SEGMENTS:
+        return None
+
+    log_bands = np.log(np.maximum(bands, bands.max() * FLOOR_RATIO))
+    segments = np.stack([segment.mean(axis=0) for segment in np.array_split(log_bands, N_SEGMENTS)])
+    loudness = np.array([segment.sum(axis=1).mean() for segment in np.array_split(bands, N_SEGMENTS)])
+    # Bỏ trung bình mỗi dải (đáp tuyến mic) và mỗi đoạn (âm lượng): chỉ giữ hình dạng phổ
+    segments = segments - segments.mean(axis=0) - segments.mean(axis=1, keepdims=True) + segments.mean()
+    norms = np.linalg.norm(segments, axis=1, keepdims=True)
+    voiced_segments = (loudness >= loudness.max() * PAUSE_RATIO) & (norms[:, 0] > 0)
+    if not voiced_segments.any():
+        return None
+    segments = np.where(voiced_segments[:, None], segments / np.maximum(norms, 1e-12), 0)
+    # Chia cho sqrt(số đoạn) để tích vô hướng hai vector ~ cosine trung bình các đoạn
+    vector = (segments / np.sqrt(voiced_segments.sum())).ravel().astype(np.float32)
+    return vector, len(bands) * hop / rate
+
+
+def _best_matches(first, second):
+    """
+    Với mỗi đoạn của `first`: cosine cao nhất với các đoạn của `second` lệch tối đa MAX_LAG,
+    kể cả vị trí nửa đoạn (trung bình hai đoạn liền nhau, cho đoạn nằm giữa hai âm)
+    """
+    halves = second[:-1] + second[1:]
+    halves /= np.maximum(np.linalg.norm(halves, axis=1, keepdims=True), 1e-12)
+    full = first @ second.T
+    half = first @ halves.T
+    index = np.arange(N_SEGMENTS)
+    best = np.full(N_SEGMENTS, -1.0)
+    for similarities, offsets in ((full, range(-MAX_LAG, MAX_LAG + 1)), (half, range(-MAX_LAG, MAX_LAG))):
+        for offset in offsets:
+            other = index + offset
+            valid = (other >= 0) & (other < similarities.shape[1])
+            best[valid] = np.maximum(best[valid], similarities[index[valid], other[valid]])
+    return best
+
+
+def segment_similarity(first, second) -> float:
+    """
+    So từng đoạn thời gian của hai fingerprint
+
+    Mỗi đoạn có tiếng được so với đoạn tương ứng của audio kia (cho phép lệch MAX_LAG đoạn);
+    đoạn có tiếng ở bên này nhưng là đoạn nghỉ ở bên kia được tính 0. Trả về điểm thấp thứ
+    hai (bỏ qua một đoạn ở biên), nên chỉ cần hai đoạn khác nhau là điểm thấp.
+    """
+    first = first.reshape(N_SEGMENTS, N_BANDS)
+    second = second.reshape(N_SEGMENTS, N_BANDS)
+    first_voiced = np.abs(first).sum(axis=1) > 0
+    second_voiced = np.abs(second).sum(axis=1) > 0
+    first = first / np.maximum(np.linalg.norm(first, axis=1, keepdims=True), 1e-12)
+    second = second / np.maximum(np.linalg.norm(second, axis=1, keepdims=True), 1e-12)
+
+    # Điểm mỗi đoạn: thấp hơn trong hai chiều so sánh (chỉ tính chiều có tiếng)
+    scores = np.minimum(np.where(first_voiced, _best_matches(first, second), np.inf),
+                        np.where(second_voiced, _best_matches(second, first), np.inf))
+    scores = np.sort(scores[first_voiced | second_voiced])
+    if len(scores) == 0:
+        return 0.0
+    return float(scores[min(1, len(scores) - 1)])
+
+
+def fingerprint_file(path: str):
+    """Fingerprint của một file audio, None nếu không decode được"""
+    try:
+        decoded = read_wav_samples(path) or read_samples_with_ffmpeg(path)
+        if decoded is None:
+            return None
+        return compute_fingerprint(*decoded)
+    except (OSError, ValueError) as e:
+        print(f"Không tính được fingerprint cho {path}: {e}")
+        return None
+
+
+class CacheLookup:
+    """Kết quả tra cache; giữ lại fingerprint để store() không phải tính lại"""
+
+    def __init__(self, audio_hash: str, params: str, fingerprint=None):
+        self.audio_hash = audio_hash
+        self.params = params
+        self.fingerprint = fingerprint
+        self.text = None
+        self.match = None  # "exact" | "near" | None
+        self.similarity = None
+
+
+class FingerprintCache:
+    """
+    Index fingerprint có giới hạn số entry (bỏ entry ít dùng gần đây nhất khi đầy),
+    lưu xuống đĩa để giữ qua các lần restart
+
+    Mỗi entry thuộc về một khoá tham số (model, language, task); chỉ entry cùng khoá
+    mới được so khớp. Trùng sha256 thì trả về ngay, không cần tính fingerprint.
+    Số khoá tham số bị giới hạn (`max_params`, khoá không còn entry nào được dùng lại)
+    vì language do client gửi lên.
+    """
+
+    def __init__(self,
+                 directory: str,
+                 capacity: int = 5000,
+                 threshold: float = 0.75,
+                 max_duration_diff: float = 0.1,
+                 max_seconds: float = 120,
+                 save_every: int = 20,
+                 max_params: int = 64,
+                 workers: int = 2):
+        """
+        Args:
+            max_params (int): Số khoá tham số tối đa; khi đủ, audio với khoá mới không được cache
+            workers (int): Số lookup (decode + tính fingerprint) chạy đồng thời, caller tự giới hạn
+        """
+        self.directory = directory
+        self.capacity = capacity
+        self.threshold = threshold
+        self.max_duration_diff = max_duration_diff
+        self.max_seconds = max_seconds
+        self.save_every = save_every
+        self.max_params = max_params
+        self.workers = max(1, workers)
+        self._lock = threading.Lock()
+        # Giữ thứ tự ghi file; ghi đĩa không giữ self._lock để lookup không phải chờ
+        self._save_lock = threading.Lock()
+
+        self._vectors = np.zeros((capacity, FINGERPRINT_DIM), dtype=np.float32)
+        # Thời lượng phần có tiếng; -1 nếu entry không có fingerprint (chỉ khớp theo hash)
+        self._durations = np.full(capacity, -1.0, dtype=np.float32)
+        self._params_ids = np.full(capacity, -1, dtype=np.int32)
+        self._last_used = np.zeros(capacity, dtype=np.float64)
+        self._hashes = [None] * capacity
+        self._texts = [None] * capacity
+        self._params = {}
+        self._params_names = []
+        self._exact = {}
+        self._size = 0
+        self._unsaved = 0
+
+        self._lookups = 0
+        self._exact_hits = 0
+        self._near_hits = 0
+        self._lookup_seconds = 0.0
+
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _params_id(self, params: str) -> Optional[int]:
+        """Id của khoá tham số (gọi khi đang giữ lock); None nếu đã đủ max_params khoá đang dùng"""
+        if params in self._params:
+            return self._params[params]
+        if len(self._params_names) < self.max_params:
+            params_id = len(self._params_names)
+            self._params_names.append(params)
+        else:
+            # Dùng lại id của khoá không còn entry nào
+            used = set(np.unique(self._params_ids[:self._size]).tolist())
+            params_id = next((index for index in range(len(self._params_names)) if index not in used), None)
+            if params_id is None:
+                return None
+            del self._params[self._params_names[params_id]]
+            self._params_names[params_id] = params
+        self._params[params] = params_id
+        return params_id
+
+    def lookup(self, audio_path: str, audio_hash: str, params: str, audio_duration: float) -> CacheLookup:
+        """
+        Tra cache cho một file audio (chạy trong thread, tính fingerprint tốn vài ms)
+
+        Args:
+            audio_path (str): File audio
+            audio_hash (str): sha256 của file
+            params (str): Khoá tham số (model, language, task)
+            audio_duration (float): Thời lượng ước lượng, file dài hơn max_seconds không tính fingerprint
+        """
+        result = CacheLookup(audio_hash, params)
+        with self._lock:
+            self._lookups += 1
+            slot = self._exact.get((audio_hash, params))
+            if slot is not None:
+                self._exact_hits += 1
+                self._last_used[slot] = time.time()
+                result.text, result.match, result.similarity = self._texts[slot], "exact", 1.0
+                return result
+
+        if audio_duration > self.max_seconds:
+            return result
+        result.fingerprint = fingerprint_file(audio_path)
+        if result.fingerprint is None:
+            return result
+
+        vector, voiced_seconds = result.fingerprint
+        start = time.perf_counter()
+        with self._lock:
+            params_id = self._params.get(params)
+            if params_id is not None and self._size:
+                size = self._size
+                scores = self._vectors[:size] @ vector
+                durations = self._durations[:size]
+                eligible = (self._params_ids[:size] == params_id) & \
+                    (np.abs(durations - voiced_seconds) <= self.max_duration_diff * voiced_seconds)
+                scores[~eligible] = -np.inf
+                candidates = np.argsort(scores)[::-1][:CANDIDATES]
+                best_slot, best_similarity = None, self.threshold
+                for slot in candidates:
+                    if scores[slot] == -np.inf:
+                        break
+                    similarity = segment_similarity(self._vectors[slot], vector)
+                    if similarity >= best_similarity:
+                        best_slot, best_similarity = int(slot), similarity
+                if best_slot is not None:
+                    self._near_hits += 1
+                    self._last_used[best_slot] = time.time()
+                    result.text, result.match = self._texts[best_slot], "near"
+                    result.similarity = round(best_similarity, 4)
+            self._lookup_seconds += time.perf_counter() - start
+        return result
+
+    def store(self, lookup: CacheLookup, text: str):
+        """Lưu transcription cho audio vừa tra cache (miss)"""
+        with self._lock:
+            if (lookup.audio_hash, lookup.params) in self._exact:
+                return
+            params_id = self._params_id(lookup.params)
+            if params_id is None:
+                return
+            if self._size < self.capacity:
+                slot = self._size
+                self._size += 1
+            else:
+                slot = int(np.argmin(self._last_used))
+                self._exact.pop((self._hashes[slot], self._params_names[self._params_ids[slot]]), None)
+
+            if lookup.fingerprint is not None:
+                self._vectors[slot], self._durations[slot] = lookup.fingerprint
+            else:
+                self._vectors[slot] = 0
+                self._durations[slot] = -1
+            self._params_ids[slot] = params_id
+            self._last_used[slot] = time.time()
+            self._hashes[slot] = lookup.audio_hash
+            self._texts[slot] = text
+            self._exact[(lookup.audio_hash, lookup.params)] = slot
+
+            self._unsaved += 1
+            should_save = self._unsaved >= self.save_every
+
+        if should_save:
+            self.save()
+
+    def _load(self):
+        meta_path = os.path.join(self.directory, "meta.json")
+        vectors_path = os.path.join(self.directory, "vectors.npy")
+        if not (os.path.exists(meta_path) and os.path.exists(vectors_path)):
+            return
+        try:
+            with open(meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+            vectors = np.load(vectors_path)
+        except (OSError, ValueError) as e:
+            print(f"Không đọc được fingerprint cache: {e}")
+            return
+        if meta.get("dim") != FINGERPRINT_DIM or vectors.shape[1:] != (FINGERPRINT_DIM,):
+            print("Fingerprint cache khác phiên bản, bỏ qua")
+            return
+
+        # Giữ các entry dùng gần đây nhất nếu capacity nhỏ hơn lúc lưu
+        order = np.argsort(meta["last_used"])[::-1][:self.capacity]
+        self._params_names = list(meta["params"])
+        self._params = {params: index for index, params in enumerate(self._params_names)}
+        for slot, index in enumerate(order):
+            self._vectors[slot] = vectors[index]
+            self._durations[slot] = meta["durations"][index]
+            self._params_ids[slot] = meta["params_ids"][index]
+            self._last_used[slot] = meta["last_used"][index]
+            self._hashes[slot] = meta["hashes"][index]
+            self._texts[slot] = meta["texts"][index]
+            self._exact[(self._hashes[slot], meta["params"][self._params_ids[slot]])] = slot
+        self._size = len(order)
+        print(f"Loaded {self._size} fingerprint cache entries")
+
+    def _snapshot(self):
+        """Bản sao index để ghi xuống đĩa (gọi khi đang giữ lock)"""
+        size = self._size
+        meta = {
+            "dim": FINGERPRINT_DIM,
+            "params": list(self._params_names),
+            "params_ids": self._params_ids[:size].tolist(),
+            "durations": self._durations[:size].tolist(),
+            "last_used": self._last_used[:size].tolist(),
+            "hashes": self._hashes[:size],
+            "texts": self._texts[:size],
+        }
+        self._unsaved = 0
+        return self._vectors[:size].copy(), meta
+
+    def _write(self, vectors, meta: dict):
+        """Ghi index xuống đĩa; ghi file tạm rồi rename"""
+        vectors_tmp = os.path.join(self.directory, "vectors.tmp.npy")
+        meta_tmp = os.path.join(self.directory, "meta.json.tmp")
+        np.save(vectors_tmp, vectors)
+        with open(meta_tmp, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(vectors_tmp, os.path.join(self.directory, "vectors.npy"))
+        os.replace(meta_tmp, os.path.join(self.directory, "meta.json"))
+
+    def save(self):
+        """Ghi index xuống đĩa nếu có thay đổi (blocking, gọi từ thread)"""
+        with self._save_lock:
+            with self._lock:
+                if not self._unsaved:
+                    return
+                vectors, meta = self._snapshot()
+            self._write(vectors, meta)
+
+    def stats(self) -> dict:
+        """Metrics cho endpoint /metrics"""
+        with self._lock:
+            near_lookups = self._lookups - self._exact_hits
+            return {
+                "size": self._size,
+                "capacity": self.capacity,
+                "threshold": self.threshold,
+                "lookups": self._lookups,
+                "exact_hits": self._exact_hits,
+                "near_hits": self._near_hits,
+                "hit_rate": round((self._exact_hits + self._near_hits) / self._lookups, 4) if self._lookups else 0.0,
+                "avg_index_search_ms": round(self._lookup_seconds / near_lookups * 1000, 4) if near_lookups else None,
+            }
+
+
+# Singleton pattern
+_fingerprint_cache = None
+
+
+def get_fingerprint_cache() -> Optional[FingerprintCache]:
+    """Get fingerprint cache (None nếu chưa bật FINGERPRINT_CACHE_ENABLED hoặc thiếu numpy)"""
+    global _fingerprint_cache
+    if _fingerprint_cache is None:
+        if os.environ.get('FINGERPRINT_CACHE_ENABLED', '0').lower() not in ('1', 'true', 'yes'):
+            return None
+        if np is None:
+            print("FINGERPRINT_CACHE_ENABLED nhưng chưa cài numpy, cache bị tắt")
+            return None
+        _fingerprint_cache = FingerprintCache(
+            directory=os.environ.get('FINGERPRINT_CACHE_DIR', '/tmp/whisper_fingerprints'),
+            capacity=int(os.environ.get('FINGERPRINT_CACHE_SIZE', 5000)),
+            threshold=float(os.environ.get('FINGERPRINT_THRESHOLD', 0.75)),
+            max_duration_diff=float(os.environ.get('FINGERPRINT_MAX_DURATION_DIFF', 0.1)),
+            max_seconds=float(os.environ.get('FINGERPRINT_MAX_SECONDS', 120)),
+            save_every=int(os.environ.get('FINGERPRINT_SAVE_EVERY', 20)),
+            max_params=int(os.environ.get('FINGERPRINT_MAX_PARAMS', 64)),
+            workers=int(os.environ.get('FINGERPRINT_WORKERS', 2)),
+        )
+    return _fingerprint_cache
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Hedged requests cho upstream API (HF Inference API)
+Nếu request chưa trả về sau percentile latency gần đây, gửi thêm một bản sao
+(cùng backend hoặc backend dự phòng), lấy kết quả thành công đầu tiên và huỷ bản còn lại.
+Số request hedge bị giới hạn bởi budget (tỉ lệ so với số request gốc).
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from typing import Awaitable, Callable, Optional
+
+
+class HedgeBudget:
+    """
+    Budget cho request hedge: mỗi request gốc nạp thêm `ratio` token (tối đa `burst`),
+    mỗi lần hedge tốn 1 token. ratio=0.1 nghĩa là tối đa ~10% request phát sinh thêm.
+    """
+
+    def __init__(self, ratio: float, burst: float):
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens = burst
+
+    def deposit(self):
+        self.tokens = min(self.burst, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class HedgedRequester:
+    """
+    Chạy một coroutine upstream với hedging
+
+    Delay trước khi hedge là percentile `percentile` của latency end-to-end các request
+    thành công gần đây (tối thiểu `min_delay`). Chưa đủ `min_samples` thì không hedge.
+    Khi hedge thắng, thời gian end-to-end vẫn được tính (request gốc đã chạy ít nhất
+    bằng khoảng này). Request lỗi không được tính: 503/429 trả về ngay sẽ kéo percentile
+    xuống và làm hedge quá sớm.
+    """
+
+    def __init__(self,
+                 percentile: float = 95,
+                 min_delay: float = 1.0,
+                 window: int = 200,
+                 min_samples: int = 20,
+                 budget_ratio: float = 0.1,
+                 budget_burst: float = 5):
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.budget = HedgeBudget(budget_ratio, budget_burst)
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._hedged = 0
+        self._hedge_wins = 0
+        self._skipped_budget = 0
+
+    def record(self, latency: float):
+        with self._lock:
+            self._latencies.append(latency)
+
+    def hedge_delay(self) -> Optional[float]:
+        """Số giây chờ trước khi hedge, None nếu chưa đủ mẫu"""
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            latencies = sorted(self._latencies)
+        index = min(len(latencies) - 1, int(round(self.percentile / 100 * (len(latencies) - 1))))
+        return max(self.min_delay, latencies[index])
+
+    async def run(self, primary: Callable[[], Awaitable], hedge: Callable[[], Awaitable]):
+        """
+        Args:
+            primary: Tạo coroutine request gốc
+            hedge: Tạo coroutine request hedge (cùng backend hoặc backend dự phòng)
+
+        Returns:
+            Kết quả thành công đầu tiên; nếu tất cả đều lỗi thì raise lỗi của request gốc
+        """
+        with self._lock:
+            self._requests += 1
+            self.budget.deposit()
+
+        start = time.perf_counter()
+        result = await self._race(primary, hedge)
+        self.record(time.perf_counter() - start)
+        return result
+
+    async def _race(self, primary: Callable[[], Awaitable], hedge: Callable[[], Awaitable]):
+        delay = self.hedge_delay()
+        primary_task = asyncio.ensure_future(primary())
+        hedge_task = None
+        try:
+            if delay is None:
+                return await primary_task
+
+            done, _ = await asyncio.wait({primary_task}, timeout=delay)
+            if done:
+                return primary_task.result()
+
+            with self._lock:
+                allowed = self.budget.withdraw()
+                if allowed:
+                    self._hedged += 1
+                else:
+                    self._skipped_budget += 1
+            if not allowed:
+                return await primary_task
+
+            hedge_task = asyncio.ensure_future(hedge())
+            pending = {primary_task, hedge_task}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge_task:
+                            with self._lock:
+                                self._hedge_wins += 1
+                        return task.result()
+            # Cả hai đều lỗi
+            return primary_task.result()
+        finally:
+            for task in (primary_task, hedge_task):
+                if task is not None and not task.done():
+                    task.cancel()
+
+    def stats(self) -> dict:
+        """Metrics cho endpoint /metrics"""
+        delay = self.hedge_delay()
+        with self._lock:
+            return {
+                "requests": self._requests,
+                "hedged": self._hedged,
+                "hedge_wins": self._hedge_wins,
+                "skipped_budget": self._skipped_budget,
+                "hedge_rate": round(self._hedged / self._requests, 4) if self._requests else 0.0,
+                "hedge_delay_seconds": round(delay, 3) if delay is not None else None,
+                "percentile": self.percentile,
+                "budget_ratio": self.budget.ratio,
+                "budget_tokens": round(self.budget.tokens, 2),
+                "samples": len(self._latencies),
+            }
+
+
+# Singleton pattern
+_hedged_requester = None
+
+
+def get_hedged_requester() -> Optional[HedgedRequester]:
+    """Get hedged requester (None nếu chưa bật HEDGE_ENABLED)"""
+    global _hedged_requester
+    if _hedged_requester is None:
+        if os.environ.get('HEDGE_ENABLED', '0').lower() not in ('1', 'true', 'yes'):
+            return None
+        _hedged_requester = HedgedRequester(
+            percentile=float(os.environ.get('HEDGE_PERCENTILE', 95)),
+            min_delay=float(os.environ.get('HEDGE_MIN_DELAY_SECONDS', 1)),
+            window=int(os.environ.get('HEDGE_WINDOW', 200)),
+            min_samples=int(os.environ.get('HEDGE_MIN_SAMPLES', 20)),
+            budget_ratio=float(os.environ.get('HEDGE_BUDGET_RATIO', 0.1)),
+            budget_burst=float(os.environ.get('HEDGE_BUDGET_BURST', 5)),
+        )
+    return _hedged_requester
@@ -6,20 +6,56 @@ Không cần PyTorch/Transformers - giảm drastically image size
 """
 
 import requests
+import httpx
+import base64
 import json
 import os
 import tempfile
-from typing import Union, Optional
+from typing import AsyncIterator, Union, Optional
 import asyncio
 import aiofiles
 
+from tracing import span
+from chunked_transcription import get_resumable_transcriber, split_audio
+from hedging import get_hedged_requester
+from decoding_profiles import DecodingProfile
+
+# Các service trả về thông báo lỗi dưới dạng text thay vì raise,
+# những kết quả này không được cache
+ERROR_RESULT_PREFIXES = (
+    "Model đang loading",
+    "Rate limit exceeded",
+    "HF API Error",
+    "Network error",
+    "Transcription error",
+    "OpenAI API Error",
+    "OpenAI transcription error",
+    "Error: OpenAI API key",
+    "[Fallback Service]",
+    "Fallback service error",
+)
+
+
+def is_error_result(text: str) -> bool:
+    """Kết quả transcribe có phải là thông báo lỗi không"""
+    return not text or text.startswith(ERROR_RESULT_PREFIXES)
+
+
+class UpstreamError(Exception):
+    """Lỗi từ HF Inference API (status code None nếu là lỗi mạng)"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
 class LightweightWhisperService:
     """
     Lightweight Whisper service sử dụng external API thay vì local model
     Giảm Docker image size từ 8GB xuống < 500MB
     """
 
-        def __init__(self):
+    def __init__(self):
         # Ưu tiên sử dụng Hugging Face Inference API (miễn phí)
         self.api_url = "https://api-inference.huggingface.co/models/openai/whisper-small"
         self.model = "openai/whisper-small"
@@ -28,6 +64,16 @@ class LightweightWhisperService:
         self.api_key = os.environ.get('HF_API_KEY') or os.environ.get('HUGGINGFACE_API_KEY')
         self.use_hf = True  # Luôn sử dụng HF API
 
+        # Backend dự phòng cho request hedge (mặc định hedge về cùng API)
+        self.alternate_api_url = os.environ.get('HF_ALTERNATE_API_URL') or self.api_url
+        self.hedger = get_hedged_requester()
+
+        # Connection pool dùng chung; request bị huỷ (hedge thua) sẽ đóng connection ngay
+        self.client = httpx.AsyncClient(
+            timeout=60,  # HF API có thể mất thời gian load model lần đầu
+            limits=httpx.Limits(max_connections=int(os.environ.get('HF_MAX_CONNECTIONS', 20)))
+        )
+
         print(f"Initialized Hugging Face Whisper Inference API")
         if self.api_key:
             print("Using authenticated HF API (higher rate limits)")
@@ -42,56 +88,256 @@ class LightweightWhisperService:
         # Không cần preprocessing phức tạp
         return audio_path
 
-    async def transcribe_with_hf(self, audio_path: str, language: Optional[str] = None) -> str:
+    def model_api_url(self, profile: Optional[DecodingProfile] = None) -> str:
+        """URL của model theo decoding profile (model mặc định nếu không có profile)"""
+        if profile is None or profile.model == self.model:
+            return self.api_url
+        return f"https://api-inference.huggingface.co/models/{profile.model}"
+
+    def hf_headers(self) -> dict:
+        headers = {}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        return headers
+
+    def hf_generate_kwargs(self, language: Optional[str] = None, task: str = "transcribe",
+                           profile: Optional[DecodingProfile] = None) -> dict:
+        """generate_kwargs gửi kèm audio (rỗng nếu gửi raw bytes là đủ)"""
+        generate_kwargs = {}
+        if language:
+            generate_kwargs["language"] = language
+        if task and task != "transcribe":
+            generate_kwargs["task"] = task
+        if profile is not None:
+            generate_kwargs.update(profile.generate_kwargs())
+
+        if language:
+            # Với language cố định, task mặc định cũng được gửi rõ ràng
+            generate_kwargs.setdefault("task", task)
+        return generate_kwargs
+
+    def build_hf_payload(self, audio_data: bytes, language: Optional[str] = None,
+                         task: str = "transcribe",
+                         profile: Optional[DecodingProfile] = None) -> tuple:
         """
-        Transcribe using Hugging Face Inference API (FREE) - simplified version
+        Tạo headers và body cho HF Inference API
+
+        Không có tham số: gửi raw audio bytes (như trước).
+        Có language, task translate hoặc profile đổi tham số decode (num_beams,
+        max_new_tokens): gửi JSON với audio base64 và generate_kwargs.
         """
-        try:
-            # Setup headers for binary audio data
-            headers = {}
-            if self.api_key:
-                headers["Authorization"] = f"Bearer {self.api_key}"
+        headers = self.hf_headers()
+        generate_kwargs = self.hf_generate_kwargs(language, task, profile)
 
-            # Đọc audio data trực tiếp
-            async with aiofiles.open(audio_path, 'rb') as f:
-                audio_data = await f.read()
+        if not generate_kwargs:
+            return headers, audio_data
 
-            # Call Hugging Face Inference API
-            response = requests.post(
-                self.api_url,
-                headers=headers,
-                data=audio_data,
-                timeout=60  # HF API có thể mất thời gian load model lần đầu
-            )
+        headers["Content-Type"] = "application/json"
+        body = json.dumps({
+            "inputs": base64.b64encode(audio_data).decode('ascii'),
+            "parameters": {"generate_kwargs": generate_kwargs}
+        })
+        return headers, body
 
-            if response.status_code == 200:
+    async def _post_hf(self, api_url: str, headers: dict, body, span_name: str) -> str:
+        """
+        Gửi một request tới HF Inference API
+
+        Raises:
+            UpstreamError: Khi API trả lỗi (503 loading, 429 rate limit, ...) hoặc lỗi mạng
+        """
+        with span(span_name):
+            try:
+                response = await self.client.post(api_url, headers=headers, content=body)
+            except httpx.HTTPError as e:
+                raise UpstreamError(f"Network error: {str(e)}")
+
+        if response.status_code == 200:
+            with span("parse_response"):
                 result = response.json()
-                # HF API trả về format: {"text": "transcription"}
-                if isinstance(result, dict):
-                    return result.get('text', 'No transcription available')
-                elif isinstance(result, list) and len(result) > 0:
-                    return result[0].get('text', 'No transcription available')
-                else:
-                    return str(result)
-            elif response.status_code == 503:
-                return "Model đang loading, vui lòng thử lại sau 30-60 giây"
-            elif response.status_code == 429:
-                return "Rate limit exceeded, vui lòng thử lại sau"
+            # HF API trả về format: {"text": "transcription"}
+            if isinstance(result, dict):
+                return result.get('text', 'No transcription available')
+            elif isinstance(result, list) and len(result) > 0:
+                return result[0].get('text', 'No transcription available')
             else:
-                error_msg = f"HF API Error: {response.status_code}"
-                try:
-                    error_detail = response.json()
-                    if 'error' in error_detail:
-                        error_msg += f" - {error_detail['error']}"
-                except:
-                    error_msg += f" - {response.text[:200]}"
-                return error_msg
+                return str(result)
+        elif response.status_code == 503:
+            raise UpstreamError("Model đang loading, vui lòng thử lại sau 30-60 giây", 503)
+        elif response.status_code == 429:
+            raise UpstreamError("Rate limit exceeded, vui lòng thử lại sau", 429)
+        else:
+            error_msg = f"HF API Error: {response.status_code}"
+            try:
+                error_detail = response.json()
+                if 'error' in error_detail:
+                    error_msg += f" - {error_detail['error']}"
+            except:
+                error_msg += f" - {response.text[:200]}"
+            raise UpstreamError(error_msg, response.status_code)
+
+    def build_hf_stream(self, chunks: AsyncIterator[bytes], language: Optional[str] = None,
+                        task: str = "transcribe", profile: Optional[DecodingProfile] = None,
+                        size: Optional[int] = None) -> tuple:
+        """
+        Như build_hf_payload nhưng body là async iterator, chuyển tiếp từng chunk
+
+        Khi cần JSON, audio được base64 theo từng khối 3 byte ngay khi chunk tới.
+        Nếu biết trước kích thước audio (Content-Length của client) thì gửi kèm
+        Content-Length, không thì dùng chunked transfer encoding.
+        """
+        headers = self.hf_headers()
+        generate_kwargs = self.hf_generate_kwargs(language, task, profile)
+
+        if not generate_kwargs:
+            if size is not None:
+                headers["Content-Length"] = str(size)
+            return headers, chunks
 
-        except requests.RequestException as e:
-            return f"Network error: {str(e)}"
+        prefix = b'{"inputs": "'
+        suffix = b'", "parameters": ' + json.dumps({"generate_kwargs": generate_kwargs}).encode('ascii') + b'}'
+
+        async def body():
+            yield prefix
+            pending = b''
+            async for chunk in chunks:
+                pending += chunk
+                cut = len(pending) - len(pending) % 3
+                if cut:
+                    yield base64.b64encode(pending[:cut])
+                    pending = pending[cut:]
+            yield base64.b64encode(pending) + suffix
+
+        headers["Content-Type"] = "application/json"
+        if size is not None:
+            headers["Content-Length"] = str(len(prefix) + (size + 2) // 3 * 4 + len(suffix))
+        return headers, body()
+
+    async def request_hf(self, audio_data: bytes, language: Optional[str] = None,
+                         task: str = "transcribe",
+                         profile: Optional[DecodingProfile] = None) -> str:
+        """
+        Gọi HF Inference API, có hedging nếu bật HEDGE_ENABLED
+
+        Khi request chưa trả về sau percentile latency gần đây, một bản sao được gửi
+        tới HF_ALTERNATE_API_URL (hoặc cùng API); lấy kết quả đầu tiên, huỷ request còn lại.
+        Với profile dùng model khác model mặc định, bản sao được gửi tới cùng model.
+
+        Raises:
+            UpstreamError: Khi API trả lỗi (503 loading, 429 rate limit, ...) hoặc lỗi mạng
+        """
+        headers, body = self.build_hf_payload(audio_data, language, task, profile)
+        api_url = self.model_api_url(profile)
+
+        if self.hedger is None:
+            return await self._post_hf(api_url, headers, body, "hf_upstream_request")
+
+        alternate_api_url = self.alternate_api_url if api_url == self.api_url else api_url
+        return await self.hedger.run(
+            lambda: self._post_hf(api_url, headers, body, "hf_upstream_request"),
+            lambda: self._post_hf(alternate_api_url, headers, body, "hf_hedge_request"),
+        )
+
+    async def close(self):
+        await self.client.aclose()
+
+    async def transcribe_with_hf(self, audio_path: str, language: Optional[str] = None,
+                                 task: str = "transcribe",
+                                 profile: Optional[DecodingProfile] = None) -> str:
+        """
+        Transcribe using Hugging Face Inference API (FREE) - simplified version
+        """
+        try:
+            # Đọc audio data trực tiếp
+            with span("read_audio_file"):
+                async with aiofiles.open(audio_path, 'rb') as f:
+                    audio_data = await f.read()
+
+            return await self.request_hf(audio_data, language, task, profile)
+
+        except UpstreamError as e:
+            return str(e)
+        except Exception as e:
+            return f"Transcription error: {str(e)}"
+
+    async def transcribe_stream(self, chunks: AsyncIterator[bytes], language: Optional[str] = None,
+                                task: str = "transcribe", profile: Optional[DecodingProfile] = None,
+                                size: Optional[int] = None) -> str:
+        """
+        Pass-through: mở request tới HF API ngay và chuyển tiếp audio khi nhận được
+
+        Upload của client và upload tới HF chạy song song thay vì nối tiếp. httpx chỉ đọc
+        chunk tiếp theo khi đã gửi xong chunk trước, nên client upload nhanh hơn HF
+        sẽ bị chậm lại (backpressure). Body chỉ đọc được một lần nên không hedge.
+
+        Args:
+            chunks: Async iterator các chunk audio (ví dụ AudioStream)
+            size (Optional[int]): Kích thước audio nếu biết trước
+
+        Raises:
+            Lỗi của chính stream (ví dụ AudioTooLargeError, client ngắt kết nối) được
+            raise lại; lỗi từ HF API trả về dạng text như transcribe()
+        """
+        stream_error = None
+
+        async def guarded():
+            # Giữ lại lỗi của stream input, để không bị nhầm với lỗi mạng tới HF
+            nonlocal stream_error
+            try:
+                async for chunk in chunks:
+                    yield chunk
+            except Exception as e:
+                stream_error = e
+                raise
+
+        headers, body = self.build_hf_stream(guarded(), language, task, profile, size)
+        try:
+            return await self._post_hf(self.model_api_url(profile), headers, body, "hf_upstream_stream")
+        except UpstreamError as e:
+            if stream_error is not None:
+                raise stream_error
+            return str(e)
         except Exception as e:
+            if stream_error is not None:
+                raise stream_error
             return f"Transcription error: {str(e)}"
 
+    async def transcribe_resumable(self, audio_path: str, audio_hash: str,
+                                   language: Optional[str] = None,
+                                   task: str = "transcribe",
+                                   profile: Optional[DecodingProfile] = None) -> Optional[dict]:
+        """
+        Transcribe file dài theo từng chunk có checkpoint
+
+        Mỗi chunk được gửi riêng tới HF API và lưu lại ngay khi xong; nếu một chunk
+        lỗi (503, rate limit, mạng), lần gọi sau với cùng audio chỉ xử lý các chunk còn thiếu.
+
+        Returns:
+            Optional[dict]: text, chunks_total, chunks_reused, chunks_processed;
+            None nếu file không cắt được thành nhiều chunk
+
+        Raises:
+            IncompleteTranscriptionError: Khi một chunk lỗi
+        """
+        transcriber = get_resumable_transcriber()
+        chunk_seconds = transcriber.chunk_seconds
+        params = f"{self.model}|{language}|{task}"
+        if profile is not None:
+            chunk_seconds = profile.chunk_seconds or chunk_seconds
+            params = f"{profile.model}|{language}|{task}|{profile.name}|{chunk_seconds}"
+
+        with span("split_audio"):
+            chunks = await asyncio.to_thread(split_audio, audio_path, chunk_seconds)
+        if not chunks or len(chunks) < 2:
+            return None
+
+        return await transcriber.run(
+            chunks,
+            audio_hash,
+            params,
+            lambda chunk: self.request_hf(chunk, language, task, profile)
+        )
+
     async def transcribe_with_openai(self, audio_path: str, language: Optional[str] = None) -> str:
         """
         Transcribe using OpenAI API (PAID but higher quality)
@@ -139,9 +385,17 @@ class LightweightWhisperService:
                 except:
                     pass
 
-    async def transcribe(self, audio: Union[str, bytes], language: Optional[str] = None) -> str:
+    async def transcribe(self, audio: Union[str, bytes], language: Optional[str] = None,
+                         task: str = "transcribe",
+                         profile: Optional[DecodingProfile] = None) -> str:
         """
         Main transcription method - luôn sử dụng Hugging Face API
+
+        Args:
+            audio: Đường dẫn file hoặc audio bytes
+            language: Mã ngôn ngữ, bỏ qua language detection nếu được chỉ định
+            task: "transcribe" hoặc "translate" (dịch sang tiếng Anh)
+            profile: Decoding profile (model, num_beams, max_new_tokens), None để dùng mặc định
         """
         # Handle bytes input (from uploaded files)
         if isinstance(audio, bytes):
@@ -153,7 +407,7 @@ class LightweightWhisperService:
 
         try:
             # Luôn sử dụng Hugging Face Inference API
-            return await self.transcribe_with_hf(audio_path, language)
+            return await self.transcribe_with_hf(audio_path, language, task, profile)
         finally:
             # Cleanup temporary file if created
             if isinstance(audio, bytes):
@@ -171,7 +425,8 @@ class FallbackWhisperService:
     def __init__(self):
         print("Using fallback Whisper service")
 
-    async def transcribe(self, audio: Union[str, bytes], language: Optional[str] = None) -> str:
+    async def transcribe(self, audio: Union[str, bytes], language: Optional[str] = None,
+                         task: str = "transcribe", profile: Optional[DecodingProfile] = None) -> str:
         try:
             if isinstance(audio, bytes):
                 file_size = len(audio)
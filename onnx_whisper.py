@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Whisper inference bằng ONNX Runtime trên CPU
+- Export encoder và decoder (có KV-cache) sang ONNX một lần, lưu trong ONNX_MODEL_DIR
+- Greedy decoding bằng numpy, lúc chạy không cần torch (torch chỉ dùng khi export)
+- Tuỳ chọn quantize int8 (dynamic quantization của onnxruntime)
+"""
+
+import json
+import os
+import threading
+import warnings
+from typing import Union, Optional
+
+import numpy as np
+import onnxruntime as ort
+import librosa
+from transformers import WhisperProcessor, GenerationConfig
+from transformers.models.whisper.tokenization_whisper import TO_LANGUAGE_CODE
+
+from tracing import span
+from decoding_profiles import DecodingProfile
+
+# Tắt các warning không cần thiết
+warnings.filterwarnings("ignore")
+
+# Tăng khi thay đổi cấu trúc graph để các bản export cũ được export lại
+EXPORT_VERSION = 1
+
+
+def export_whisper_onnx(model, directory: str, opset: int = 17):
+    """
+    Export Whisper sang hai graph ONNX
+
+    - encoder.onnx: input_features -> cross_key_i, cross_value_i (K/V của cross-attention
+      cho từng layer decoder, tính một lần cho mỗi audio)
+    - decoder.onnx: input_ids, past_key_i, past_value_i, cross_key_i, cross_value_i
+      -> logits (token cuối), present_key_i, present_value_i
+
+    Decoder step được viết lại với KV-cache dạng tensor thường (không dùng Cache object
+    của transformers) để graph export ổn định giữa các phiên bản.
+
+    Args:
+        model: WhisperForConditionalGeneration (torch)
+        directory (str): Thư mục lưu graph và config.json
+    """
+    import torch
+    from torch import nn
+
+    encoder = model.model.encoder
+    decoder = model.model.decoder
+    layers = decoder.layers
+    num_layers = len(layers)
+    num_heads = layers[0].self_attn.num_heads
+    head_dim = layers[0].self_attn.head_dim
+
+    def split_heads(x):
+        return x.reshape(x.shape[0], x.shape[1], num_heads, head_dim).transpose(1, 2)
+
+    def attention(attn, query, key, value, bias=None):
+        scores = torch.matmul(split_heads(attn.q_proj(query)) * attn.scaling, key.transpose(-1, -2))
+        if bias is not None:
+            scores = scores + bias
+        output = torch.matmul(torch.softmax(scores, dim=-1), value)
+        output = output.transpose(1, 2).reshape(query.shape[0], query.shape[1], num_heads * head_dim)
+        return attn.out_proj(output)
+
+    # Model được đăng ký làm submodule để weights được export thành initializer
+    class EncoderGraph(nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.model = model
+
+        def forward(self, input_features):
+            hidden_states = encoder(input_features).last_hidden_state
+            outputs = []
+            for layer in layers:
+                outputs.append(split_heads(layer.encoder_attn.k_proj(hidden_states)))
+                outputs.append(split_heads(layer.encoder_attn.v_proj(hidden_states)))
+            return tuple(outputs)
+
+    class DecoderGraph(nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.model = model
+
+        def forward(self, input_ids, *cache):
+            past, cross = cache[:2 * num_layers], cache[2 * num_layers:]
+            past_length = past[0].shape[2]
+            positions = torch.arange(input_ids.shape[1]) + past_length
+            hidden_states = decoder.embed_tokens(input_ids) + decoder.embed_positions.weight[positions]
+
+            # Causal mask: token ở vị trí p chỉ nhìn thấy các vị trí <= p
+            key_positions = torch.arange(past_length + input_ids.shape[1])
+            bias = (key_positions[None, :] > positions[:, None]).to(hidden_states.dtype) * -1e9
+
+            presents = []
+            for index, layer in enumerate(layers):
+                residual = hidden_states
+                normed = layer.self_attn_layer_norm(hidden_states)
+                key = torch.cat([past[2 * index], split_heads(layer.self_attn.k_proj(normed))], dim=2)
+                value = torch.cat([past[2 * index + 1], split_heads(layer.self_attn.v_proj(normed))], dim=2)
+                presents += [key, value]
+                hidden_states = residual + attention(layer.self_attn, normed, key, value, bias)
+
+                residual = hidden_states
+                normed = layer.encoder_attn_layer_norm(hidden_states)
+                hidden_states = residual + attention(layer.encoder_attn, normed,
+                                                     cross[2 * index], cross[2 * index + 1])
+
+                residual = hidden_states
+                normed = layer.final_layer_norm(hidden_states)
+                hidden_states = residual + layer.fc2(layer.activation_fn(layer.fc1(normed)))
+
+            hidden_states = decoder.layer_norm(hidden_states[:, -1:, :])
+            return (model.proj_out(hidden_states), *presents)
+
+    os.makedirs(directory, exist_ok=True)
+    model = model.float().eval()
+    cross_names = [f"cross_{kind}_{i}" for i in range(num_layers) for kind in ("key", "value")]
+    past_names = [f"past_{kind}_{i}" for i in range(num_layers) for kind in ("key", "value")]
+    present_names = [f"present_{kind}_{i}" for i in range(num_layers) for kind in ("key", "value")]
+
+    input_features = torch.zeros(1, model.config.num_mel_bins, 2 * model.config.max_source_positions)
+    with torch.no_grad():
+        cross = EncoderGraph()(input_features)
+        torch.onnx.export(
+            EncoderGraph(), (input_features,), os.path.join(directory, "encoder.onnx"),
+            input_names=["input_features"], output_names=cross_names,
+            dynamic_axes={name: {0: "batch"} for name in ["input_features"] + cross_names},
+            opset_version=opset, dynamo=False,
+        )
+
+        input_ids = torch.zeros(1, 2, dtype=torch.long)
+        past = [torch.zeros(1, num_heads, 3, head_dim) for _ in past_names]
+        dynamic_axes = {"input_ids": {0: "batch", 1: "tokens"}, "logits": {0: "batch"}}
+        dynamic_axes.update({name: {0: "batch", 2: "past"} for name in past_names})
+        dynamic_axes.update({name: {0: "batch"} for name in cross_names})
+        dynamic_axes.update({name: {0: "batch", 2: "total"} for name in present_names})
+        torch.onnx.export(
+            DecoderGraph(), (input_ids, *past, *cross), os.path.join(directory, "decoder.onnx"),
+            input_names=["input_ids"] + past_names + cross_names,
+            output_names=["logits"] + present_names,
+            dynamic_axes=dynamic_axes,
+            opset_version=opset, dynamo=False,
+        )
+
+    with open(os.path.join(directory, "config.json"), 'w') as f:
+        json.dump({
+            "export_version": EXPORT_VERSION,
+            "num_layers": num_layers,
+            "num_heads": num_heads,
+            "head_dim": head_dim,
+            "max_target_positions": model.config.max_target_positions,
+        }, f)
+
+
+def quantize_whisper_onnx(directory: str):
+    """Tạo encoder.int8.onnx / decoder.int8.onnx (weight int8, activation quantize động)"""
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    for name in ("encoder", "decoder"):
+        quantize_dynamic(
+            os.path.join(directory, f"{name}.onnx"),
+            os.path.join(directory, f"{name}.int8.onnx"),
+            weight_type=QuantType.QInt8,
+        )
+
+    # Ghi sau cùng: graph int8 chỉ hợp lệ với đúng bản export đã dùng để quantize
+    with open(os.path.join(directory, "int8.json"), 'w') as f:
+        json.dump({"export_version": EXPORT_VERSION}, f)
+
+
+def read_export_version(path: str) -> Optional[int]:
+    """export_version trong config.json / int8.json, None nếu chưa có file"""
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f).get("export_version")
+
+
+class OnnxWhisperConnection:
+    """
+    Whisper chạy bằng ONNX Runtime, cùng interface transcribe(audio, language) với
+    WhisperConnection/OptimizedWhisperConnection
+
+    Lần đầu chạy sẽ export model từ Hugging Face (cần torch), các lần sau chỉ load
+    graph ONNX đã lưu.
+    """
+
+    def __init__(self,
+                 model_name: str = "openai/whisper-small",
+                 model_dir: Optional[str] = None,
+                 intra_op_threads: int = 0,
+                 inter_op_threads: int = 1,
+                 quantize: bool = False):
+        """
+        Args:
+            model_name (str): Tên model trên Hugging Face
+            model_dir (Optional[str]): Thư mục chứa graph ONNX (default: ONNX_MODEL_DIR/<model>)
+            intra_op_threads (int): Số thread trong một operator (0 = onnxruntime tự chọn)
+            inter_op_threads (int): Số operator chạy song song
+            quantize (bool): Dùng graph int8
+        """
+        self.model_name = model_name
+        self.model_dir = model_dir or os.path.join(
+            os.environ.get('ONNX_MODEL_DIR', '/tmp/whisper_onnx'), model_name.replace('/', '--')
+        )
+        self.quantize = quantize
+        self._prompt_ids_cache = {}
+        self._prompt_ids_lock = threading.Lock()
+
+        print(f"Initializing ONNX Runtime Whisper model: {model_name}")
+        self.processor = WhisperProcessor.from_pretrained(model_name)
+        self.generation_config = GenerationConfig.from_pretrained(model_name)
+        self._ensure_exported()
+        self._load_sessions(intra_op_threads, inter_op_threads)
+        print("Model loaded successfully!")
+
+    def _ensure_exported(self):
+        exported = read_export_version(os.path.join(self.model_dir, "config.json")) == EXPORT_VERSION
+        if not exported:
+            print(f"Exporting {self.model_name} sang ONNX ({self.model_dir})...")
+            from transformers import WhisperForConditionalGeneration
+            model = WhisperForConditionalGeneration.from_pretrained(self.model_name)
+            export_whisper_onnx(model, self.model_dir)
+            del model
+
+        # Graph int8 cũ (quantize từ bản export trước EXPORT_VERSION hiện tại) phải tạo lại
+        quantized = read_export_version(os.path.join(self.model_dir, "int8.json")) == EXPORT_VERSION
+        if self.quantize and (not exported or not quantized):
+            print("Quantizing ONNX graphs sang int8...")
+            quantize_whisper_onnx(self.model_dir)
+
+    def _load_sessions(self, intra_op_threads: int, inter_op_threads: int):
+        with open(os.path.join(self.model_dir, "config.json")) as f:
+            config = json.load(f)
+        self.num_layers = config["num_layers"]
+        self.num_heads = config["num_heads"]
+        self.head_dim = config["head_dim"]
+        self.max_target_positions = config["max_target_positions"]
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = inter_op_threads
+        suffix = ".int8.onnx" if self.quantize else ".onnx"
+        self.encoder = ort.InferenceSession(os.path.join(self.model_dir, "encoder" + suffix),
+                                            options, providers=["CPUExecutionProvider"])
+        self.decoder = ort.InferenceSession(os.path.join(self.model_dir, "decoder" + suffix),
+                                            options, providers=["CPUExecutionProvider"])
+
+        self.cross_names = [f"cross_{kind}_{i}" for i in range(self.num_layers) for kind in ("key", "value")]
+        self.past_names = [f"past_{kind}_{i}" for i in range(self.num_layers) for kind in ("key", "value")]
+
+    def get_decoder_prompt(self, language: Optional[str], task: str = "transcribe") -> list:
+        """Token prompt <|startoftranscript|><|lang|><|task|><|notimestamps|> (không có lang nếu None)"""
+        key = (language, task)
+        prompt = self._prompt_ids_cache.get(key)
+        if prompt is None:
+            with self._prompt_ids_lock:
+                config = self.generation_config
+                prompt = [config.decoder_start_token_id]
+                if language is not None:
+                    code = TO_LANGUAGE_CODE.get(language.lower(), language.lower())
+                    token = f"<|{code}|>"
+                    if token not in config.lang_to_id:
+                        raise ValueError(f"Ngôn ngữ không được hỗ trợ: {language}")
+                    prompt.append(config.lang_to_id[token])
+                prompt += [config.task_to_id[task], config.no_timestamps_token_id]
+                self._prompt_ids_cache[key] = prompt
+        return prompt
+
+    def load_audio(self, audio_path: str, target_sr: int = 16000) -> np.ndarray:
+        """Load audio mono 16kHz"""
+        try:
+            audio, sr = librosa.load(audio_path, sr=target_sr, mono=True)
+            return audio
+        except Exception as e:
+            print(f"Error loading audio: {e}")
+            return None
+
+    def _run_decoder(self, input_ids: list, past: list, cross: list) -> tuple:
+        feeds = {"input_ids": np.array([input_ids], dtype=np.int64)}
+        feeds.update(zip(self.past_names, past))
+        feeds.update(zip(self.cross_names, cross))
+        outputs = self.decoder.run(None, feeds)
+        return outputs[0][0, -1], outputs[1:]
+
+    def extract_features(self, audio_data: np.ndarray) -> np.ndarray:
+        """Log-mel features (1, n_mels, 3000) của audio 16kHz"""
+        return self.processor(audio_data, sampling_rate=16000, return_tensors="np").input_features
+
+    def encode(self, input_features: np.ndarray) -> list:
+        """Chạy encoder, trả về cross-attention key/value cho từng layer decoder"""
+        with span("encoder"):
+            return self.encoder.run(None, {"input_features": input_features.astype(np.float32)})
+
+    def decode(self, cross: list, language: Optional[str] = None,
+               task: str = "transcribe", profile: Optional[DecodingProfile] = None) -> list:
+        """
+        Greedy decoding với KV-cache
+
+        Args:
+            cross (list): Output của encode()
+            profile (Optional[DecodingProfile]): Chỉ dùng max_new_tokens (backend này luôn greedy)
+
+        Returns:
+            list: Token ids đã sinh (gồm cả prompt)
+        """
+        config = self.generation_config
+        past = [np.zeros((1, self.num_heads, 0, self.head_dim), dtype=np.float32) for _ in self.past_names]
+        prompt = self.get_decoder_prompt(language, task)
+
+        if language is None:
+            # Nhận diện ngôn ngữ: một bước decoder từ <|startoftranscript|>
+            logits, past = self._run_decoder(prompt[:1], past, cross)
+            lang_ids = np.array(list(config.lang_to_id.values()))
+            prompt = prompt[:1] + [int(lang_ids[np.argmax(logits[lang_ids])])] + prompt[1:]
+            next_input = prompt[1:]
+        else:
+            next_input = prompt
+
+        suppress = np.array(config.suppress_tokens or [], dtype=np.int64)
+        begin_suppress = np.array(config.begin_suppress_tokens or [], dtype=np.int64)
+        tokens = list(prompt)
+        max_new_tokens = profile.max_new_tokens if profile is not None and profile.max_new_tokens else 448
+        max_new_tokens = min(max_new_tokens, self.max_target_positions - len(prompt))
+
+        for step in range(max_new_tokens):
+            logits, past = self._run_decoder(next_input, past, cross)
+            logits[suppress] = -np.inf
+            if step == 0:
+                logits[begin_suppress] = -np.inf
+            token = int(np.argmax(logits))
+            tokens.append(token)
+            if token == config.eos_token_id:
+                break
+            next_input = [token]
+        return tokens
+
+    def postprocess(self, tokens: list) -> str:
+        """Token ids -> text"""
+        return self.processor.batch_decode([tokens], skip_special_tokens=True)[0].strip()
+
+    def transcribe(self, audio: Union[str, np.ndarray], language: Optional[str] = None,
+                   task: str = "transcribe", profile: Optional[DecodingProfile] = None) -> str:
+        """
+        Chuyển đổi audio thành text
+
+        Args:
+            audio (Union[str, np.ndarray]): Đường dẫn tới file audio hoặc audio array 16kHz
+            language (Optional[str]): Ngôn ngữ, None để tự nhận diện
+            task (str): "transcribe" hoặc "translate"
+            profile (Optional[DecodingProfile]): Chỉ dùng max_new_tokens (backend này luôn greedy)
+        """
+        try:
+            if isinstance(audio, str):
+                with span("load_audio"):
+                    audio_data = self.load_audio(audio)
+                if audio_data is None:
+                    return "Error: Cannot load audio file"
+            else:
+                audio_data = audio
+
+            with span("feature_extraction"):
+                input_features = self.extract_features(audio_data)
+
+            cross = self.encode(input_features)
+
+            with span("generate"):
+                tokens = self.decode(cross, language, task, profile)
+
+            with span("batch_decode"):
+                return self.postprocess(tokens)
+
+        except Exception as e:
+            print(f"Transcription error: {e}")
+            return f"Error: {e}"
+
+
+# Singleton pattern để tránh load model nhiều lần
+_onnx_whisper_instance = None
+
+
+def get_onnx_whisper_instance() -> OnnxWhisperConnection:
+    """Get singleton ONNX Whisper instance từ environment variables"""
+    global _onnx_whisper_instance
+    if _onnx_whisper_instance is None:
+        _onnx_whisper_instance = OnnxWhisperConnection(
+            intra_op_threads=int(os.environ.get('ONNX_INTRA_OP_THREADS', 0)),
+            inter_op_threads=int(os.environ.get('ONNX_INTER_OP_THREADS', 1)),
+            quantize=os.environ.get('ONNX_QUANTIZE', '0').lower() in ('1', 'true', 'yes'),
+        )
+    return _onnx_whisper_instance
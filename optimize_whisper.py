@@ -14,10 +14,15 @@ import warnings
 import gc
 import os
 
+from tracing import span
+from profiling import torch_operator_profile
+from encoder_cache import LocalWhisperMixin, get_encoder_cache
+from decoding_profiles import DecodingProfile
+
 # Tắt các warning không cần thiết
 warnings.filterwarnings("ignore")
 
-class OptimizedWhisperConnection:
+class OptimizedWhisperConnection(LocalWhisperMixin):
     """
     Optimized version của WhisperConnection cho deployment
     - Giảm memory usage
@@ -33,6 +38,7 @@ class OptimizedWhisperConnection:
         self.device = "cpu"  # Force CPU để tránh CUDA memory issues
         self.model = None
         self.processor = None
+        self.encoder_cache = get_encoder_cache()
 
         print(f"Initializing optimized Whisper model: {model_name}")
         self._load_model()
@@ -65,6 +71,45 @@ class OptimizedWhisperConnection:
             print(f"Error loading model: {e}")
             raise e
 
+    def extract_features(self, audio_data: np.ndarray) -> torch.Tensor:
+        """Log-mel features của audio 16kHz"""
+        return self.processor(
+            audio_data,
+            sampling_rate=16000,
+            return_tensors="pt",
+            padding=True
+        ).input_features
+
+    def decode(self, encoder_outputs, language: Optional[str] = None,
+               task: str = "transcribe", profile: Optional[DecodingProfile] = None) -> torch.Tensor:
+        """Chạy decoder (generate) trên encoder output, trả về token ids"""
+        # Generation với optimization settings
+        generate_kwargs = {
+            "max_new_tokens": 448,
+            "num_beams": 1,  # Giảm từ default để tăng tốc
+            "do_sample": False,  # Deterministic output
+            "use_cache": True
+        }
+        if profile is not None:
+            generate_kwargs.update(profile.generate_kwargs())
+
+        generate_kwargs.update(self.language_kwargs(language, task))
+        generate_kwargs["max_new_tokens"] = self.max_new_tokens(generate_kwargs["max_new_tokens"])
+
+        # Inference với torch.no_grad() để tiết kiệm memory
+        with torch_operator_profile("generate"), torch.no_grad():
+            return self.model.generate(
+                encoder_outputs=encoder_outputs,
+                **generate_kwargs
+            )
+
+    def postprocess(self, predicted_ids: torch.Tensor) -> str:
+        """Token ids -> text"""
+        return self.processor.batch_decode(
+            predicted_ids,
+            skip_special_tokens=True
+        )[0].strip()
+
     def load_audio(self, audio_path: str, target_sr: int = 16000) -> np.ndarray:
         """Optimized audio loading"""
         try:
@@ -78,9 +123,12 @@ class OptimizedWhisperConnection:
             print(f"Error loading audio: {e}")
             return None
 
-    def transcribe(self, audio: Union[str, np.ndarray], language: Optional[str] = None) -> str:
+    def transcribe(self, audio: Union[str, np.ndarray], language: Optional[str] = None,
+                   task: str = "transcribe", profile: Optional[DecodingProfile] = None) -> str:
         """
         Optimized transcription
+
+        Khi có language, generate bỏ qua bước language detection. `profile` ghi đè num_beams/max_new_tokens.
         """
         try:
             if self.model is None or self.processor is None:
@@ -88,49 +136,32 @@ class OptimizedWhisperConnection:
 
             # Load audio if path provided
             if isinstance(audio, str):
-                audio_data = self.load_audio(audio)
+                with span("load_audio"):
+                    audio_data = self.load_audio(audio)
                 if audio_data is None:
                     return "Error: Cannot load audio file"
             else:
                 audio_data = audio
 
             # Preprocessing với optimization
-            inputs = self.processor(
-                audio_data,
-                sampling_rate=16000,
-                return_tensors="pt",
-                padding=True
-            )
-
-            # Generation với optimization settings
-            generate_kwargs = {
-                "max_new_tokens": 448,
-                "num_beams": 1,  # Giảm từ default để tăng tốc
-                "do_sample": False,  # Deterministic output
-                "use_cache": True
-            }
+            with span("feature_extraction"):
+                input_features = self.extract_features(audio_data)
 
-            if language:
-                generate_kwargs["language"] = language
+            # Encoder output từ cache nếu có (chỉ chạy decoder khi audio đã được encode)
+            encoder_outputs = self.encode(input_features)
 
-            # Inference với torch.no_grad() để tiết kiệm memory
-            with torch.no_grad():
-                predicted_ids = self.model.generate(
-                    inputs.input_features,
-                    **generate_kwargs
-                )
+            with span("generate"):
+                predicted_ids = self.decode(encoder_outputs, language, task, profile)
 
             # Decode result
-            transcription = self.processor.batch_decode(
-                predicted_ids,
-                skip_special_tokens=True
-            )[0]
+            with span("batch_decode"):
+                transcription = self.postprocess(predicted_ids)
 
             # Clean up memory
-            del inputs, predicted_ids
+            del input_features, encoder_outputs, predicted_ids
             gc.collect()
 
-            return transcription.strip()
+            return transcription
 
         except Exception as e:
             print(f"Transcription error: {e}")
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pipeline nhiều stage cho các local engine
+Load audio -> feature extraction -> encoder -> decoder (generate) -> batch_decode, mỗi stage
+có worker riêng và nối với nhau bằng queue có giới hạn: preprocessing của request sau
+chạy song song với inference của request trước, model không phải chờ input.
+"""
+
+import contextvars
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError
+from typing import Callable, Optional, Union
+
+import numpy as np
+
+from tracing import span
+from decoding_profiles import DecodingProfile
+
+# Thứ tự stage và số worker mặc định; encoder/decoder chỉ 1 worker vì đã dùng nhiều thread bên trong
+DEFAULT_WORKERS = {
+    "load_audio": 2,
+    "feature_extraction": 2,
+    "encoder": 1,
+    "decoder": 1,
+    "batch_decode": 1,
+}
+
+_STOP = object()
+
+
+class PipelineJob:
+    """Một request đi qua các stage; `value` là output của stage trước"""
+
+    __slots__ = ('value', 'language', 'task', 'profile', 'future', 'context', 'submitted')
+
+    def __init__(self, audio, language: Optional[str], task: str,
+                 profile: Optional[DecodingProfile] = None):
+        self.value = audio
+        self.language = language
+        self.task = task
+        self.profile = profile
+        self.future = Future()
+        # Giữ context của caller để span/profile trong worker thread gắn vào đúng request
+        self.context = contextvars.copy_context()
+        self.submitted = time.perf_counter()
+
+
+class Stage:
+    """Một stage: hàm xử lý, queue input có giới hạn và các worker thread"""
+
+    def __init__(self, name: str, fn: Callable[[PipelineJob], object], workers: int, queue_size: int):
+        self.name = name
+        self.fn = fn
+        self.workers = workers
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.next = None
+        self._lock = threading.Lock()
+        self._busy_seconds = 0.0
+        self._processed = 0
+        self._failed = 0
+        self._active = 0
+        self._threads = []
+
+    def start(self):
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"pipeline-{self.name}-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _process(self, job: PipelineJob):
+        with span(self.name):
+            job.value = self.fn(job)
+
+    @staticmethod
+    def _finish(job: PipelineJob, value=None, error: Optional[BaseException] = None):
+        """Trả kết quả cho caller; bỏ qua nếu caller đã huỷ Future trong lúc job đang chạy"""
+        try:
+            if error is not None:
+                job.future.set_exception(error)
+            else:
+                job.future.set_result(value)
+        except InvalidStateError:
+            pass
+
+    def _run(self):
+        while True:
+            job = self.queue.get()
+            if job is _STOP:
+                return
+            try:
+                self._handle(job)
+            except Exception as e:
+                # Không để lỗi nào làm chết worker thread
+                print(f"Pipeline stage {self.name} error: {e}")
+                self._finish(job, error=e)
+
+    def _handle(self, job: PipelineJob):
+        if job.future.cancelled():
+            return
+
+        start = time.perf_counter()
+        with self._lock:
+            self._active += 1
+        failed = False
+        try:
+            job.context.run(self._process, job)
+        except Exception as e:
+            failed = True
+            self._finish(job, error=e)
+        finally:
+            with self._lock:
+                self._active -= 1
+                self._busy_seconds += time.perf_counter() - start
+                if failed:
+                    self._failed += 1
+                else:
+                    self._processed += 1
+
+        if failed:
+            return
+        if self.next is not None:
+            # Block khi stage sau đầy (backpressure)
+            self.next.queue.put(job)
+        else:
+            self._finish(job, job.value)
+
+    def stop(self):
+        for _ in self._threads:
+            self.queue.put(_STOP)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def stats(self, elapsed: float) -> dict:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "active": self._active,
+                "queue_length": self.queue.qsize(),
+                "queue_capacity": self.queue.maxsize,
+                "processed": self._processed,
+                "failed": self._failed,
+                "avg_ms": round(self._busy_seconds / self._processed * 1000, 2) if self._processed else None,
+                # Tỉ lệ thời gian các worker đang bận kể từ khi pipeline khởi động
+                "utilisation": round(self._busy_seconds / (elapsed * self.workers), 4) if elapsed > 0 else 0.0,
+            }
+
+
+class StagedPipeline:
+    """
+    Chuỗi stage nối bằng queue có giới hạn
+
+    submit() trả về Future (lỗi của stage nằm trong Future); transcribe() là bản
+    blocking với cùng interface như các engine: lỗi trả về dạng "Error: ..." thay vì raise.
+    """
+
+    def __init__(self, stages: list, queue_size: int = 4):
+        """
+        Args:
+            stages (list): Danh sách (tên, hàm xử lý job, số worker) theo thứ tự
+            queue_size (int): Số job tối đa chờ trước mỗi stage
+        """
+        self.stages = [Stage(name, fn, workers, queue_size) for name, fn, workers in stages]
+        for stage, following in zip(self.stages, self.stages[1:]):
+            stage.next = following
+        for stage in self.stages:
+            stage.start()
+        self.started = time.perf_counter()
+        self._completed = 0
+        self._latency_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def _record(self, job: PipelineJob, future: Future):
+        if future.cancelled() or future.exception() is not None:
+            return
+        with self._lock:
+            self._completed += 1
+            self._latency_seconds += time.perf_counter() - job.submitted
+
+    def submit(self, audio: Union[str, np.ndarray], language: Optional[str] = None,
+               task: str = "transcribe", profile: Optional[DecodingProfile] = None) -> Future:
+        """
+        Đưa một request vào pipeline (block nếu queue của stage đầu đã đầy)
+
+        `profile` được truyền tới decode() của engine (num_beams, max_new_tokens).
+        """
+        job = PipelineJob(audio, language, task, profile)
+        job.future.add_done_callback(lambda future: self._record(job, future))
+        self.stages[0].queue.put(job)
+        return job.future
+
+    def transcribe(self, audio: Union[str, np.ndarray], language: Optional[str] = None,
+                   task: str = "transcribe", profile: Optional[DecodingProfile] = None) -> str:
+        try:
+            return self.submit(audio, language, task, profile).result()
+        except Exception as e:
+            print(f"Transcription error: {e}")
+            return f"Error: {e}"
+
+    def stats(self) -> dict:
+        """Utilisation, queue length của từng stage và latency trung bình"""
+        elapsed = time.perf_counter() - self.started
+        with self._lock:
+            completed = self._completed
+            latency = self._latency_seconds
+        return {
+            "stages": {stage.name: stage.stats(elapsed) for stage in self.stages},
+            "completed": completed,
+            "avg_latency_ms": round(latency / completed * 1000, 2) if completed else None,
+        }
+
+    def close(self):
+        for stage in self.stages:
+            stage.stop()
+
+
+def build_whisper_pipeline(engine, workers: Optional[dict] = None, queue_size: int = 4) -> StagedPipeline:
+    """
+    Tạo pipeline từ một local engine (WhisperConnection, OptimizedWhisperConnection,
+    OnnxWhisperConnection)
+
+    Engine cần các method load_audio, extract_features, encode, decode, postprocess.
+
+    Args:
+        engine: Local engine đã load model
+        workers (Optional[dict]): Số worker theo tên stage, ghi đè DEFAULT_WORKERS
+        queue_size (int): Số job tối đa chờ trước mỗi stage
+    """
+    workers = dict(DEFAULT_WORKERS, **(workers or {}))
+
+    def load_audio(job):
+        if not isinstance(job.value, str):
+            return job.value
+        audio_data = engine.load_audio(job.value)
+        if audio_data is None:
+            raise ValueError(f"Cannot load audio file: {job.value}")
+        return audio_data
+
+    return StagedPipeline([
+        ("load_audio", load_audio, workers["load_audio"]),
+        ("feature_extraction", lambda job: engine.extract_features(job.value), workers["feature_extraction"]),
+        ("encoder", lambda job: engine.encode(job.value), workers["encoder"]),
+        ("decoder", lambda job: engine.decode(job.value, job.language, job.task, job.profile), workers["decoder"]),
+        ("batch_decode", lambda job: engine.postprocess(job.value), workers["batch_decode"]),
+    ], queue_size=queue_size)
+
+
+# Singleton pattern
+_whisper_pipeline = None
+_whisper_pipeline_lock = threading.Lock()
+
+
+def get_whisper_pipeline() -> StagedPipeline:
+    """
+    Get pipeline singleton từ environment variables
+
+    PIPELINE_BACKEND: "optimized" (OptimizedWhisperConnection, default) hoặc "onnx"
+    PIPELINE_QUEUE_SIZE: Số job tối đa chờ trước mỗi stage
+    PIPELINE_WORKERS_<STAGE>: Số worker của stage, ví dụ PIPELINE_WORKERS_FEATURE_EXTRACTION=3
+    """
+    global _whisper_pipeline
+    with _whisper_pipeline_lock:
+        if _whisper_pipeline is None:
+            if os.environ.get('PIPELINE_BACKEND', 'optimized').lower() == 'onnx':
+                from onnx_whisper import get_onnx_whisper_instance
+                engine = get_onnx_whisper_instance()
+            else:
+                from optimize_whisper import get_whisper_instance
+                engine = get_whisper_instance()
+            workers = {
+                name: int(os.environ.get(f'PIPELINE_WORKERS_{name.upper()}', default))
+                for name, default in DEFAULT_WORKERS.items()
+            }
+            _whisper_pipeline = build_whisper_pipeline(
+                engine,
+                workers=workers,
+                queue_size=int(os.environ.get('PIPELINE_QUEUE_SIZE', 4)),
+            )
+        return _whisper_pipeline
+
+
+def pipeline_stats() -> Optional[dict]:
+    """Stats của pipeline singleton nếu đã được tạo, None nếu chưa (app.py không dùng local engine)"""
+    return _whisper_pipeline.stats() if _whisper_pipeline is not None else None
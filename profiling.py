@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Profiling theo yêu cầu cho request đang chạy trên server
+- Sampling profiler Python (stack mẫu định kỳ, output dạng collapsed stacks cho flamegraph)
+- Profile mức operator của torch cho model.generate trong các local engine
+Tắt mặc định; khi tắt chỉ tốn một phép kiểm tra bool mỗi request.
+"""
+
+import contextvars
+import hmac
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Optional
+
+_current_session = contextvars.ContextVar('profile_session', default=None)
+
+_PROFILE_NAME_PATTERN = re.compile(r'^[A-Za-z0-9_.\-]+$')
+
+
+class ProfileStore:
+    """
+    Thư mục lưu profile có giới hạn số file và tổng dung lượng
+    File cũ nhất bị xoá trước khi vượt giới hạn
+    """
+
+    def __init__(self, directory: str, max_files: int = 50, max_bytes: int = 50 * 1024 * 1024):
+        self.directory = directory
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _entries(self) -> list:
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if os.path.isfile(path):
+                stat = os.stat(path)
+                entries.append({"name": name, "size": stat.st_size, "created": stat.st_mtime})
+        entries.sort(key=lambda entry: entry["created"])
+        return entries
+
+    def write(self, name: str, content: str) -> str:
+        """Ghi một profile và dọn các file cũ nếu vượt giới hạn"""
+        with self._lock:
+            path = os.path.join(self.directory, name)
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(content)
+
+            entries = self._entries()
+            total = sum(entry["size"] for entry in entries)
+            while entries and (len(entries) > self.max_files or total > self.max_bytes):
+                oldest = entries.pop(0)
+                total -= oldest["size"]
+                try:
+                    os.unlink(os.path.join(self.directory, oldest["name"]))
+                except OSError:
+                    pass
+            return path
+
+    def list(self) -> list:
+        with self._lock:
+            return list(reversed(self._entries()))
+
+    def path(self, name: str) -> Optional[str]:
+        """Đường dẫn tới profile, None nếu tên không hợp lệ hoặc không tồn tại"""
+        if not _PROFILE_NAME_PATTERN.match(name):
+            return None
+        path = os.path.join(self.directory, name)
+        return path if os.path.isfile(path) else None
+
+
+class SamplingProfiler:
+    """
+    Sampling profiler dựa trên sys._current_frames()
+
+    Một thread nền lấy stack của các thread khác sau mỗi interval và đếm
+    các stack giống nhau. Vì server xử lý nhiều request cùng lúc, profile
+    có thể chứa cả stack của request khác đang chạy song song.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.samples = Counter()
+        self.sample_count = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _collect(self):
+        own_id = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+                frame = frame.f_back
+            stack.append(names.get(thread_id, str(thread_id)))
+            self.samples[";".join(reversed(stack))] += 1
+        self.sample_count += 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._collect()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def collapsed(self) -> str:
+        """Output dạng collapsed stacks (flamegraph.pl, speedscope)"""
+        return "\n".join(f"{stack} {count}" for stack, count in self.samples.most_common()) + "\n"
+
+
+class ProfileSession:
+    """Profile của một request"""
+
+    def __init__(self, profile_id: str, store: ProfileStore, interval: float):
+        self.profile_id = profile_id
+        self.store = store
+        self.profiler = SamplingProfiler(interval)
+        self.files = []
+        self.started = time.perf_counter()
+
+    def write(self, suffix: str, content: str):
+        name = f"{self.profile_id}.{suffix}"
+        self.store.write(name, content)
+        self.files.append(name)
+
+
+class ProfilingManager:
+    """Quyết định request nào được profile và quản lý kho profile"""
+
+    def __init__(self,
+                 token: str,
+                 directory: str = '/tmp/whisper_profiles',
+                 sample_rate: float = 0.0,
+                 interval: float = 0.005,
+                 max_files: int = 50,
+                 max_bytes: int = 50 * 1024 * 1024):
+        self.token = token
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.store = ProfileStore(directory, max_files, max_bytes)
+        # Chỉ một session tại một thời điểm để giới hạn overhead
+        self._active = threading.Lock()
+        self._profiled = 0
+        self._skipped_busy = 0
+
+    def authorized(self, token: Optional[str]) -> bool:
+        return bool(token) and hmac.compare_digest(token, self.token)
+
+    def should_profile(self, flag: Optional[str], token: Optional[str]) -> bool:
+        """Request được gắn cờ (có token hợp lệ) hoặc được chọn ngẫu nhiên theo sample_rate"""
+        if flag and flag.lower() in ('1', 'true', 'yes'):
+            return self.authorized(token)
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def begin(self, trace_id: Optional[str]) -> Optional[ProfileSession]:
+        """Bắt đầu profile cho context hiện tại, None nếu đang có session khác"""
+        if not self._active.acquire(blocking=False):
+            self._skipped_busy += 1
+            return None
+        profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}_{trace_id or 'request'}"
+        session = ProfileSession(profile_id, self.store, self.interval)
+        _current_session.set(session)
+        session.profiler.start()
+        return session
+
+    def end(self, session: ProfileSession, description: str):
+        try:
+            session.profiler.stop()
+            elapsed = time.perf_counter() - session.started
+            session.write("collapsed.txt", session.profiler.collapsed())
+            session.write("summary.txt",
+                          f"{description}\n"
+                          f"duration_seconds: {elapsed:.3f}\n"
+                          f"samples: {session.profiler.sample_count}\n"
+                          f"interval_seconds: {self.interval}\n")
+            self._profiled += 1
+        finally:
+            self._active.release()
+
+    def stats(self) -> dict:
+        return {
+            "sample_rate": self.sample_rate,
+            "profiled": self._profiled,
+            "skipped_busy": self._skipped_busy,
+            "stored": len(self.store.list()),
+        }
+
+
+@contextmanager
+def torch_operator_profile(name: str):
+    """
+    Profile mức operator của torch nếu request hiện tại đang được profile
+
+    Dùng trong local engines quanh model.generate, không làm gì nếu không có session.
+    """
+    session = _current_session.get()
+    if session is None:
+        yield
+        return
+
+    from torch.profiler import profile, ProfilerActivity
+
+    with profile(activities=[ProfilerActivity.CPU], record_shapes=True) as prof:
+        yield
+    session.write(f"torch-{name}.txt",
+                  prof.key_averages(group_by_input_shape=True).table(sort_by="self_cpu_time_total", row_limit=50))
+
+
+# Singleton pattern
+_profiling_manager = None
+
+
+def get_profiling_manager() -> Optional[ProfilingManager]:
+    """Get profiling manager (None nếu chưa bật PROFILING_ENABLED hoặc chưa có PROFILING_TOKEN)"""
+    global _profiling_manager
+    if _profiling_manager is None:
+        if os.environ.get('PROFILING_ENABLED', '0').lower() not in ('1', 'true', 'yes'):
+            return None
+        token = os.environ.get('PROFILING_TOKEN')
+        if not token:
+            print("PROFILING_ENABLED nhưng thiếu PROFILING_TOKEN, profiling bị tắt")
+            return None
+        _profiling_manager = ProfilingManager(
+            token=token,
+            directory=os.environ.get('PROFILING_DIR', '/tmp/whisper_profiles'),
+            sample_rate=float(os.environ.get('PROFILING_SAMPLE_RATE', 0)),
+            interval=float(os.environ.get('PROFILING_INTERVAL_MS', 5)) / 1000,
+            max_files=int(os.environ.get('PROFILING_MAX_FILES', 50)),
+            max_bytes=int(os.environ.get('PROFILING_MAX_BYTES', 50 * 1024 * 1024)),
+        )
+    return _profiling_manager
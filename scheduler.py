@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Scheduler cho inference: shortest job first có aging
+Job ngắn (voice command) không phải chờ sau các file 25MB
+"""
+
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from contextlib import asynccontextmanager
+
+from tracing import span
+
+
+class InferenceScheduler:
+    """
+    Giới hạn số job chạy đồng thời và chọn job tiếp theo theo chi phí ước lượng
+
+    Điểm ưu tiên của job (nhỏ hơn chạy trước):
+        cost_seconds - priority * priority_weight - aging_rate * thời_gian_chờ
+
+    Vì aging tuyến tính theo thời gian, thứ tự tương đối giữa các job không đổi
+    khi thời gian trôi, nên có thể dùng heap với key
+        cost_seconds - priority * priority_weight + aging_rate * enqueued_at
+    Job dài vẫn được chạy sau tối đa khoảng cost / aging_rate giây.
+    """
+
+    def __init__(self,
+                 concurrency: int = 2,
+                 aging_rate: float = 0.5,
+                 priority_weight: float = 30.0):
+        """
+        Args:
+            concurrency (int): Số job chạy đồng thời
+            aging_rate (float): Số giây chi phí được "trừ" cho mỗi giây chờ
+            priority_weight (float): Số giây chi phí tương ứng với 1 mức priority
+        """
+        self.concurrency = max(1, concurrency)
+        self.aging_rate = aging_rate
+        self.priority_weight = priority_weight
+
+        self._running = 0
+        self._heap = []
+        self._counter = itertools.count()
+        self._scheduled = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    def _key(self, cost_seconds: float, priority: int, enqueued_at: float) -> float:
+        return cost_seconds - priority * self.priority_weight + self.aging_rate * enqueued_at
+
+    def _grant_next(self):
+        """Trao slot trống cho job có key nhỏ nhất còn đang chờ"""
+        while self._running < self.concurrency and self._heap:
+            _, _, future = heapq.heappop(self._heap)
+            if future.done():  # Job đã bị huỷ khi đang chờ
+                continue
+            self._running += 1
+            future.set_result(None)
+
+    async def acquire(self, cost_seconds: float, priority: int = 0):
+        """Chờ tới lượt của job"""
+        enqueued_at = time.monotonic()
+        if self._running < self.concurrency and not self._heap:
+            self._running += 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._heap, (self._key(cost_seconds, priority, enqueued_at),
+                                        next(self._counter), future))
+            try:
+                await future
+            except asyncio.CancelledError:
+                # Slot có thể đã được trao đúng lúc bị huỷ
+                if future.done() and not future.cancelled():
+                    self.release()
+                raise
+
+        waited = time.monotonic() - enqueued_at
+        self._scheduled += 1
+        self._total_wait += waited
+        self._max_wait = max(self._max_wait, waited)
+
+    def release(self):
+        """Trả slot và chạy job tiếp theo"""
+        self._running -= 1
+        self._grant_next()
+
+    def expected_wait(self) -> float:
+        """Thời gian chờ dự kiến của job mới: 0 nếu còn slot trống, không thì thời gian chờ trung bình"""
+        if self._running < self.concurrency and not self._heap:
+            return 0.0
+        return self._total_wait / self._scheduled if self._scheduled else 0.0
+
+    @asynccontextmanager
+    async def slot(self, cost_seconds: float, priority: int = 0):
+        """
+        Context manager cho một job inference
+
+        Args:
+            cost_seconds (float): Chi phí ước lượng, ví dụ thời lượng audio
+            priority (int): Priority do client gửi lên (lớn hơn = gấp hơn)
+        """
+        with span("scheduler_wait"):
+            await self.acquire(cost_seconds, priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> dict:
+        """Metrics cho endpoint /metrics"""
+        return {
+            "concurrency": self.concurrency,
+            "running": self._running,
+            "waiting": sum(1 for _, _, future in self._heap if not future.done()),
+            "scheduled": self._scheduled,
+            "avg_wait_seconds": round(self._total_wait / self._scheduled, 3) if self._scheduled else None,
+            "max_wait_seconds": round(self._max_wait, 3),
+            "aging_rate": self.aging_rate,
+        }
+
+
+# Singleton pattern
+_scheduler = None
+
+
+def get_scheduler() -> InferenceScheduler:
+    """Get scheduler instance từ environment variables"""
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = InferenceScheduler(
+            concurrency=int(os.environ.get('SCHEDULER_CONCURRENCY', 2)),
+            aging_rate=float(os.environ.get('SCHEDULER_AGING_RATE', 0.5)),
+            priority_weight=float(os.environ.get('SCHEDULER_PRIORITY_WEIGHT', 30)),
+        )
+    return _scheduler
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test admission control: token bucket theo client, giới hạn in-flight, deadline và Retry-After.
+Phần end-to-end chạy app qua ASGI với HF API giả lập (httpx.MockTransport) thay cho upstream thật.
+"""
+
+import asyncio
+import io
+import wave
+
+import httpx
+import pytest
+
+import app as appmod
+from admission_control import AdmissionController, AdmissionRejected, TokenBucket
+from lightweight_whisper import LightweightWhisperService
+from scheduler import InferenceScheduler
+
+
+def rejection(controller, client_id="client", audio_seconds=10.0) -> AdmissionRejected:
+    with pytest.raises(AdmissionRejected) as error:
+        controller.admit(client_id, audio_seconds)
+    return error.value
+
+
+def test_token_bucket_refills_at_rate():
+    bucket = TokenBucket(rate=2, burst=2)
+    now = bucket.updated
+    assert bucket.take(now) == 0 and bucket.take(now) == 0
+    assert bucket.take(now) == pytest.approx(0.5)
+    # Sau 0.5 giây có lại đúng 1 token
+    assert bucket.take(now + 0.5) == 0
+    assert bucket.take(now + 0.5) == pytest.approx(0.5)
+    # Nghỉ lâu cũng chỉ nạp tối đa burst
+    assert bucket.take(now + 60) == 0 and bucket.take(now + 60) == 0
+    assert bucket.take(now + 60) > 0
+
+
+def test_client_rate_rejects_with_retry_after():
+    controller = AdmissionController(client_rate=0.1, client_burst=2, max_in_flight=100)
+    for _ in range(2):
+        controller.release(controller.admit("noisy", 1.0))
+
+    error = rejection(controller, "noisy")
+    assert (error.status_code, error.reason) == (429, "client_rate")
+    # Cần 1 token với tốc độ 0.1 token/giây
+    assert 9 <= error.retry_after <= 10
+
+    # Client khác có bucket riêng
+    controller.release(controller.admit("quiet", 1.0))
+    assert controller.stats()["rejected"] == {"client_rate": 1}
+
+
+def test_in_flight_limit_and_release():
+    controller = AdmissionController(max_in_flight=2, initial_processing_ratio=0.3, deadline_seconds=1000)
+    tickets = [controller.admit(f"client-{i}", 20.0) for i in range(2)]
+
+    error = rejection(controller, "client-2", 20.0)
+    assert (error.status_code, error.reason) == (503, "max_in_flight")
+    # Retry-After ~ thời gian xử lý một request cùng độ dài: 0.3 * 20 giây
+    assert error.retry_after == 6
+
+    controller.release(tickets[0])
+    controller.release(controller.admit("client-2", 20.0))
+    assert controller.stats()["in_flight"] == 1
+
+
+def test_deadline_uses_queued_audio():
+    controller = AdmissionController(concurrency=1, initial_processing_ratio=1.0, deadline_seconds=30)
+    controller.admit("first", 20.0)
+
+    # Đang chờ 20 giây audio + 20 giây mới = 40 giây xử lý, vượt deadline 10 giây
+    error = rejection(controller, "second", 20.0)
+    assert (error.status_code, error.reason) == (503, "deadline")
+    assert error.retry_after == 10
+    controller.admit("second", 5.0)
+
+
+def test_idle_server_accepts_oversized_request():
+    controller = AdmissionController(max_queued_audio_seconds=60, deadline_seconds=1)
+    controller.admit("client", 600.0)
+    assert rejection(controller, "other", 600.0).reason == "max_queued_audio"
+
+
+def test_client_header_only_trusted_from_proxy():
+    controller = AdmissionController(trusted_proxies={"10.0.0.1"})
+    assert controller.client_id("10.0.0.1", "tenant-a") == "tenant-a"
+    assert controller.client_id("203.0.113.5", "tenant-a") == "203.0.113.5"
+    assert controller.client_id(None) == "unknown"
+
+
+def wav_bytes(seconds=1.0, rate=16000) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(b'\0\0' * int(seconds * rate))
+    return buffer.getvalue()
+
+
+class SlowHF:
+    """HF API giả: giữ request tới khi được release, để đếm request đang xử lý"""
+
+    def __init__(self):
+        self.release = asyncio.Event()
+        self.started = asyncio.Event()
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        await request.aread()
+        self.started.set()
+        await self.release.wait()
+        return httpx.Response(200, json={"text": "xin chào"})
+
+
+@pytest.fixture
+def slow_hf(monkeypatch):
+    upstream = SlowHF()
+    service = LightweightWhisperService()
+    service.client = httpx.AsyncClient(transport=httpx.MockTransport(upstream))
+    monkeypatch.setattr(appmod, "whisper_model", service)
+    monkeypatch.setattr(appmod, "result_cache", None)
+    monkeypatch.setattr(appmod, "PASSTHROUGH_ENABLED", False)
+    monkeypatch.setattr(appmod, "scheduler", InferenceScheduler(concurrency=2))
+    return upstream
+
+
+def post_raw(client, body: bytes, client_id: str):
+    return client.post("/transcribe-raw", content=body,
+                       headers={"content-type": "audio/wav", "x-client-id": client_id})
+
+
+def test_app_returns_retry_after_when_overloaded(slow_hf, monkeypatch):
+    controller = AdmissionController(max_in_flight=1, client_rate=0.5, client_burst=2,
+                                     trusted_proxies={"127.0.0.1"})
+    monkeypatch.setattr(appmod, "admission", controller)
+    body = wav_bytes()
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=appmod.app, client=("127.0.0.1", 1234))
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            first = asyncio.create_task(post_raw(client, body, "tenant-a"))
+            await slow_hf.started.wait()
+
+            # Request đang xử lý chiếm hết in-flight: từ chối trước khi đọc body
+            overloaded = await post_raw(client, body, "tenant-b")
+            slow_hf.release.set()
+            done = await first
+
+            # Request thứ hai của tenant-a dùng hết burst, request thứ ba phải chờ 1 token (2 giây)
+            await post_raw(client, body, "tenant-a")
+            limited = await post_raw(client, body, "tenant-a")
+            return done, overloaded, limited
+
+    done, overloaded, limited = asyncio.run(scenario())
+    assert done.status_code == 200 and done.json()["transcription"] == "xin chào"
+
+    assert overloaded.status_code == 503
+    assert overloaded.json()["reason"] == "max_in_flight"
+    assert int(overloaded.headers["retry-after"]) >= 1
+
+    assert limited.status_code == 429
+    assert limited.json()["reason"] == "client_rate"
+    assert int(limited.headers["retry-after"]) == 2
+    assert controller.stats()["in_flight"] == 0
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test ước lượng thời lượng từ header (WAV, FLAC, MP3) và fallback theo kích thước
+Header bị cắt hoặc giả mạo không được làm request lỗi 500.
+"""
+
+import io
+import struct
+import wave
+
+import pytest
+
+from audio_info import estimate_duration, estimate_duration_from_size
+
+
+def make_wav(seconds: float, rate: int = 16000, channels: int = 1) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(b'\0' * int(seconds * rate) * 2 * channels)
+    return buffer.getvalue()
+
+
+def test_wav_duration_from_header():
+    assert estimate_duration(make_wav(2.5), '.wav') == pytest.approx(2.5)
+    assert estimate_duration(make_wav(1.0, rate=44100, channels=2), '.wav') == pytest.approx(1.0)
+
+
+def test_wav_duration_from_header_prefix():
+    # Chỉ có phần đầu file (ví dụ chunk upload đầu tiên) + tổng kích thước
+    data = make_wav(10)
+    assert estimate_duration(data[:64], '.wav', total_size=len(data)) == pytest.approx(10)
+
+
+def test_wav_streaming_header_is_capped_by_real_size():
+    data = bytearray(make_wav(1.0))
+    data[40:44] = struct.pack('<I', 0xFFFFFFFF)
+    assert estimate_duration(bytes(data), '.wav') == pytest.approx(1.0)
+
+
+@pytest.mark.parametrize("cut", [24, 28, 30, 35])
+def test_truncated_fmt_chunk_falls_back_to_size(cut):
+    data = make_wav(1.0)[:cut]
+    assert estimate_duration(data, '.wav') == estimate_duration_from_size(cut, '.wav')
+
+
+def test_crafted_fmt_chunk_size_falls_back_to_size():
+    data = b'RIFF' + struct.pack('<I', 100) + b'WAVE' + b'fmt ' + struct.pack('<I', 4) + b'\1\0\1\0'
+    assert estimate_duration(data, '.wav') == estimate_duration_from_size(len(data), '.wav')
+
+
+def test_flac_streaminfo():
+    sample_rate, total_samples = 16000, 16000 * 3
+    info = bytearray(18)
+    info[10] = sample_rate >> 12
+    info[11] = (sample_rate >> 4) & 0xFF
+    info[12] = (sample_rate & 0x0F) << 4
+    info[14:18] = struct.pack('>I', total_samples)
+    data = b'fLaC' + bytes([0, 0, 0, 34]) + bytes(info)
+    assert estimate_duration(data, '.flac') == pytest.approx(3.0)
+
+
+def test_mp3_cbr_from_first_frame():
+    # MPEG-1 Layer III, 128 kbps, 44.1 kHz
+    header = bytes([0xFF, 0xFB, 0x90, 0x00])
+    data = header + b'\0' * (16000 * 4 - 4)
+    assert estimate_duration(data, '.mp3') == pytest.approx(4.0)
+
+
+def test_truncated_mp3_frame_falls_back_to_size():
+    data = b'ID3' + b'\0' * 7 + bytes([0xFF])
+    assert estimate_duration(data, '.mp3') == estimate_duration_from_size(len(data), '.mp3')
+
+
+def test_unknown_format_uses_typical_bitrate():
+    assert estimate_duration(b'\0' * 80000, '.webm') == pytest.approx(10.0)
+    assert estimate_duration(b'', '.ogg') == 0.1
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test transcribe file dài theo chunk có checkpoint: khi một chunk lỗi, lần retry chỉ gửi
+các chunk còn thiếu. Phần end-to-end dùng app với HF API giả lập trả 503 cho một chunk.
+"""
+
+import asyncio
+import io
+import wave
+
+import httpx
+import pytest
+
+import app as appmod
+import chunked_transcription
+from chunked_transcription import CheckpointStore, IncompleteTranscriptionError, ResumableTranscriber, split_wav
+from lightweight_whisper import LightweightWhisperService
+
+RATE = 8000
+CHUNK_SECONDS = 30
+
+
+def wav_bytes(seconds: float) -> bytes:
+    """WAV mono 16-bit; mỗi đoạn CHUNK_SECONDS có sample bằng số thứ tự đoạn để nhận ra chunk"""
+    frames = bytearray()
+    for index in range(int(seconds * RATE)):
+        frames += (index // (CHUNK_SECONDS * RATE)).to_bytes(2, 'little')
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(RATE)
+        wav.writeframes(bytes(frames))
+    return buffer.getvalue()
+
+
+def chunk_index(chunk: bytes) -> int:
+    with wave.open(io.BytesIO(chunk), 'rb') as wav:
+        return int.from_bytes(wav.readframes(1), 'little')
+
+
+@pytest.fixture
+def transcriber(tmp_path):
+    return ResumableTranscriber(CheckpointStore(str(tmp_path / "chunks.db")), chunk_seconds=CHUNK_SECONDS)
+
+
+def test_split_wav_into_chunks(tmp_path):
+    path = tmp_path / "long.wav"
+    path.write_bytes(wav_bytes(70))
+    chunks = split_wav(str(path), CHUNK_SECONDS)
+    assert [chunk_index(chunk) for chunk in chunks] == [0, 1, 2]
+
+    path = tmp_path / "not-a-wav.mp3"
+    path.write_bytes(b"ID3" + b"\0" * 100)
+    assert split_wav(str(path), CHUNK_SECONDS) is None
+
+
+def test_resume_after_chunk_failure(transcriber):
+    chunks = [b"zero", b"one", b"two"]
+    calls = []
+
+    def transcribe_chunk(fail_on):
+        async def run(chunk):
+            calls.append(chunk)
+            if chunk == fail_on:
+                raise RuntimeError("503")
+            return chunk.decode()
+        return run
+
+    with pytest.raises(IncompleteTranscriptionError) as error:
+        asyncio.run(transcriber.run(chunks, "hash", "params", transcribe_chunk(b"one")))
+    assert (error.value.completed, error.value.total) == (1, 3)
+
+    calls.clear()
+    result = asyncio.run(transcriber.run(chunks, "hash", "params", transcribe_chunk(None)))
+    assert calls == [b"one", b"two"]
+    assert result == {"text": "zero one two", "chunks_total": 3, "chunks_reused": 1, "chunks_processed": 2}
+
+    # Tham số khác (ví dụ language khác) không dùng lại checkpoint
+    calls.clear()
+    asyncio.run(transcriber.run(chunks, "hash", "other-params", transcribe_chunk(None)))
+    assert calls == chunks
+
+
+def test_expired_checkpoints_are_ignored(tmp_path):
+    store = CheckpointStore(str(tmp_path / "chunks.db"), ttl_seconds=0)
+    store.save("hash", "params", 0, "cũ")
+    assert store.load("hash", "params") == {}
+    store.prune()
+    assert CheckpointStore(store.path).load("hash", "params") == {}
+
+
+class FlakyHF:
+    """HF API giả: trả 503 cho chunk `fail_chunk` lần đầu, các lần sau trả text theo số thứ tự chunk"""
+
+    def __init__(self, fail_chunk: int):
+        self.fail_chunk = fail_chunk
+        self.received = []
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        index = chunk_index(await request.aread())
+        self.received.append(index)
+        if index == self.fail_chunk and self.received.count(index) == 1:
+            return httpx.Response(503, json={"error": "Model is currently loading"})
+        return httpx.Response(200, json={"text": f"đoạn {index}"})
+
+
+def test_app_retry_only_sends_missing_chunks(tmp_path, monkeypatch, transcriber):
+    upstream = FlakyHF(fail_chunk=1)
+    service = LightweightWhisperService()
+    service.client = httpx.AsyncClient(transport=httpx.MockTransport(upstream))
+    monkeypatch.setattr(chunked_transcription, "_resumable_transcriber", transcriber)
+    monkeypatch.setattr(appmod, "whisper_model", service)
+    monkeypatch.setattr(appmod, "admission", None)
+    monkeypatch.setattr(appmod, "result_cache", None)
+    monkeypatch.setattr(appmod, "LONG_AUDIO_SECONDS", 60)
+    body = wav_bytes(70)
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=appmod.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            headers = {"content-type": "audio/wav"}
+            first = await client.post("/transcribe-raw", content=body, headers=headers)
+            retry = await client.post("/transcribe-raw", content=body, headers=headers)
+            return first, retry
+
+    first, retry = asyncio.run(scenario())
+    assert first.status_code == 503
+    assert first.headers["retry-after"] == "30"
+    assert "1/3" in first.json()["detail"]
+
+    assert retry.status_code == 200
+    assert retry.json()["transcription"] == "đoạn 0 đoạn 1 đoạn 2"
+    assert retry.json()["chunks"] == {"chunks_total": 3, "chunks_reused": 1, "chunks_processed": 2}
+    assert upstream.received == [0, 1, 1, 2]
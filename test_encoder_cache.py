@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test encoder cache với local engine: decode lại cùng audio bằng beam search rồi greedy
+không được làm hỏng encoder output trong cache.
+Dùng model Whisper nhỏ khởi tạo ngẫu nhiên nên không cần tải model từ HF.
+"""
+
+import pytest
+import torch
+from transformers import WhisperConfig, WhisperForConditionalGeneration
+
+from decoding_profiles import DecodingProfile
+from encoder_cache import EncoderCache, tensor_bytes
+from optimize_whisper import OptimizedWhisperConnection
+from whisper_connection import WhisperConnection
+
+NUM_MEL_BINS = 80
+MAX_SOURCE_POSITIONS = 50
+
+
+def tiny_model() -> WhisperForConditionalGeneration:
+    torch.manual_seed(0)
+    config = WhisperConfig(
+        vocab_size=51865,
+        num_mel_bins=NUM_MEL_BINS,
+        d_model=16,
+        encoder_layers=1,
+        decoder_layers=1,
+        encoder_attention_heads=2,
+        decoder_attention_heads=2,
+        encoder_ffn_dim=32,
+        decoder_ffn_dim=32,
+        max_source_positions=MAX_SOURCE_POSITIONS,
+        max_target_positions=448,
+        decoder_start_token_id=50258,
+        pad_token_id=50257,
+        bos_token_id=50257,
+        eos_token_id=50257,
+    )
+    model = WhisperForConditionalGeneration(config)
+    model.generation_config.decoder_start_token_id = 50258
+    model.generation_config.forced_decoder_ids = None
+    return model.eval()
+
+
+def make_engine(engine_class, cache: EncoderCache):
+    """Engine không qua __init__ (không tải model/processor từ HF)"""
+    engine = engine_class.__new__(engine_class)
+    engine.model_name = "tiny-random"
+    engine.device = "cpu"
+    engine.model = tiny_model()
+    engine.processor = None
+    engine.encoder_cache = cache
+    return engine
+
+
+@pytest.mark.parametrize("engine_class", [WhisperConnection, OptimizedWhisperConnection])
+def test_beam_search_does_not_mutate_cached_encoder_output(engine_class):
+    cache = EncoderCache()
+    engine = make_engine(engine_class, cache)
+    d_model = engine.model.config.d_model
+    features = torch.randn(1, NUM_MEL_BINS, MAX_SOURCE_POSITIONS * 2)
+    beams = DecodingProfile("beams", "tiny-random", num_beams=3, max_new_tokens=5)
+    greedy = DecodingProfile("greedy", "tiny-random", num_beams=1, max_new_tokens=5)
+
+    engine.decode(engine.encode(features), profile=beams)
+    cached_bytes = cache.stats()["bytes"]
+
+    encoder_outputs = engine.encode(features)
+    assert cache.stats()["hits"] == 1
+    assert encoder_outputs.last_hidden_state.shape == (1, MAX_SOURCE_POSITIONS, d_model)
+
+    predicted_ids = engine.decode(encoder_outputs, profile=greedy)
+    assert predicted_ids.shape[0] == 1
+
+    # Decode lần nữa với beam search: cache vẫn giữ đúng tensor ban đầu
+    engine.decode(engine.encode(features), profile=beams)
+    hidden_states = cache.get(cache.key(engine.model_name, features))
+    assert hidden_states.shape == (1, MAX_SOURCE_POSITIONS, d_model)
+    assert cache.stats()["bytes"] == cached_bytes == tensor_bytes(hidden_states)
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test fingerprint cache: audio gần giống (nhiễu nhẹ, đổi gain, thêm khoảng lặng, đổi sample rate)
+phải khớp; audio chỉ khác một đoạn thì không được nhận transcription của bản kia.
+"""
+
+import wave
+
+import numpy as np
+import pytest
+
+from fingerprint_cache import CacheLookup, FingerprintCache, compute_fingerprint, segment_similarity
+
+RATE = 16000
+THRESHOLD = 0.75
+TONES = [400, 600, 800, 500, 700, 400]
+
+
+def tones(frequencies, seconds=0.5, rate=RATE):
+    t = np.arange(int(seconds * rate)) / rate
+    return np.concatenate([0.5 * np.sin(2 * np.pi * f * t) for f in frequencies]).astype(np.float32)
+
+
+def speech_like(seed, syllables=12, rate=RATE):
+    """Chuỗi "âm tiết" tổng hợp: hài âm của F0 ngẫu nhiên + một formant, xen khoảng nghỉ ngắn"""
+    rs = np.random.RandomState(seed)
+    parts = []
+    for _ in range(syllables):
+        t = np.arange(int(rs.uniform(0.15, 0.4) * rate)) / rate
+        f0, formant = rs.uniform(100, 250), rs.uniform(300, 3000)
+        envelope = np.hanning(len(t))
+        voiced = sum(np.sin(2 * np.pi * f0 * k * t) / k for k in range(1, 15))
+        parts.append((voiced + 0.3 * np.sin(2 * np.pi * formant * t)) * envelope)
+        parts.append(np.zeros(int(rs.uniform(0.02, 0.1) * rate)))
+    samples = np.concatenate(parts)
+    return (samples / np.abs(samples).max() * 0.5).astype(np.float32)
+
+
+def add_noise(samples, snr_db, seed=1):
+    power = np.mean(samples ** 2) / 10 ** (snr_db / 10)
+    return (samples + np.random.RandomState(seed).randn(len(samples)) * np.sqrt(power)).astype(np.float32)
+
+
+def similarity(first, second, second_rate=RATE):
+    return segment_similarity(compute_fingerprint(first, RATE)[0], compute_fingerprint(second, second_rate)[0])
+
+
+def write_wav(path, samples, rate=RATE):
+    with wave.open(str(path), 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes((np.clip(samples, -1, 1) * 32767).astype(np.int16).tobytes())
+    return str(path)
+
+
+CLIP = tones(TONES)
+SPEECH = speech_like(3)
+
+
+def replaced_segment(samples, start, length, seed=9):
+    changed = samples.copy()
+    changed[start:start + length] = speech_like(seed)[:length]
+    return changed
+
+
+@pytest.mark.parametrize("name, other, other_rate", [
+    ("noise 30dB", add_noise(CLIP, 30), RATE),
+    ("noise 20dB", add_noise(CLIP, 20), RATE),
+    ("gain + padding", np.concatenate([np.zeros(8000), CLIP * 0.3, np.zeros(4000)]).astype(np.float32), RATE),
+    ("resampled 8kHz", CLIP[::2].copy(), 8000),
+])
+def test_same_audio_matches(name, other, other_rate):
+    assert similarity(CLIP, other, other_rate) >= THRESHOLD, name
+
+
+def test_same_speech_with_noise_matches():
+    assert similarity(SPEECH, add_noise(SPEECH, 25)) >= THRESHOLD
+
+
+@pytest.mark.parametrize("name, other", [
+    ("last tone 400->450Hz", tones(TONES[:-1] + [450])),
+    ("middle tone 800->850Hz", tones([400, 600, 850, 500, 700, 400])),
+    ("two tones swapped", tones([400, 600, 500, 800, 700, 400])),
+])
+def test_one_segment_different_does_not_match(name, other):
+    assert similarity(CLIP, other) < THRESHOLD, name
+
+
+def test_speech_with_replaced_segment_does_not_match():
+    changed = replaced_segment(SPEECH, len(SPEECH) // 2, RATE // 4)
+    assert similarity(SPEECH, changed) < THRESHOLD
+    assert similarity(SPEECH, speech_like(4)) < THRESHOLD
+
+
+def test_lookup_near_hit_and_miss(tmp_path):
+    cache = FingerprintCache(str(tmp_path / "index"), threshold=THRESHOLD)
+    original = write_wav(tmp_path / "original.wav", CLIP)
+    lookup = cache.lookup(original, "hash-original", "model|vi|transcribe", 3.0)
+    assert lookup.match is None
+    cache.store(lookup, "xin chào")
+
+    noisy = write_wav(tmp_path / "noisy.wav", add_noise(CLIP, 30))
+    hit = cache.lookup(noisy, "hash-noisy", "model|vi|transcribe", 3.0)
+    assert (hit.match, hit.text) == ("near", "xin chào")
+
+    # Cùng audio nhưng tham số khác, và audio chỉ khác tone cuối: không khớp
+    assert cache.lookup(noisy, "hash-noisy", "model|en|transcribe", 3.0).match is None
+    changed = write_wav(tmp_path / "changed.wav", tones(TONES[:-1] + [450]))
+    assert cache.lookup(changed, "hash-changed", "model|vi|transcribe", 3.0).match is None
+
+    exact = cache.lookup(original, "hash-original", "model|vi|transcribe", 3.0)
+    assert (exact.match, exact.similarity) == ("exact", 1.0)
+
+
+def test_index_survives_restart(tmp_path):
+    directory = str(tmp_path / "index")
+    cache = FingerprintCache(directory)
+    cache.store(CacheLookup("hash", "params", compute_fingerprint(CLIP, RATE)), "text")
+    cache.save()
+
+    reloaded = FingerprintCache(directory)
+    path = write_wav(tmp_path / "clip.wav", CLIP)
+    assert reloaded.lookup(path, "other-hash", "params", 3.0).text == "text"
+
+
+def test_params_keys_are_bounded(tmp_path):
+    cache = FingerprintCache(str(tmp_path / "index"), capacity=2, max_params=2)
+    cache.store(CacheLookup("a", "model|vi|transcribe"), "a")
+    cache.store(CacheLookup("b", "model|en|transcribe"), "b")
+    # Đủ khoá: language tuỳ ý từ client không làm index phình ra
+    cache.store(CacheLookup("c", "model|xx-1|transcribe"), "c")
+    assert len(cache._params_names) == 2
+    assert cache.lookup("/nonexistent.wav", "c", "model|xx-1|transcribe", 3.0).text is None
+
+    # Entry "a" bị thay bằng entry cùng khoá "en": khoá "vi" không còn entry nên được dùng lại
+    cache.store(CacheLookup("d", "model|en|transcribe"), "d")
+    cache.store(CacheLookup("e", "model|fr|transcribe"), "e")
+    assert sorted(cache._params_names) == ["model|en|transcribe", "model|fr|transcribe"]
+    assert cache.lookup("/nonexistent.wav", "e", "model|fr|transcribe", 3.0).text == "e"
+    assert cache.lookup("/nonexistent.wav", "d", "model|en|transcribe", 3.0).text == "d"
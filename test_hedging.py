@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test hedged requests với upstream giả lập bằng coroutine: hedge chỉ chạy khi request gốc chậm
+hơn percentile, bị giới hạn bởi budget, và latency của request lỗi không vào cửa sổ percentile.
+"""
+
+import asyncio
+
+import pytest
+
+from hedging import HedgeBudget, HedgedRequester
+
+FAST = 0.01
+SLOW = 0.5
+
+
+class Upstream:
+    """Upstream giả: trả kết quả sau `delay` giây hoặc raise ngay, ghi lại các lần gọi bị huỷ"""
+
+    def __init__(self, name, delay=FAST, error=None):
+        self.name = name
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+        self.cancelled = 0
+
+    async def __call__(self):
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if self.error is not None:
+            raise self.error
+        return self.name
+
+
+def warmed_requester(**kwargs) -> HedgedRequester:
+    """Requester đã đủ mẫu latency nhanh, hedge sau min_delay"""
+    requester = HedgedRequester(min_delay=0.05, min_samples=5, **kwargs)
+    for _ in range(5):
+        requester.record(FAST)
+    return requester
+
+
+def test_budget_refills_by_ratio_up_to_burst():
+    budget = HedgeBudget(ratio=0.5, burst=2)
+    assert budget.withdraw() and budget.withdraw()
+    assert not budget.withdraw()
+
+    budget.deposit()
+    assert not budget.withdraw()
+    budget.deposit()
+    assert budget.withdraw()
+
+    for _ in range(10):
+        budget.deposit()
+    assert budget.tokens == 2
+
+
+def test_no_hedge_before_min_samples():
+    requester = HedgedRequester(min_delay=0.01, min_samples=5)
+    primary, hedge = Upstream("primary", delay=0.05), Upstream("hedge")
+    assert asyncio.run(requester.run(primary, hedge)) == "primary"
+    assert hedge.calls == 0
+    assert requester.stats()["samples"] == 1
+
+
+def test_fast_primary_is_not_hedged():
+    requester = warmed_requester()
+    primary, hedge = Upstream("primary"), Upstream("hedge")
+    assert asyncio.run(requester.run(primary, hedge)) == "primary"
+    assert hedge.calls == 0
+    assert requester.stats()["hedged"] == 0
+
+
+def test_slow_primary_is_hedged_and_cancelled():
+    requester = warmed_requester(budget_ratio=0.1, budget_burst=2)
+    primary, hedge = Upstream("primary", delay=SLOW), Upstream("hedge")
+    assert asyncio.run(requester.run(primary, hedge)) == "hedge"
+    assert primary.cancelled == 1
+
+    stats = requester.stats()
+    assert (stats["requests"], stats["hedged"], stats["hedge_wins"]) == (1, 1, 1)
+    # Nạp 0.1 khi request đến (đã đầy nên giữ 2), tốn 1 khi hedge
+    assert stats["budget_tokens"] == 1
+    assert stats["samples"] == 6
+
+
+def test_hedges_stop_when_budget_is_spent():
+    requester = warmed_requester(budget_ratio=0, budget_burst=1)
+
+    async def run_twice():
+        results = []
+        for _ in range(2):
+            results.append(await requester.run(Upstream("primary", delay=0.2), Upstream("hedge")))
+        return results
+
+    assert asyncio.run(run_twice()) == ["hedge", "primary"]
+    stats = requester.stats()
+    assert (stats["hedged"], stats["skipped_budget"], stats["hedge_rate"]) == (1, 1, 0.5)
+
+
+def test_failed_hedge_falls_back_to_primary():
+    requester = warmed_requester()
+    primary = Upstream("primary", delay=0.2)
+    hedge = Upstream("hedge", error=RuntimeError("503"))
+    assert asyncio.run(requester.run(primary, hedge)) == "primary"
+    assert requester.stats()["hedge_wins"] == 0
+
+
+def test_failures_are_not_recorded():
+    requester = warmed_requester()
+    delay = requester.hedge_delay()
+
+    # 503/429 trả về ngay: không được kéo percentile xuống
+    with pytest.raises(RuntimeError, match="429"):
+        asyncio.run(requester.run(Upstream("primary", error=RuntimeError("429")), Upstream("hedge")))
+    assert requester.stats()["samples"] == 5
+    assert requester.hedge_delay() == delay
+
+    # Cả hai đều lỗi: raise lỗi của request gốc
+    primary = Upstream("primary", delay=0.2, error=RuntimeError("primary failed"))
+    hedge = Upstream("hedge", error=RuntimeError("hedge failed"))
+    with pytest.raises(RuntimeError, match="primary failed"):
+        asyncio.run(requester.run(primary, hedge))
+    assert requester.stats()["samples"] == 5
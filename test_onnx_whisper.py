@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test export/quantize graph ONNX: khi EXPORT_VERSION đổi, graph float32 được export lại
+và graph int8 cũng phải được quantize lại thay vì load bản int8 cũ.
+Dùng model Whisper nhỏ khởi tạo ngẫu nhiên nên không cần tải model từ HF.
+"""
+
+import json
+import os
+
+import pytest
+import torch
+from transformers import WhisperConfig, WhisperForConditionalGeneration
+
+import onnx_whisper
+from onnx_whisper import OnnxWhisperConnection
+
+
+def tiny_model() -> WhisperForConditionalGeneration:
+    torch.manual_seed(0)
+    config = WhisperConfig(
+        vocab_size=100,
+        pad_token_id=0,
+        bos_token_id=1,
+        eos_token_id=2,
+        decoder_start_token_id=3,
+        num_mel_bins=80,
+        d_model=16,
+        encoder_layers=1,
+        decoder_layers=1,
+        encoder_attention_heads=2,
+        decoder_attention_heads=2,
+        encoder_ffn_dim=32,
+        decoder_ffn_dim=32,
+        max_source_positions=50,
+        max_target_positions=64,
+    )
+    return WhisperForConditionalGeneration(config).eval()
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    """Engine không qua __init__, export từ model nhỏ thay vì tải từ HF"""
+    exports = []
+
+    def from_pretrained(name, *args, **kwargs):
+        exports.append(name)
+        return tiny_model()
+
+    monkeypatch.setattr(WhisperForConditionalGeneration, "from_pretrained", from_pretrained)
+    engine = OnnxWhisperConnection.__new__(OnnxWhisperConnection)
+    engine.model_name = "tiny-random"
+    engine.model_dir = str(tmp_path / "onnx")
+    engine.quantize = True
+    engine.exports = exports
+    return engine
+
+
+def int8_version(engine) -> int:
+    with open(os.path.join(engine.model_dir, "int8.json")) as f:
+        return json.load(f)["export_version"]
+
+
+def test_export_and_quantize_once(engine):
+    engine._ensure_exported()
+    assert engine.exports == ["tiny-random"]
+    assert int8_version(engine) == onnx_whisper.EXPORT_VERSION
+    quantized_at = os.path.getmtime(os.path.join(engine.model_dir, "decoder.int8.onnx"))
+
+    engine._ensure_exported()
+    assert engine.exports == ["tiny-random"]
+    assert os.path.getmtime(os.path.join(engine.model_dir, "decoder.int8.onnx")) == quantized_at
+
+
+def test_version_bump_requantizes(engine, monkeypatch):
+    engine._ensure_exported()
+    os.utime(os.path.join(engine.model_dir, "decoder.int8.onnx"), (0, 0))
+
+    monkeypatch.setattr(onnx_whisper, "EXPORT_VERSION", onnx_whisper.EXPORT_VERSION + 1)
+    engine._ensure_exported()
+    assert len(engine.exports) == 2
+    assert int8_version(engine) == onnx_whisper.EXPORT_VERSION
+    assert os.path.getmtime(os.path.join(engine.model_dir, "decoder.int8.onnx")) > 0
+
+
+def test_int8_without_version_is_requantized(engine):
+    # Graph int8 tạo trước khi có int8.json: không biết từ bản export nào nên quantize lại
+    engine._ensure_exported()
+    os.remove(os.path.join(engine.model_dir, "int8.json"))
+    os.utime(os.path.join(engine.model_dir, "decoder.int8.onnx"), (0, 0))
+
+    engine._ensure_exported()
+    assert engine.exports == ["tiny-random"]
+    assert int8_version(engine) == onnx_whisper.EXPORT_VERSION
+    assert os.path.getmtime(os.path.join(engine.model_dir, "decoder.int8.onnx")) > 0
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test pipeline nhiều stage với engine giả (không cần model): kết quả đúng thứ tự request,
+preprocessing chạy song song với decoder, lỗi trả về "Error: ..." như transcribe() của engine.
+"""
+
+import threading
+import time
+
+import pytest
+
+from pipeline import build_whisper_pipeline
+
+
+class FakeEngine:
+    """Engine giả: mỗi stage biến đổi text để kiểm tra dữ liệu đi đúng qua các stage"""
+
+    def __init__(self, decode_seconds=0.0):
+        self.decode_seconds = decode_seconds
+        self.decoding = threading.Event()
+        self.features_while_decoding = 0
+
+    def load_audio(self, path):
+        return None if path.startswith("missing") else path
+
+    def extract_features(self, audio):
+        if self.decoding.is_set():
+            self.features_while_decoding += 1
+        if audio == "broken":
+            raise RuntimeError("bad features")
+        return f"features({audio})"
+
+    def encode(self, features):
+        return f"encoded({features})"
+
+    def decode(self, encoded, language=None, task="transcribe", profile=None):
+        self.decoding.set()
+        time.sleep(self.decode_seconds)
+        self.decoding.clear()
+        return f"{encoded}|{language}|{task}"
+
+    def postprocess(self, ids):
+        return ids.upper()
+
+
+@pytest.fixture
+def engine():
+    return FakeEngine(decode_seconds=0.05)
+
+
+@pytest.fixture
+def pipeline(engine):
+    pipeline = build_whisper_pipeline(engine, queue_size=2)
+    yield pipeline
+    pipeline.close()
+
+
+def test_results_match_requests(pipeline):
+    futures = [pipeline.submit(f"clip{i}", language="vi") for i in range(6)]
+    assert [future.result(timeout=5) for future in futures] == [
+        f"ENCODED(FEATURES(CLIP{i}))|VI|TRANSCRIBE" for i in range(6)
+    ]
+    assert pipeline.transcribe("clip", task="translate") == "ENCODED(FEATURES(CLIP))|NONE|TRANSLATE"
+
+
+def test_preprocessing_overlaps_decoder(pipeline, engine):
+    futures = [pipeline.submit(f"clip{i}") for i in range(6)]
+    for future in futures:
+        future.result(timeout=5)
+    assert engine.features_while_decoding > 0
+
+    stats = pipeline.stats()
+    assert stats["completed"] == 6
+    assert stats["stages"]["decoder"]["processed"] == 6
+    assert stats["stages"]["decoder"]["utilisation"] > 0
+
+
+def test_errors_are_returned_like_engines(pipeline):
+    assert pipeline.transcribe("missing.wav") == "Error: Cannot load audio file: missing.wav"
+    assert pipeline.transcribe("broken") == "Error: bad features"
+
+    # submit() giữ lỗi trong Future
+    with pytest.raises(RuntimeError, match="bad features"):
+        pipeline.submit("broken").result(timeout=5)
+
+    # Worker vẫn chạy sau lỗi, request lỗi không tính vào latency
+    assert pipeline.transcribe("clip") == "ENCODED(FEATURES(CLIP))|NONE|TRANSCRIBE"
+    stats = pipeline.stats()
+    assert stats["completed"] == 1
+    assert stats["stages"]["feature_extraction"]["failed"] == 2
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test /transcribe-raw: kiểm tra Content-Type/kích thước/body rỗng, đường ghi file tạm và
+pass-through tới HF API (giả lập bằng httpx.MockTransport) khi bật HF_PASSTHROUGH.
+"""
+
+import asyncio
+import base64
+import io
+import json
+import wave
+
+import httpx
+import pytest
+
+import app as appmod
+from lightweight_whisper import LightweightWhisperService
+from scheduler import InferenceScheduler
+
+
+def wav_bytes(seconds: float = 1.0, rate: int = 16000) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(bytes(range(256)) * int(seconds * rate * 2 // 256))
+    return buffer.getvalue()
+
+
+class EchoHF:
+    """HF API giả: ghi lại body nhận được, trả về số byte audio"""
+
+    def __init__(self):
+        self.bodies = []
+        self.content_types = []
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        body = await request.aread()
+        self.bodies.append(body)
+        self.content_types.append(request.headers.get("content-type"))
+        return httpx.Response(200, json={"text": f"{len(body)} bytes"})
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    echo = EchoHF()
+    service = LightweightWhisperService()
+    service.client = httpx.AsyncClient(transport=httpx.MockTransport(echo))
+    monkeypatch.setattr(appmod, "whisper_model", service)
+    monkeypatch.setattr(appmod, "admission", None)
+    monkeypatch.setattr(appmod, "result_cache", None)
+    monkeypatch.setattr(appmod, "scheduler", InferenceScheduler(concurrency=1))
+    monkeypatch.setattr(appmod, "passthrough_uploads", asyncio.Semaphore(2))
+    monkeypatch.setattr(appmod, "PASSTHROUGH_ENABLED", False)
+    return echo
+
+
+def post(content, headers=None, params=None):
+    async def run():
+        transport = httpx.ASGITransport(app=appmod.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post("/transcribe-raw", content=content, params=params,
+                                     headers={"content-type": "audio/wav", **(headers or {})})
+    return asyncio.run(run())
+
+
+async def slow_body(data: bytes, parts: int = 5, delay: float = 0.05, on_chunk=None):
+    """Body upload từng phần như client mạng chậm"""
+    step = len(data) // parts + 1
+    for start in range(0, len(data), step):
+        await asyncio.sleep(delay)
+        if on_chunk is not None:
+            on_chunk()
+        yield data[start:start + step]
+
+
+@pytest.mark.parametrize("passthrough", [False, True])
+def test_rejects_wrong_content_type(upstream, monkeypatch, passthrough):
+    monkeypatch.setattr(appmod, "PASSTHROUGH_ENABLED", passthrough)
+    response = post(wav_bytes(), headers={"content-type": "text/plain"})
+    assert response.status_code == 415
+    assert upstream.bodies == []
+
+
+@pytest.mark.parametrize("passthrough", [False, True])
+def test_rejects_oversized_body(upstream, monkeypatch, passthrough):
+    monkeypatch.setattr(appmod, "PASSTHROUGH_ENABLED", passthrough)
+    monkeypatch.setattr(appmod, "MAX_FILE_SIZE", 10_000)
+    data = wav_bytes()
+
+    # Content-Length đã vượt quá giới hạn: từ chối trước khi đọc body
+    assert post(data).status_code == 413
+    # Không có Content-Length: dừng đọc khi vượt quá giới hạn
+    assert post(slow_body(data, delay=0)).status_code == 413
+    assert upstream.bodies == []
+
+
+@pytest.mark.parametrize("passthrough", [False, True])
+def test_rejects_empty_body(upstream, monkeypatch, passthrough):
+    monkeypatch.setattr(appmod, "PASSTHROUGH_ENABLED", passthrough)
+    assert post(b"").status_code == 400
+    assert post(slow_body(b"", parts=1, delay=0)).status_code == 400
+    assert upstream.bodies == []
+
+
+def test_rejects_unsupported_extension(upstream):
+    response = post(wav_bytes(), headers={"x-filename": "notes.txt"})
+    assert response.status_code == 400
+    assert upstream.bodies == []
+
+
+def test_spooled_upload_sends_whole_file(upstream):
+    data = wav_bytes()
+    response = post(data, headers={"x-filename": "clip.wav"})
+    assert response.status_code == 200
+    result = response.json()
+    assert result["transcription"] == f"{len(data)} bytes"
+    assert (result["filename"], result["file_size"], result["audio_duration"]) == ("clip.wav", len(data), 1.0)
+    assert "passthrough" not in result
+    assert upstream.bodies == [data]
+
+
+def test_passthrough_keeps_upload_out_of_scheduler(upstream, monkeypatch):
+    monkeypatch.setattr(appmod, "PASSTHROUGH_ENABLED", True)
+    scheduler = appmod.scheduler
+    running_during_upload = set()
+    data = wav_bytes()
+
+    body = slow_body(data, on_chunk=lambda: running_during_upload.add(scheduler._running))
+    response = post(body, headers={"content-length": str(len(data))})
+    assert response.status_code == 200
+    result = response.json()
+    assert result["passthrough"] is True
+    assert result["transcription"] == f"{len(data)} bytes"
+    assert upstream.bodies == [data]
+
+    # Slot chỉ được lấy sau khi upload xong, processing_time không gồm 5 x 50ms upload
+    assert running_during_upload == {0}
+    assert result["processing_time"] < 0.1
+    assert scheduler._running == 0
+
+
+def test_passthrough_with_language_sends_json(upstream, monkeypatch):
+    monkeypatch.setattr(appmod, "PASSTHROUGH_ENABLED", True)
+    data = wav_bytes()
+    response = post(data, params={"language": "vi"})
+    assert response.json()["passthrough"] is True
+
+    payload = json.loads(upstream.bodies[0])
+    assert base64.b64decode(payload["inputs"]) == data
+    assert payload["parameters"]["generate_kwargs"] == {"language": "vi", "task": "transcribe"}
+    assert upstream.content_types == ["application/json"]
+
+
+def test_passthrough_needs_content_length(upstream, monkeypatch):
+    monkeypatch.setattr(appmod, "PASSTHROUGH_ENABLED", True)
+    data = wav_bytes()
+    response = post(slow_body(data, delay=0))
+    assert response.status_code == 200
+    assert "passthrough" not in response.json()
+    assert upstream.bodies == [data]
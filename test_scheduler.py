@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test scheduler: job ngắn chạy trước job dài (SJF), priority của client, aging để job dài
+không bị bỏ đói, và job bị huỷ khi đang chờ không giữ slot.
+Phần end-to-end gửi request thật qua app với HF API giả lập ghi lại thứ tự nhận request.
+"""
+
+import asyncio
+import io
+import types
+import wave
+
+import httpx
+import pytest
+
+import app as appmod
+import scheduler as scheduler_module
+from lightweight_whisper import LightweightWhisperService
+from scheduler import InferenceScheduler
+
+
+async def run_order(scheduler: InferenceScheduler, jobs: list) -> list:
+    """Giữ slot duy nhất, xếp các job (tên, cost, priority) vào hàng đợi rồi trả về thứ tự được chạy"""
+    order = []
+
+    async def job(name, cost, priority):
+        async with scheduler.slot(cost, priority):
+            order.append(name)
+
+    await scheduler.acquire(0)
+    tasks = []
+    for name, cost, priority in jobs:
+        tasks.append(asyncio.create_task(job(name, cost, priority)))
+        await asyncio.sleep(0)
+    scheduler.release()
+    await asyncio.gather(*tasks)
+    return order
+
+
+def test_shortest_job_first():
+    scheduler = InferenceScheduler(concurrency=1)
+    jobs = [("long", 300, 0), ("short", 5, 0), ("medium", 60, 0)]
+    assert asyncio.run(run_order(scheduler, jobs)) == ["short", "medium", "long"]
+    assert scheduler.stats()["scheduled"] == 4
+
+
+def test_priority_outweighs_cost():
+    scheduler = InferenceScheduler(concurrency=1, priority_weight=30)
+    # 100 - 5 * 30 = -50 < 5
+    jobs = [("short", 5, 0), ("urgent-long", 100, 5), ("background", 1, -1)]
+    assert asyncio.run(run_order(scheduler, jobs)) == ["urgent-long", "short", "background"]
+
+
+@pytest.mark.parametrize("short_arrives_after, expected", [
+    (10, ["short", "long"]),
+    (300, ["long", "short"]),
+])
+def test_aging_lets_long_jobs_through(monkeypatch, short_arrives_after, expected):
+    """Job dài (cost 100) đã chờ đủ lâu thì chạy trước job ngắn mới tới (aging_rate 0.5)"""
+    clock = {"now": 1000.0}
+    monkeypatch.setattr(scheduler_module, "time", types.SimpleNamespace(monotonic=lambda: clock["now"]))
+    scheduler = InferenceScheduler(concurrency=1, aging_rate=0.5)
+
+    async def scenario():
+        order = []
+
+        async def job(name, cost):
+            async with scheduler.slot(cost):
+                order.append(name)
+
+        await scheduler.acquire(0)
+        long_job = asyncio.create_task(job("long", 100))
+        await asyncio.sleep(0)
+        clock["now"] += short_arrives_after
+        short_job = asyncio.create_task(job("short", 5))
+        await asyncio.sleep(0)
+        scheduler.release()
+        await asyncio.gather(long_job, short_job)
+        return order
+
+    assert asyncio.run(scenario()) == expected
+
+
+def test_cancelled_waiter_does_not_hold_slot():
+    scheduler = InferenceScheduler(concurrency=1)
+
+    async def scenario():
+        await scheduler.acquire(0)
+        waiter = asyncio.create_task(scheduler.acquire(5))
+        await asyncio.sleep(0)
+        assert scheduler.stats()["waiting"] == 1
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert scheduler.stats()["waiting"] == 0
+        scheduler.release()
+        assert scheduler._running == 0
+
+        # Slot vẫn dùng được ngay
+        await asyncio.wait_for(scheduler.acquire(1), timeout=1)
+        scheduler.release()
+
+    asyncio.run(scenario())
+
+
+def wav_bytes(seconds: float, rate=8000) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(b'\0\0' * int(seconds * rate))
+    return buffer.getvalue()
+
+
+class RecordingHF:
+    """HF API giả: request đầu tiên bị giữ lại, các request sau được ghi theo thứ tự tới"""
+
+    def __init__(self):
+        self.release = asyncio.Event()
+        self.received = []
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        body = await request.aread()
+        self.received.append(len(body))
+        if len(self.received) == 1:
+            await self.release.wait()
+        return httpx.Response(200, json={"text": f"{len(body)} bytes"})
+
+
+def test_app_runs_short_uploads_first(monkeypatch):
+    upstream = RecordingHF()
+    service = LightweightWhisperService()
+    service.client = httpx.AsyncClient(transport=httpx.MockTransport(upstream))
+    scheduler = InferenceScheduler(concurrency=1)
+    monkeypatch.setattr(appmod, "whisper_model", service)
+    monkeypatch.setattr(appmod, "scheduler", scheduler)
+    monkeypatch.setattr(appmod, "admission", None)
+    monkeypatch.setattr(appmod, "result_cache", None)
+    monkeypatch.setattr(appmod, "PASSTHROUGH_ENABLED", False)
+    bodies = {name: wav_bytes(seconds) for name, seconds in
+              [("blocker", 1), ("long", 40), ("short", 2), ("medium", 10)]}
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=appmod.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            async def post(name):
+                return await client.post("/transcribe-raw", content=bodies[name],
+                                         headers={"content-type": "audio/wav"})
+
+            tasks = [asyncio.create_task(post("blocker"))]
+            while not upstream.received:
+                await asyncio.sleep(0.01)
+            for name in ("long", "short", "medium"):
+                tasks.append(asyncio.create_task(post(name)))
+            while scheduler.stats()["waiting"] < 3:
+                await asyncio.sleep(0.01)
+            upstream.release.set()
+            return await asyncio.gather(*tasks)
+
+    responses = asyncio.run(scenario())
+    assert all(response.status_code == 200 for response in responses)
+    assert upstream.received == [len(bodies[name]) for name in ("blocker", "short", "medium", "long")]
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test tải audio từ URL với HTTP server thật chạy local: chặn địa chỉ nội bộ (kể cả qua redirect),
+URL sai, file quá lớn và server gửi nhỏ giọt quá tổng thời gian cho phép.
+"""
+
+import asyncio
+import http.server
+import os
+import threading
+import time
+from urllib.parse import urlparse
+
+import pytest
+
+from url_fetch import AudioFetcher, AudioFetchError
+
+BODY = b'RIFF' + b'\0' * 4096
+
+
+class AudioHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == '/redirect-external':
+            self.send_response(302)
+            self.send_header('Location', 'http://evil.example/audio.wav')
+            self.end_headers()
+        elif self.path == '/redirect-local':
+            self.send_response(302)
+            self.send_header('Location', '/audio.wav')
+            self.end_headers()
+        elif self.path == '/redirect-metadata':
+            self.send_response(302)
+            self.send_header('Location', 'http://169.254.169.254/latest/meta-data')
+            self.end_headers()
+        elif self.path == '/trickle.wav':
+            # Mỗi lần đọc đều nhanh hơn read timeout nhưng cả file thì không bao giờ xong
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(BODY)))
+            self.end_headers()
+            for byte in BODY:
+                self.wfile.write(bytes([byte]))
+                self.wfile.flush()
+                time.sleep(0.05)
+        else:
+            self.send_response(200)
+            self.send_header('Content-Type', 'audio/wav')
+            self.send_header('Content-Length', str(len(BODY)))
+            self.end_headers()
+            self.wfile.write(BODY)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def base_url():
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), AudioHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+def fetch(url, public_hosts=(), **kwargs):
+    """public_hosts: coi các host local này như host public (server test chạy trên loopback)"""
+    async def run():
+        fetcher = AudioFetcher(**kwargs)
+        resolve = fetcher._resolve
+
+        async def resolve_public(target):
+            host = urlparse(target).hostname
+            return host if host in public_hosts else await resolve(target)
+
+        fetcher._resolve = resolve_public
+        try:
+            return await fetcher.fetch(url)
+        finally:
+            await fetcher.close()
+    return asyncio.run(run())
+
+
+def fetch_error(url, **kwargs) -> AudioFetchError:
+    with pytest.raises(AudioFetchError) as error:
+        fetch(url, **kwargs)
+    return error.value
+
+
+def test_loopback_is_rejected_by_default(base_url):
+    assert fetch_error(f"{base_url}/audio.wav").status_code == 403
+
+
+@pytest.mark.parametrize("url", [
+    "http://169.254.169.254/latest/meta-data",
+    "http://10.0.0.1/audio.wav",
+    "http://[::1]/audio.wav",
+    "http://[::ffff:127.0.0.1]/audio.wav",
+])
+def test_private_addresses_are_rejected(url):
+    assert fetch_error(url).status_code == 403
+
+
+@pytest.mark.parametrize("url", [
+    "ftp://example.com/audio.wav",
+    "http:///audio.wav",
+    "http://example.com:99999/audio.wav",
+    "http://example.com:abc/audio.wav",
+])
+def test_invalid_urls_are_rejected(url):
+    assert fetch_error(url).status_code == 400
+
+
+def test_redirect_targets_are_checked_again(base_url):
+    # Host ban đầu được phép, host sau redirect thì không
+    error = fetch_error(f"{base_url}/redirect-external", allow_private=True, allowed_hosts=['127.0.0.1'])
+    assert error.status_code == 403
+
+    # Host ban đầu hợp lệ, redirect sang metadata endpoint (link-local) bị chặn
+    error = fetch_error(f"{base_url}/redirect-metadata", public_hosts=['127.0.0.1'])
+    assert error.status_code == 403
+    assert "169.254.169.254" in error.detail
+
+
+def test_download_follows_allowed_redirect(base_url):
+    audio = fetch(f"{base_url}/redirect-local", allow_private=True)
+    try:
+        assert audio.size == len(BODY)
+        assert audio.extension == '.wav'
+        with open(audio.path, 'rb') as f:
+            assert f.read() == BODY
+    finally:
+        audio.cleanup()
+    assert not os.path.exists(audio.path)
+
+
+def test_too_large_download_is_rejected(base_url):
+    assert fetch_error(f"{base_url}/audio.wav", allow_private=True, max_bytes=1024).status_code == 413
+
+
+def test_total_timeout_stops_trickling_server(base_url):
+    started = time.monotonic()
+    error = fetch_error(f"{base_url}/trickle.wav", allow_private=True, read_timeout=5, total_timeout=0.5)
+    assert error.status_code == 504
+    assert time.monotonic() - started < 3
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tracing theo từng request: trace id, span lồng nhau và structured JSON logs
+Dùng contextvars nên trace đi theo request qua async code và asyncio.to_thread
+"""
+
+import contextvars
+import json
+import logging
+import os
+import re
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Optional
+
+_current_trace = contextvars.ContextVar('current_trace', default=None)
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+_TRACE_ID_PATTERN = re.compile(r'^[A-Za-z0-9_\-]{1,64}$')
+
+
+class Span:
+    """Một giai đoạn trong pipeline xử lý request"""
+
+    __slots__ = ('name', 'start', 'end', 'children')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.start = time.perf_counter()
+        self.end = None
+        self.children = []
+
+    def to_dict(self, origin: float) -> dict:
+        end = self.end if self.end is not None else time.perf_counter()
+        result = {
+            "name": self.name,
+            "start_ms": round((self.start - origin) * 1000, 2),
+            "duration_ms": round((end - self.start) * 1000, 2),
+        }
+        if self.children:
+            result["children"] = [child.to_dict(origin) for child in list(self.children)]
+        return result
+
+
+class Trace:
+    """Trace của một request, gốc của cây span"""
+
+    def __init__(self, trace_id: str):
+        self.trace_id = trace_id
+        self.root = Span("request")
+
+    def finish(self):
+        self.root.end = time.perf_counter()
+
+    def to_dict(self) -> dict:
+        root = self.root.to_dict(self.root.start)
+        return {
+            "trace_id": self.trace_id,
+            "total_ms": root["duration_ms"],
+            "spans": root.get("children", []),
+        }
+
+
+def extract_trace_id(headers) -> str:
+    """Lấy trace id từ X-Request-ID hoặc W3C traceparent, nếu không có thì tạo mới"""
+    request_id = headers.get("x-request-id")
+    if request_id and _TRACE_ID_PATTERN.match(request_id):
+        return request_id
+
+    traceparent = headers.get("traceparent")
+    if traceparent:
+        parts = traceparent.split("-")
+        if len(parts) >= 2 and _TRACE_ID_PATTERN.match(parts[1]):
+            return parts[1]
+
+    return uuid.uuid4().hex
+
+
+def start_trace(trace_id: str) -> Trace:
+    """Bắt đầu trace cho context hiện tại (gọi ở middleware)"""
+    trace = Trace(trace_id)
+    _current_trace.set(trace)
+    _current_span.set(trace.root)
+    return trace
+
+
+def current_trace() -> Optional[Trace]:
+    """Trace của request hiện tại (None nếu ngoài request)"""
+    return _current_trace.get()
+
+
+def current_trace_id() -> Optional[str]:
+    trace = _current_trace.get()
+    return trace.trace_id if trace is not None else None
+
+
+def elapsed_since_start() -> float:
+    """Số giây từ lúc bắt đầu request hiện tại (0 nếu ngoài request)"""
+    trace = _current_trace.get()
+    if trace is None:
+        return 0.0
+    return time.perf_counter() - trace.root.start
+
+
+def record_since_start(name: str):
+    """
+    Ghi một span từ lúc bắt đầu request tới hiện tại
+
+    Dùng cho phần việc xảy ra trước handler, ví dụ FastAPI parse multipart upload.
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        return
+    parsed = Span(name)
+    parsed.start = trace.root.start
+    parsed.end = time.perf_counter()
+    trace.root.children.append(parsed)
+
+
+@contextmanager
+def span(name: str):
+    """
+    Đo thời gian một giai đoạn, lồng vào span đang mở
+
+    Không làm gì nếu không có trace (ví dụ khi engine chạy như script độc lập).
+    """
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+
+    child = Span(name)
+    parent.children.append(child)
+    token = _current_span.set(child)
+    try:
+        yield child
+    finally:
+        child.end = time.perf_counter()
+        _current_span.reset(token)
+
+
+class JsonFormatter(logging.Formatter):
+    """Format log record thành một dòng JSON có trace_id"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "timestamp": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        trace_id = getattr(record, "trace_id", None) or current_trace_id()
+        if trace_id:
+            entry["trace_id"] = trace_id
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def setup_logging(level: int = logging.INFO):
+    """
+    Cấu hình root logger
+
+    LOG_FORMAT=json (mặc định) cho structured logs, LOG_FORMAT=text cho format cũ.
+    """
+    if os.environ.get('LOG_FORMAT', 'json').lower() == 'text':
+        logging.basicConfig(level=level)
+        return
+
+    handler = logging.StreamHandler()
+    handler.setFormatter(JsonFormatter())
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(level)
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tải audio từ URL (object storage, CDN, ...) để transcribe trực tiếp
+Client không cần tải về rồi upload lại qua multipart
+"""
+
+import asyncio
+import ipaddress
+import os
+import socket
+from typing import Optional
+from urllib.parse import urljoin, urlparse
+
+import httpx
+
+from audio_stream import AudioTooLargeError, SpooledAudio, extension_for_content_type, spool_audio
+from tracing import span
+
+
+class AudioFetchError(Exception):
+    """Lỗi khi tải audio từ URL, kèm HTTP status trả về cho client"""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class AudioFetcher:
+    """
+    Tải audio qua một httpx.AsyncClient dùng chung (connection pool)
+
+    Body được stream thẳng vào file tạm, đồng thời kiểm tra kích thước
+    và tính sha256, không giữ toàn bộ file trong memory.
+    """
+
+    def __init__(self,
+                 max_bytes: int = 25 * 1024 * 1024,
+                 connect_timeout: float = 5.0,
+                 read_timeout: float = 30.0,
+                 max_connections: int = 20,
+                 allowed_hosts: Optional[list] = None,
+                 chunk_size: int = 64 * 1024,
+                 max_redirects: int = 5,
+                 allow_private: bool = False,
+                 total_timeout: float = 120.0):
+        """
+        Args:
+            allowed_hosts (Optional[list]): Chỉ cho phép các host này (và subdomain), rỗng = mọi host
+            max_redirects (int): Số redirect tối đa, mỗi bước đều được kiểm tra lại
+            allow_private (bool): Cho phép tải từ địa chỉ nội bộ (loopback, private, link-local, ...)
+            total_timeout (float): Thời gian tối đa cho cả lần tải (read_timeout chỉ tính từng lần đọc,
+                server gửi nhỏ giọt vẫn có thể giữ connection rất lâu)
+        """
+        self.max_bytes = max_bytes
+        self.total_timeout = total_timeout
+        self.allowed_hosts = allowed_hosts or []
+        self.chunk_size = chunk_size
+        self.max_redirects = max_redirects
+        self.allow_private = allow_private
+        # Redirect được xử lý thủ công trong fetch() để kiểm tra từng bước
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=max_connections,
+                                max_keepalive_connections=max_connections),
+            follow_redirects=False,
+        )
+
+    def _validate_url(self, url: str):
+        try:
+            parsed = urlparse(url)
+            parsed.port  # Port ngoài 0-65535 hoặc không phải số raise ValueError
+        except ValueError:
+            raise AudioFetchError(400, f"URL không hợp lệ: {url}")
+        if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+            raise AudioFetchError(400, f"URL không hợp lệ: {url}")
+        if self.allowed_hosts:
+            host = parsed.hostname.lower()
+            if not any(host == allowed or host.endswith('.' + allowed) for allowed in self.allowed_hosts):
+                raise AudioFetchError(403, f"Host không được phép: {parsed.hostname}")
+
+    async def _resolve(self, url: str) -> str:
+        """
+        Phân giải host của URL và trả về địa chỉ IP sẽ kết nối tới
+
+        Raises:
+            AudioFetchError: Khi host trỏ tới địa chỉ nội bộ (trừ khi allow_private)
+        """
+        parsed = urlparse(url)
+        port = parsed.port or (443 if parsed.scheme == 'https' else 80)
+        try:
+            infos = await asyncio.get_running_loop().getaddrinfo(
+                parsed.hostname, port, type=socket.SOCK_STREAM
+            )
+        except socket.gaierror:
+            raise AudioFetchError(502, f"Không phân giải được host: {parsed.hostname}")
+
+        addresses = [info[4][0] for info in infos]
+        if not self.allow_private:
+            for address in addresses:
+                ip = ipaddress.ip_address(address.split('%')[0])
+                if ip.version == 6 and ip.ipv4_mapped is not None:
+                    ip = ip.ipv4_mapped
+                if not ip.is_global:
+                    raise AudioFetchError(403, f"Host không được phép: {parsed.hostname}")
+        return addresses[0]
+
+    def _pinned_request(self, url: str, address: str) -> httpx.Request:
+        """
+        Request tới đúng địa chỉ đã kiểm tra (tránh DNS trả về IP khác khi kết nối)
+
+        Host header và SNI/kiểm tra certificate vẫn dùng hostname gốc.
+        """
+        parsed = urlparse(url)
+        host = f"[{address}]" if ':' in address else address
+        netloc = f"{host}:{parsed.port}" if parsed.port else host
+        extensions = {"sni_hostname": parsed.hostname} if parsed.scheme == 'https' else {}
+        return self.client.build_request(
+            "GET",
+            parsed._replace(netloc=netloc).geturl(),
+            headers={"Host": parsed.netloc.rsplit('@', 1)[-1]},
+            extensions=extensions,
+        )
+
+    @staticmethod
+    def _extension(url: str, content_type: Optional[str]) -> str:
+        extension = os.path.splitext(urlparse(url).path)[1].lower()
+        return extension or extension_for_content_type(content_type)
+
+    async def _fetch(self, url: str) -> SpooledAudio:
+        """Tải theo redirect, mỗi bước đều được kiểm tra lại (allowlist, địa chỉ nội bộ)"""
+        current_url = url
+        for _ in range(self.max_redirects + 1):
+            self._validate_url(current_url)
+            address = await self._resolve(current_url)
+            response = await self.client.send(self._pinned_request(current_url, address), stream=True)
+            try:
+                if response.is_redirect:
+                    location = response.headers.get("location")
+                    if not location:
+                        raise AudioFetchError(502, f"Không tải được {url}: redirect không có Location")
+                    current_url = urljoin(current_url, location)
+                    continue
+
+                if response.status_code != 200:
+                    raise AudioFetchError(502, f"Không tải được {url}: HTTP {response.status_code}")
+
+                content_length = response.headers.get("content-length")
+                if content_length and content_length.isdigit() and int(content_length) > self.max_bytes:
+                    raise AudioTooLargeError(self.max_bytes)
+
+                extension = self._extension(current_url, response.headers.get("content-type"))
+                return await spool_audio(
+                    response.aiter_bytes(self.chunk_size),
+                    extension,
+                    self.max_bytes,
+                    filename=os.path.basename(urlparse(current_url).path) or None,
+                )
+            finally:
+                await response.aclose()
+
+        raise AudioFetchError(502, f"Không tải được {url}: quá nhiều redirect")
+
+    async def fetch(self, url: str) -> SpooledAudio:
+        """
+        Tải audio từ URL vào file tạm
+
+        Args:
+            url (str): URL http(s) của file audio
+
+        Returns:
+            SpooledAudio: Thông tin file đã tải, gọi cleanup() khi dùng xong
+
+        Raises:
+            AudioFetchError: URL không hợp lệ, file quá lớn, lỗi mạng hoặc timeout
+        """
+        try:
+            with span("url_fetch"):
+                async with asyncio.timeout(self.total_timeout):
+                    return await self._fetch(url)
+        except AudioTooLargeError as e:
+            raise AudioFetchError(413, str(e))
+        except (httpx.TimeoutException, TimeoutError):
+            raise AudioFetchError(504, f"Timeout khi tải {url}")
+        except httpx.HTTPError as e:
+            raise AudioFetchError(502, f"Lỗi mạng khi tải {url}: {e}")
+
+    async def close(self):
+        await self.client.aclose()
+
+
+# Singleton pattern
+_audio_fetcher = None
+
+
+def get_audio_fetcher() -> AudioFetcher:
+    """Get audio fetcher instance từ environment variables"""
+    global _audio_fetcher
+    if _audio_fetcher is None:
+        allowed_hosts = os.environ.get('URL_FETCH_ALLOWED_HOSTS', '')
+        _audio_fetcher = AudioFetcher(
+            max_bytes=int(os.environ.get('URL_FETCH_MAX_BYTES', 25 * 1024 * 1024)),
+            connect_timeout=float(os.environ.get('URL_FETCH_CONNECT_TIMEOUT', 5)),
+            read_timeout=float(os.environ.get('URL_FETCH_READ_TIMEOUT', 30)),
+            max_connections=int(os.environ.get('URL_FETCH_MAX_CONNECTIONS', 20)),
+            allowed_hosts=[host.strip().lower() for host in allowed_hosts.split(',') if host.strip()],
+            max_redirects=int(os.environ.get('URL_FETCH_MAX_REDIRECTS', 5)),
+            allow_private=os.environ.get('URL_FETCH_ALLOW_PRIVATE', '0').lower() in ('1', 'true', 'yes'),
+            total_timeout=float(os.environ.get('URL_FETCH_TOTAL_TIMEOUT', 120)),
+        )
+    return _audio_fetcher
@@ -12,10 +12,15 @@ import numpy as np
 from typing import Union, Optional
 import warnings
 
+from tracing import span
+from profiling import torch_operator_profile
+from encoder_cache import LocalWhisperMixin, get_encoder_cache
+from decoding_profiles import DecodingProfile
+
 # Tắt các warning không cần thiết
 warnings.filterwarnings("ignore")
 
-class WhisperConnection:
+class WhisperConnection(LocalWhisperMixin):
     """
     Class để kết nối và sử dụng OpenAI Whisper-small model từ Hugging Face
     """
@@ -43,6 +48,40 @@ class WhisperConnection:
         self.model.to(self.device)
         print("Model đã được tải thành công!")
 
+        # Cache encoder output theo audio (None nếu ENCODER_CACHE_MAX_MB=0)
+        self.encoder_cache = get_encoder_cache()
+
+    def extract_features(self, audio_data: np.ndarray) -> torch.Tensor:
+        """Log-mel features của audio 16kHz (trên CPU)"""
+        return self.processor(
+            audio_data,
+            sampling_rate=16000,
+            return_tensors="pt"
+        ).input_features
+
+    def decode(self, encoder_outputs, language: Optional[str] = None,
+               task: str = "transcribe", profile: Optional[DecodingProfile] = None) -> torch.Tensor:
+        """Chạy decoder (generate) trên encoder output, trả về token ids"""
+        # Thiết lập generation config (profile có thể đổi num_beams, max_new_tokens)
+        generate_kwargs = {"max_new_tokens": 448}
+        if profile is not None:
+            generate_kwargs.update(profile.generate_kwargs())
+        generate_kwargs.update(self.language_kwargs(language, task))
+        generate_kwargs["max_new_tokens"] = self.max_new_tokens(generate_kwargs["max_new_tokens"])
+
+        with torch_operator_profile("generate"), torch.no_grad():
+            return self.model.generate(
+                encoder_outputs=encoder_outputs,
+                **generate_kwargs
+            )
+
+    def postprocess(self, predicted_ids: torch.Tensor) -> str:
+        """Token ids -> text"""
+        return self.processor.batch_decode(
+            predicted_ids,
+            skip_special_tokens=True
+        )[0].strip()
+
     def load_audio(self, audio_path: str, target_sr: int = 16000) -> np.ndarray:
         """
         Load và preprocessing audio file
@@ -64,13 +103,16 @@ class WhisperConnection:
             print(f"Lỗi khi load audio: {e}")
             return None
 
-    def transcribe(self, audio: Union[str, np.ndarray], language: Optional[str] = None) -> str:
+    def transcribe(self, audio: Union[str, np.ndarray], language: Optional[str] = None,
+                   task: str = "transcribe", profile: Optional[DecodingProfile] = None) -> str:
         """
         Chuyển đổi audio thành text
 
         Args:
             audio (Union[str, np.ndarray]): Đường dẫn tới file audio hoặc audio array
             language (Optional[str]): Ngôn ngữ (ví dụ: "vi" cho tiếng Việt, "en" cho tiếng Anh)
+            task (str): "transcribe" hoặc "translate" (dịch sang tiếng Anh)
+            profile (Optional[DecodingProfile]): Tham số decode (num_beams, max_new_tokens)
 
         Returns:
             str: Text đã được transcribe
@@ -78,55 +120,42 @@ class WhisperConnection:
         try:
             # Nếu input là đường dẫn file, load audio
             if isinstance(audio, str):
-                audio_data = self.load_audio(audio)
+                with span("load_audio"):
+                    audio_data = self.load_audio(audio)
                 if audio_data is None:
                     return "Lỗi: Không thể load audio file"
             else:
                 audio_data = audio
 
             # Preprocessing audio
-            inputs = self.processor(
-                audio_data,
-                sampling_rate=16000,
-                return_tensors="pt"
-            )
-
-            # Chuyển input lên device
-            input_features = inputs.input_features.to(self.device)
+            with span("feature_extraction"):
+                input_features = self.extract_features(audio_data)
 
-            # Thiết lập generation config
-            generate_kwargs = {}
-            if language:
-                generate_kwargs["language"] = language
+            # Encoder (dùng lại từ cache nếu audio đã được encode)
+            encoder_outputs = self.encode(input_features)
 
             # Generate transcription
             print("Đang thực hiện transcription...")
-            with torch.no_grad():
-                predicted_ids = self.model.generate(
-                    input_features,
-                    max_new_tokens=448,
-                    **generate_kwargs
-                )
+            with span("generate"):
+                predicted_ids = self.decode(encoder_outputs, language, task, profile)
 
             # Decode kết quả
-            transcription = self.processor.batch_decode(
-                predicted_ids,
-                skip_special_tokens=True
-            )[0]
-
-            return transcription.strip()
+            with span("batch_decode"):
+                return self.postprocess(predicted_ids)
 
         except Exception as e:
             print(f"Lỗi khi transcribe: {e}")
             return f"Lỗi: {e}"
 
-    def transcribe_batch(self, audio_files: list, language: Optional[str] = None) -> list:
+    def transcribe_batch(self, audio_files: list, language: Optional[str] = None,
+                         task: str = "transcribe") -> list:
         """
         Transcribe nhiều file audio cùng lúc
 
         Args:
             audio_files (list): Danh sách đường dẫn tới các file audio
             language (Optional[str]): Ngôn ngữ
+            task (str): "transcribe" hoặc "translate"
 
         Returns:
             list: Danh sách kết quả transcription
@@ -134,7 +163,7 @@ class WhisperConnection:
         results = []
         for i, audio_file in enumerate(audio_files):
             print(f"Đang xử lý file {i+1}/{len(audio_files)}: {audio_file}")
-            result = self.transcribe(audio_file, language)
+            result = self.transcribe(audio_file, language, task)
             results.append({
                 "file": audio_file,
                 "transcription": result